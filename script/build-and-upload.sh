@@ -30,9 +30,6 @@ echo "BUCKET:  ${BUCKET}"
 
 echo ""
 
-echo Building Lambda layer
-${P}/package-lambda-layer-pyopenssl.sh
-
 echo Building Authorizer Lambda function
 ${P}/package-lambda-authorizer.sh
 
@@ -103,9 +100,6 @@ echo Staging files to S3
 aws s3 cp ${P}/../cfn/secretfree.yml \
     s3://${BUCKET}/secretfree.yml
 
-aws s3 cp ${P}/../tarz/lambda-layer-pyopenssl.zip \
-    s3://${BUCKET}/lambda-layer-pyopenssl.zip
-
 aws s3 cp ${P}/../tarz/lambda-authorizer.zip \
     s3://${BUCKET}/lambda-authorizer.zip
 
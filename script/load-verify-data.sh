@@ -39,9 +39,13 @@ for i in {1..5}; do
     fi
 
     echo Registering device [$i] to DynamoDB
-    pubkey=$(base64 --wrap 0 $DEVICES/e2e_$i.pub)
+    # DER SubjectPublicKeyInfo, stored in the binary pubkey_der attribute
+    openssl pkey -pubin -in $DEVICES/e2e_$i.pub -outform DER -out $DEVICES/e2e_$i.der
+    pubkey_der=$(base64 --wrap 0 $DEVICES/e2e_$i.der)
+    # SHA-256 of the DER SubjectPublicKeyInfo, compared by the authorizer
+    fingerprint=$(openssl dgst -sha256 -r $DEVICES/e2e_$i.der | cut -d' ' -f1)
     aws dynamodb put-item --table-name $SKUNAME-iot-provisioning-secretfree \
-        --item "{\"device-id\": {\"S\": \"$i\"}, \"pubkey\": {\"S\":\"$pubkey\"}}" \
+        --item "{\"device-id\": {\"S\": \"$i\"}, \"pubkey_der\": {\"B\":\"$pubkey_der\"}, \"keytype\": {\"S\":\"spki\"}, \"fingerprint\": {\"S\":\"$fingerprint\"}}" \
         > /dev/null 2>&1
     if test $? != 0; then
        echo Error hard stop.
@@ -5,67 +5,202 @@
 Lambda function to decompose Infineon based certificate manifest(s) and begin
 the import processing pipeline
 """
-import base64
 import re
 import os
-import boto3
-import OpenSSL.crypto
-from OpenSSL.crypto import load_certificate_request, FILETYPE_PEM, dump_publickey
+from aws_utils import SINGLE_ATTEMPT, get_client, warm_up
+from cache_utils import TtlLruCache
+from csr_utils import CsrRejected, screen_csr, verify_signature, public_key_der
+from key_utils import item_fingerprint, spki_fingerprint, fingerprints_match
+from issuance_utils import authorizer_context
+from membership_utils import MembershipFilter
+from keyindex_utils import KeyIndex
+from hedge_utils import HedgedLookup
+from sku_utils import UnknownSku, sku_config, routing_mode
+from metrics_utils import instrumented, span, annotate, current
+
+# Public key fingerprints keyed by device-id. Lives for the life of the
+# container so retry bursts from the same device skip the DynamoDB read.
+PUBKEY_CACHE = TtlLruCache(maxsize=int(os.environ.get('PUBKEY_CACHE_SIZE', '1024')),
+                           ttl=float(os.environ.get('PUBKEY_CACHE_TTL', '300')))
+
+# Device-ids the table did not hold. Short lived so a device registered
+# after a miss is admitted again soon.
+NEGATIVE_CACHE = TtlLruCache(maxsize=int(os.environ.get('NEGATIVE_CACHE_SIZE', '4096')),
+                             ttl=float(os.environ.get('NEGATIVE_CACHE_TTL', '60')))
+
+# Bloom filter of registered device-ids, seeded by src/tools/rebuild_membership
+# and kept current by the table stream
+MEMBERSHIP = MembershipFilter(bucket=os.environ.get('MEMBERSHIP_BUCKET'),
+                              key=os.environ.get('MEMBERSHIP_KEY', 'membership/device-ids.bloom'),
+                              refresh=float(os.environ.get('MEMBERSHIP_REFRESH', '60')),
+                              recheck=float(os.environ.get('MEMBERSHIP_RECHECK', '1')))
+
+# Stream-fed device-id to fingerprint index, memory-mapped from S3
+KEY_INDEX = KeyIndex(bucket=os.environ.get('KEY_INDEX_BUCKET'),
+                     prefix=os.environ.get('KEY_INDEX_PREFIX', 'keyindex'),
+                     refresh=float(os.environ.get('KEY_INDEX_REFRESH', '60')))
+
+# Replicas of the provisioning global table, local region first. With more
+# than one, table reads are hedged across them.
+LOOKUP_REGIONS = [ region.strip() for region in os.environ.get('KEY_LOOKUP_REGIONS', '').split(',')
+                   if region.strip() ]
+HEDGED_LOOKUP = HedgedLookup(LOOKUP_REGIONS,
+                             hedge_percentile=float(os.environ.get('KEY_LOOKUP_HEDGE_PERCENTILE', '95')),
+                             max_delay=float(os.environ.get('KEY_LOOKUP_MAX_DELAY', '0.2')),
+                             timeout=float(os.environ.get('KEY_LOOKUP_TIMEOUT', '1.0'))
+                             ) if len(LOOKUP_REGIONS) > 1 else None
+# A slow replica is hedged rather than retried
+LOOKUP_CLIENT = { 'connect_timeout': 0.5,
+                  'read_timeout': float(os.environ.get('KEY_LOOKUP_TIMEOUT', '1.0')),
+                  'retries': SINGLE_ATTEMPT }
+
+# Clients named in AWS_CLIENT_WARM_UP are created during the init phase
+warm_up()
+
+def invalidate_pubkey( device_id=None ):
+    """
+    Drop a cached public key, or the whole cache when no device-id is given.
+    Negative entries are dropped too.
+    """
+    PUBKEY_CACHE.invalidate(device_id)
+    NEGATIVE_CACHE.invalidate(device_id)
+
+def read_item( device_id, table_name=None ):
+    """
+    The table item of device_id, or None. With several replicas the read
+    is hedged, and a miss is confirmed with the next replica in case the
+    device was registered there and has not replicated yet.
+    """
+    key = { 'device-id': { 'S' : device_id } }
+    table_name = table_name or os.environ['SECRETFREE_TABLENAME']
+    if HEDGED_LOOKUP is None:
+        d = get_client('dynamodb')
+        return d.get_item( Key=key, TableName=table_name ).get('Item')
+
+    def fetch( region ):
+        d = get_client('dynamodb', region, **LOOKUP_CLIENT)
+        return d.get_item( Key=key, TableName=table_name ).get('Item')
 
-def get_pubkey( req ):
+    return HEDGED_LOOKUP.call( fetch, accept=lambda item: item is not None )
+
+def get_pubkey( device_id, table_name=None ):
     """
-    Fetch the public key from the DynamoDB table.
+    Fetch the public key fingerprint, from the warm cache, the local key
+    index or else the DynamoDB table. Items that carry a precomputed
+    fingerprint are used as-is; legacy items only holding the base64 encoded
+    PEM are fingerprinted here, once per container. Returns None when the
+    device-id is not registered.
+
+    A table_name other than the deployment's own is for a routed SKU: its
+    entries are cached under the table name too, and the key index and
+    membership filter, which only cover the deployment's table, are skipped.
     """
-    device_id = req.get_subject().CN
-    d = boto3.client('dynamodb')
+    home = table_name in (None, os.environ.get('SECRETFREE_TABLENAME'))
+    cache_key = device_id if home else ( table_name, device_id )
+
+    fingerprint = PUBKEY_CACHE.get(cache_key)
+    if fingerprint is not None:
+        return fingerprint
 
-    response = d.get_item(
-        Key={ 'device-id': { 'S' : device_id } },
-        TableName=os.environ['SECRETFREE_TABLENAME']
-    )
+    # Known-absent ids are refused without spending a table read
+    if NEGATIVE_CACHE.get(cache_key):
+        return None
 
-    return response['Item']['pubkey']['S']
+    if home:
+        fingerprint = KEY_INDEX.lookup(device_id)
+        if fingerprint is not None:
+            PUBKEY_CACHE.put(cache_key, fingerprint)
+            return fingerprint
 
+        # Not indexed: unknown, or registered after the snapshot and delta
+        if not MEMBERSHIP.might_contain(device_id):
+            return None
+
+    item = read_item( device_id, table_name )
+    if item is None:
+        NEGATIVE_CACHE.put(cache_key, True)
+        return None
+
+    fingerprint = item_fingerprint(item)
+    PUBKEY_CACHE.put(cache_key, fingerprint)
+    return fingerprint
+
+def reject( rejected ):
+    """
+    Refuse the request, recording the stage and reason on the EMF line
+    so refusals can be broken down in CloudWatch Logs Insights.
+    """
+    annotate('RejectStage', rejected.stage)
+    annotate('RejectReason', rejected.reason)
+    raise Exception('Unauthorized') from rejected
+
+@instrumented('authorizer')
 def lambda_handler(event, context):
     """
     Main routine
     """
     principal_id = "user|a1b2c3d4"
 
-    # Get the public key from the CSR
-    device_csr = base64.b64decode(event['headers']['device-csr']).decode('utf-8')
-    req = load_certificate_request( FILETYPE_PEM, device_csr )
-    req_pubkey = req.get_pubkey()
-    req_pubkey_pem = dump_publickey( FILETYPE_PEM, req_pubkey )
-
-    # Get the public key from Dynamo. Load and then dump to format proper
-    # Whole certificate is base64 encoded for maintaining textual integrity
-    ori_pubkey_pem = base64.b64decode(get_pubkey(req))
-    pubbuf = OpenSSL.crypto.load_publickey(FILETYPE_PEM, ori_pubkey_pem)
-    ori_pubkey_pem = dump_publickey( FILETYPE_PEM, pubbuf)
-
-    print(ori_pubkey_pem)
-    print(req_pubkey_pem)
-
-    if ori_pubkey_pem == req_pubkey_pem:
-        # Return 201 and respond w sigv4 uri to signed certificate
-        tmp = event['methodArn'].split(':')
-        apiGatewayArnTmp = tmp[5].split('/')
-        account_id = tmp[4]
-
-        policy = AuthPolicy(principal_id, account_id)
-        policy.restApiId = apiGatewayArnTmp[0]
-        policy.region = tmp[3]
-        policy.stage = apiGatewayArnTmp[1]
+    # Screen the CSR cheapest check first; junk never reaches the table
+    with span('csr_decode'):
+        try:
+            screened = screen_csr( ( event.get('headers') or {} ).get('device-csr') )
+        except CsrRejected as rejected:
+            reject( rejected )
+
+    # With SKU routing the CSR subject or the path names the SKU, and
+    # with it the table holding the device's key
+    try:
+        sku = sku_config( event, screened.req )
+    except UnknownSku:
+        reject( CsrRejected('sku', 'unknown') )
+    if routing_mode():
+        current().sku = sku.name
+
+    # Get the registered fingerprint from Dynamo (or the warm cache)
+    with span('key_lookup'):
+        ori_fingerprint = get_pubkey( screened.device_id, sku.table_name )
+    if ori_fingerprint is None:
+        reject( CsrRejected('lookup', 'unregistered') )
+
+    with span('compare'):
+        req_fingerprint = spki_fingerprint(public_key_der( screened.req ))
+        matched = fingerprints_match(ori_fingerprint, req_fingerprint)
+    if not matched:
+        reject( CsrRejected('compare', 'key_mismatch') )
+
+    # Proof of possession, paid only by registered ids with the right key
+    with span('signature'):
+        try:
+            verify_signature( screened.req )
+        except CsrRejected as rejected:
+            reject( rejected )
+
+    # Return 201 and respond w sigv4 uri to signed certificate
+    tmp = event['methodArn'].split(':')
+    apiGatewayArnTmp = tmp[5].split('/')
+    account_id = tmp[4]
+
+    policy = AuthPolicy(principal_id, account_id)
+    policy.restApiId = apiGatewayArnTmp[0]
+    policy.region = tmp[3]
+    policy.stage = apiGatewayArnTmp[1]
+    if routing_mode() == 'path':
+        policy.allowMethod(HttpVerb.POST, "/" + sku.name + "/new")
+        policy.allowMethod(HttpVerb.POST, "/" + sku.name + "/proto")
+    else:
         policy.allowMethod(HttpVerb.POST, "/new")
         policy.allowMethod(HttpVerb.POST, "/proto")
 
-        # Finally, build the policy
-        authResponse = policy.build()
+    # Finally, build the policy. The verified identity rides along in
+    # the context so the issuer does not parse the CSR again.
+    authResponse = policy.build()
+    authResponse['context'] = authorizer_context( screened.device_id,
+                                                  ori_fingerprint,
+                                                  screened.pem,
+                                                  sku.name if routing_mode() else None )
 
-        return authResponse
-    else:
-        raise Exception('Unauthorized')
+    return authResponse
     
 class HttpVerb:
     GET     = "GET"
@@ -88,7 +223,7 @@ class AuthPolicy(object):
     """The policy version used for the evaluation. This should always be '2012-10-17'"""
     version = "2012-10-17"
     """The regular expression used to validate resource paths for the policy"""
-    path_regex = "^[/.a-zA-Z0-9-\*]+$"
+    path_regex = r"^[/.a-zA-Z0-9-\*]+$"
 
     """
     these are the internal lists of allowed and denied methods. These are lists
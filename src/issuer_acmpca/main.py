@@ -9,210 +9,264 @@ import json
 import time
 import base64
 import os
-import string
-import random
 import logging
-import boto3
 from botocore.exceptions import ClientError
-from OpenSSL.crypto import load_certificate_request, FILETYPE_PEM
+from aws_utils import get_client, warm_up
+from csr_utils import load_csr, common_name
+from retry_utils import Backoff, PollTimeout, poll
+from issuance_utils import (idempotency_token, verified_device_id, verified_sku, csr_digest,
+                            recent_issuance, record_issuance)
+from sku_utils import SKU_CONFIG, UnknownSku, request_config, routing_mode
+from iot_utils import data_endpoint
+from provision_utils import register_device
+from metrics_utils import instrumented, span, current
+from ratelimit_utils import rate_limited, within_deadline
+from async_utils import (async_enabled, certificate_key, retrieval_url, dispatch_worker,
+                         store_result, accepted_response, proxy_response)
 
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
-def provision_certificate( csr ):
-    """
-    Create the Certificate - duration 150 days - very arbitrary
-    TODO: Figure out a better way to deal with this idempotency token
-    """
-
-    acmpca = boto3.client('acm-pca')
-    ca_arn = os.environ['ACMPCA_CA_ARN']
-    cert_validity_days = int(os.environ('CERT_VALIDITY_DAYS'))
-    cert_signing_algo = os.environ('CERT_SIGNING_ALGO')
-    cert = acmpca.issue_certificate(
-        CertificateAuthorityArn=ca_arn,
-        SigningAlgorithm=cert_signing_algo,
-        Csr=csr,
-        Validity={
-            'Value': cert_validity_days,
-            'Type': 'DAYS'
-        },
-        IdempotencyToken=''.join(random.choice(string.ascii_lowercase) for i in range(10))
-    )
-
-    # Fetch the certificate
-    # TODO: this is wildly unacceptable, needs a backoff with iteration cutoff
-    while 1:
-        try:
-            certificate= acmpca.get_certificate(
-                CertificateAuthorityArn=ca_arn,
-                CertificateArn=cert['CertificateArn']
-            )
-            return certificate
-        except ClientError as error:
-            error_code = error.response['Error']['Code']
-            error_message = error.response['Error']['Message']
-            logger.error("Certificate not ready yet: %s: %s.", error_code, error_message)
-            time.sleep(1)
-    return None
+# Deadline margin left for the registry steps after the certificate poll,
+# at most this share of the remaining time so a short timeout still polls
+POLL_DEADLINE_MARGIN_MS = int(os.environ.get('POLL_DEADLINE_MARGIN_MS', '3000'))
+POLL_DEADLINE_MARGIN_SHARE = float(os.environ.get('POLL_DEADLINE_MARGIN_SHARE', '0.25'))
+POLL_FIRST_DELAY = float(os.environ.get('POLL_FIRST_DELAY', '0.05'))
+POLL_BACKOFF = Backoff(base=float(os.environ.get('POLL_BACKOFF_BASE', '0.1')),
+                       cap=float(os.environ.get('POLL_BACKOFF_CAP', '1.0')))
+
+# Clients named in AWS_CLIENT_WARM_UP are created during the init phase
+warm_up()
+
+def is_request_in_progress( error ) -> bool:
+    """
+    Only an issuance that has not completed yet is worth polling again.
+    """
+    return ( isinstance(error, ClientError) and
+             error.response['Error']['Code'] == 'RequestInProgressException' )
+
+def wait_for_certificate( acmpca, ca_arn, certificate_arn, context=None ):
+    """
+    Poll get_certificate with jittered exponential backoff until the
+    certificate is issued or the Lambda deadline, less a margin for the
+    registry steps, is reached. Returns the certificate and PollMetrics.
+    """
+    if context is not None:
+        remaining_ms = context.get_remaining_time_in_millis()
+        margin_ms = min(POLL_DEADLINE_MARGIN_MS, remaining_ms * POLL_DEADLINE_MARGIN_SHARE)
+        remaining = (remaining_ms - margin_ms) / 1000
+    else:
+        remaining = POLL_BACKOFF.cap * 10
+    deadline = time.monotonic() + max(0.0, remaining)
+
+    return poll( lambda: rate_limited( 'GetCertificate', acmpca.get_certificate,
+                                       CertificateAuthorityArn=ca_arn,
+                                       CertificateArn=certificate_arn ),
+                 is_request_in_progress,
+                 deadline,
+                 backoff=POLL_BACKOFF,
+                 first_delay=POLL_FIRST_DELAY )
+
+def submit_certificate( acmpca, csr, device_id, sku=None ) -> str:
+    """
+    Create the Certificate with the SKU's CA, validity and signing algorithm,
+    by default the deployment's own.
+    The idempotency token is derived from the CSR, the device-id and a time
+    bucket, so a device retrying after a timeout gets the certificate ARN
+    that was already issued rather than a second certificate.
+    """
+    sku = sku or SKU_CONFIG.get()
+    with span('issuance'):
+        cert = rate_limited( 'IssueCertificate', acmpca.issue_certificate,
+            CertificateAuthorityArn=sku.ca_arn,
+            SigningAlgorithm=sku.signing_algorithm,
+            Csr=csr,
+            Validity={
+                'Value': sku.validity_days,
+                'Type': 'DAYS'
+            },
+            IdempotencyToken=idempotency_token( csr, device_id )
+        )
+    return cert['CertificateArn']
+
+def fetch_certificate( acmpca, ca_arn, certificate_arn, context=None ):
+    """
+    Wait for a submitted certificate, returning None if it is not issued
+    before the deadline.
+    """
+    try:
+        with span('certificate_poll'):
+            certificate, metrics = wait_for_certificate( acmpca, ca_arn, certificate_arn, context )
+    except PollTimeout as error:
+        logger.error("Certificate [%s] not issued before deadline: %d attempts, %.3fs waited.",
+                     certificate_arn, error.metrics.attempts, error.metrics.waited)
+        return None
+
+    logger.info("Certificate [%s] issued: %d attempts, %.3fs waited.",
+                certificate_arn, metrics.attempts, metrics.waited)
+    return certificate
+
+def provision_certificate( csr, device_id, context=None, sku=None ):
+    """
+    Submit the CSR to ACM PCA and wait for the issued certificate.
+    """
+    sku = sku or SKU_CONFIG.get()
+    acmpca = get_client('acm-pca')
+    certificate_arn = submit_certificate( acmpca, csr, device_id, sku )
+    return fetch_certificate( acmpca, sku.ca_arn, certificate_arn, context )
 
 def deploy_certificate( certificate ):
-    iot = boto3.client('iot')
+    iot = get_client('iot')
 
     try:
         # TODO:  pull up values for setAsActive and status to environment variables
-        response = iot.register_certificate( certificatePem=certificate,
-                                             status='ACTIVE' )
+        with span('registration'):
+            response = rate_limited( 'RegisterCertificate', iot.register_certificate,
+                                     certificatePem=certificate,
+                                     status='ACTIVE' )
         return response['certificateArn']
     except ClientError as error:
         error_code = error.response['Error']['Code']
         error_message = error.response['Error']['Message']
+        # A retried request was answered with the certificate ACM PCA already
+        # issued, and that certificate is already registered: carry on with it.
+        if error_code == 'ResourceAlreadyExistsException' and 'resourceArn' in error.response:
+            logger.info("Certificate already registered, reusing [%s].",
+                        error.response['resourceArn'])
+            return error.response['resourceArn']
         logger.error("Could not register certificate: %s: %s.", error_code, error_message)
         raise error
 
-# The deploy_thing function assumes a unique identifier for a given SKU.
-# Since this can be a certificate reissue, an existing Thing will be attached
-# to the newly issued certificate.  Deactivation of existing attached certificates
-# is outside the bounds of this operation.
-
-def deploy_thing( device_id, certificate_arn ):
-    iot = boto3.client('iot')
+def complete_provisioning( certificate, device_id, region, account, digest=None, sku=None ):
+    """
+    Register the issued certificate, the Thing and the SKU's Policy,
+    returning the payload for the device or None when a step failed. With
+    the CSR digest given, the issuance is recorded for fast reissue.
+    """
+    sku = sku or SKU_CONFIG.get()
+    # Send the certificate to AWS IoT. We assume the issuing CA has already
+    # been registered.
 
-    # Identify if an existing Thing exists with the device ID. If yes, then use
-    # that Thing for certificate attachment.  Otherwise, create a new Thing.
+    certificate_arn = deploy_certificate( certificate )
+    if certificate_arn is None:
+        return None
 
-    thing_name = None
+    # Create the Thing, attach it to the deployed certificate, and attach
+    # the Policy (created if necessary).
 
-    try:
-        iot.describe_thing(thingName=device_id)
-        thing_name = device_id
-    except ClientError as error:
-        error_code = error.response['Error']['Code']
-        error_message = error.response['Error']['Message']
-        logger.info("Thing [%s] does not exist. Will create: %s: %s.",
-                    device_id, error_code, error_message)
-        try:
-            iot.create_thing(thingName=device_id)
-            thing_name = device_id
-        except ClientError as error_cr:
-            error_code = error_cr.response['Error']['Code']
-            error_message = error_cr.response['Error']['Message']
-            logger.info("Thing [%s] does not exist and failed to create. %s: %s.",
-                        device_id, error_code, error_message)
-            raise error_cr
-
-    # Attach the Thing to the Certificate.
-    try:
-        iot.attach_thing_principal( thingName = thing_name, principal = certificate_arn )
-    except ClientError as error:
-        error_code = error.response['Error']['Code']
-        error_message = error.response['Error']['Message']
-        logger.info("Thing [%s] failed to attach to principal [%s]. %s: %s.",
-                    device_id, certificate_arn, error_code, error_message)
-        raise error
-    return True
-
-# The deploy_policy function is an example for deploying a single
-# policy for a given SKU. For simplicity, the policy is the same as
-# what is deployed for the Python example from the Onboard Wizard.
-
-def deploy_policy( certificate_arn, region, account ):
-    policy_name = os.environ["SKUNAME"]
-    iot = boto3.client('iot')
-    create_policy = False
-    
-    policy_document = '''{{
-  "Version": "2012-10-17",
-  "Statement": [
-    {{
-      "Effect": "Allow",
-      "Action": [
-        "iot:Publish",
-        "iot:Receive"
-      ],
-      "Resource": [
-        "arn:aws:iot:{0}:{1}:topic/sdk/test/java",
-        "arn:aws:iot:{0}:{1}:topic/sdk/test/Python",
-        "arn:aws:iot:{0}:{1}:topic/topic_1",
-        "arn:aws:iot:{0}:{1}:topic/topic_2"
-      ]
-    }},
-    {{
-      "Effect": "Allow",
-      "Action": [
-        "iot:Subscribe"
-      ],
-      "Resource": [
-        "arn:aws:iot:{0}:{1}:topicfilter/sdk/test/java",
-        "arn:aws:iot:{0}:{1}:topicfilter/sdk/test/Python",
-        "arn:aws:iot:{0}:{1}:topicfilter/topic_1",
-        "arn:aws:iot:{0}:{1}:topicfilter/topic_2"
-      ]
-    }},
-    {{
-      "Effect": "Allow",
-      "Action": [
-        "iot:Connect"
-      ],
-      "Resource": [
-        "arn:aws:iot:{0}:{1}:client/sdk-java",
-        "arn:aws:iot:{0}:{1}:client/basicPubSub",
-        "arn:aws:iot:{0}:{1}:client/sdk-nodejs-*"
-      ]
-    }}
-  ]
-}}'''
+    iot = get_client('iot')
+    result = register_device( iot, device_id, certificate_arn, sku.policy_name,
+                              region, account, sku.policy_template )
+    logger.info("Provisioning result: %s", result.as_dict())
+    if not result.ok:
+        return None
 
-    try:
-        iot.get_policy( policyName = policy_name )
-    except:
-        create_policy = True
+    if digest is not None:
+        record_issuance( device_id, digest, certificate, certificate_arn )
 
-    if ( create_policy == True ):
-        response = iot.create_policy( policyName = policy_name,
-                                      policyDocument = policy_document.format( region, account ) )
-        if ( response == None ): return None
+    return device_payload( certificate, region, account )
 
-    try:
-        iot.attach_policy( policyName = policy_name, target = certificate_arn )
-    except:
-        return False
+def device_payload( certificate, region, account ):
+    """
+    The certificate and the account's IoT data endpoint, as returned to the
+    device.
+    """
+    iot = get_client('iot')
+    with span('endpoint_lookup'):
+        endpoint = data_endpoint( iot, region, account )
+    return { 'certificate': certificate,
+             'endpoint': endpoint }
 
+@instrumented('issuer_acmpca')
+@within_deadline
 def lambda_handler(event, context):
     # Whoami and Whatami is important for construction region sensitive ARNs
     region = context.invoked_function_arn.split(":")[3]
     account = context.invoked_function_arn.split(":")[4]
 
-    csr = base64.b64decode(event['headers']['device-csr'])
-    req = load_certificate_request( FILETYPE_PEM, csr )
-    device_id = req.get_subject().CN
-    response = provision_certificate( csr )
+    with span('csr_decode'):
+        csr = base64.b64decode(event['headers']['device-csr'])
+        # The authorizer already parsed this CSR; only parse it when its
+        # context is missing or was issued for another request.
+        device_id = verified_device_id( event, csr ) or common_name( load_csr( csr ) )
+        digest = csr_digest( csr )
+        try:
+            sku = request_config( event, csr, verified_sku( event, csr ) )
+        except UnknownSku:
+            logger.error("No configuration for the SKU of [%s].", device_id)
+            return None
+    if routing_mode():
+        current().sku = sku.name
 
-    certificate = response['Certificate']
+    # A device that rebooted before persisting its certificate presents the
+    # same CSR again; hand back what was issued instead of issuing anew.
+    with span('reissue_lookup'):
+        previous = recent_issuance( device_id, digest )
+    if previous is not None:
+        logger.info("Returning certificate %s issued to [%s] at %d.",
+                    previous['serial'], device_id, previous['issued_at'])
+        return proxy_response( 200, json.dumps( device_payload( previous['certificate'],
+                                                                region, account ) ) )
 
-    # Send the certificate to AWS IoT. We assume the issuing CA has already
-    # been registered.
+    # In two-phase mode only the issuance is submitted here; the worker
+    # waits for it, runs the registry steps and writes the certificate
+    # where the returned pre-signed URL points.
+    if async_enabled():
+        acmpca = get_client('acm-pca')
+        certificate_arn = submit_certificate( acmpca, csr, device_id, sku )
+        key = certificate_key( device_id, context.aws_request_id )
+        dispatch_worker({ 'device_id': device_id,
+                          'sku': sku.name,
+                          'ca_arn': sku.ca_arn,
+                          'certificate_arn': certificate_arn,
+                          'csr_digest': digest,
+                          'region': region,
+                          'account': account,
+                          'key': key })
+        return accepted_response( retrieval_url( key ) )
 
-    certificate_arn = deploy_certificate( certificate )
-    if certificate_arn is None:
+    response = provision_certificate( csr, device_id, context, sku )
+    if response is None:
         return None
 
-    # Create the Thing object and attach to the deployed certificate
-
-    response = deploy_thing( device_id, certificate_arn )
-    if response is False:
+    payload = complete_provisioning( response['Certificate'], device_id, region, account,
+                                     digest, sku )
+    if payload is None:
         return None
 
-    # Create the Policy if necessary, and attach the created Policy (or
-    # existing Policy) to the Thing.
+    # Return the certificate to API Gateway.
+    return proxy_response( 200, json.dumps(payload) )
 
-    response = deploy_policy( certificate_arn, region, account )
-    if response is False:
-        return None
+@instrumented('issuer_acmpca_worker')
+@within_deadline
+def worker_handler(event, context):
+    """
+    Second phase of asynchronous issuance, invoked by lambda_handler.
+    """
+    acmpca = get_client('acm-pca')
+    payload = None
 
-    # Return the certificate to API Gateway.
-    iot = boto3.client('iot')
-    endpoint = iot.describe_endpoint(endpointType = 'iot:Data-ATS')
-    payload = { 'certificate': certificate,
-                'endpoint': endpoint['endpointAddress'] }
-    return json.dumps(payload)
+    try:
+        response = fetch_certificate( acmpca, event['ca_arn'], event['certificate_arn'], context )
+        if response is not None:
+            payload = complete_provisioning( response['Certificate'], event['device_id'],
+                                             event['region'], event['account'],
+                                             event.get('csr_digest'),
+                                             SKU_CONFIG.get( event.get('sku') ) )
+    except UnknownSku:
+        logger.error("No configuration for SKU [%s] of [%s].", event.get('sku'),
+                     event['device_id'])
+    except ClientError as error:
+        error_code = error.response['Error']['Code']
+        error_message = error.response['Error']['Message']
+        logger.error("Provisioning [%s] failed: %s: %s.", event['device_id'],
+                     error_code, error_message)
+
+    # The device polls the pre-signed URL, so always leave it an answer.
+    if payload is None:
+        payload = { 'status': 'FAILED' }
+    else:
+        payload['status'] = 'ISSUED'
+
+    store_result( event['key'], payload )
+    return payload['status']
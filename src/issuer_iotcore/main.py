@@ -5,177 +5,206 @@
 Lambda function to decompose Infineon based certificate manifest(s) and begin
 the import processing pipeline
 """
+from __future__ import annotations
 import base64
+import json
 import os
 import logging
-import boto3
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 from botocore.exceptions import ClientError
-#from OpenSSL.crypto import load_certificate_request, FILETYPE_PEM
-from cryptography.x509 import load_pem_x509_csr
-from cryptography.x509.oid import NameOID
-from aws_lambda_powertools.utilities.typing import LambdaContext
-from aws_lambda_powertools.utilities.data_classes import SQSEvent
+from aws_utils import get_client, warm_up
+from csr_utils import load_csr, common_name
+from provision_utils import register_device
+from issuance_utils import (verified_device_id, verified_sku, csr_digest, recent_issuance,
+                            record_issuance)
+from sku_utils import SKU_CONFIG, SkuConfig, UnknownSku, request_config, routing_mode
+from metrics_utils import instrumented, span, run_in_context, current
+from ratelimit_utils import rate_limited, within_deadline
+from async_utils import (async_enabled, certificate_key, retrieval_url, dispatch_worker,
+                         store_result, accepted_response, proxy_response)
+if TYPE_CHECKING:
+    from aws_lambda_powertools.utilities.typing import LambdaContext
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
-def provision_certificate( csr ) -> dict:
-    iot = boto3.client('iot')
+# The synchronous answer carries the bare PEM certificate
+PEM_HEADERS = { 'Content-Type': 'application/x-pem-file' }
 
-    try:
-        return iot.create_certificate_from_csr( certificateSigningRequest=csr.decode('ascii'),
-                                                setAsActive=True )
-    except ClientError as error:
-        error_code = error.response['Error']['Code']
-        error_message = error.response['Error']['Message']
-        logger.error("Certificate creation failed: %s: %s.", error_code, error_message)
-        return {}
+# Records provisioned concurrently by the SQS batch handler
+SQS_CONCURRENCY = int(os.environ.get('SQS_CONCURRENCY', '8'))
 
-# The certificate is already deployed.
-def deploy_certificate( certificate ):
-    return None
+# Clients named in AWS_CLIENT_WARM_UP are created during the init phase
+warm_up()
 
+def provision_certificate( csr ) -> dict:
+    """Issue and activate a certificate for the CSR; empty when AWS IoT Core refuses it"""
+    iot = get_client('iot')
 
-def deploy_thing( device_id, certificate_arn ):
-    """
-    The deploy_thing function assumes a unique identifier for a given SKU.
-    Since this can be a certificate reissue, an existing Thing will be attached
-    to the newly issued certificate.  Deactivation of existing attached certificates
-    is outside the bounds of this operation.
-
-    Identify if an existing Thing exists with the device ID. If yes, then use
-    that Thing for certificate attachment.  Otherwise, create a new Thing.
-    """
-    iot = boto3.client('iot')
-    thing_name = None
-
-    try:
-        iot.describe_thing( thingName = device_id )
-        thing_name = device_id
-    except ClientError as error:
-        error_code = error.response['Error']['Code']
-        error_message = error.response['Error']['Message']
-        logger.error("Thing %s does not exist. Will create. %s: %s.", device_id, error_code, error_message)
-        try:
-            iot.create_thing( thingName = device_id )
-            thing_name = device_id
-        except ClientError as error_cr:
-            error_code = error_cr.response['Error']['Code']
-            error_message = error_cr.response['Error']['Message']
-            logger.error("Thing creation failed: %s: %s.", error_code, error_message)
-            return False
-
-    # Attach the Thing to the Certificate.
     try:
-        iot.attach_thing_principal( thingName = thing_name, principal = certificate_arn )
+        with span('issuance'):
+            return rate_limited('CreateCertificateFromCsr', iot.create_certificate_from_csr,
+                                certificateSigningRequest=csr.decode('ascii'),
+                                setAsActive=True)
     except ClientError as error:
         error_code = error.response['Error']['Code']
         error_message = error.response['Error']['Message']
-        logger.error("Principal attachment failed: %s: %s.", error_code, error_message)
-        return False
-
-    return True
-
-# The deploy_policy function is an example for deploying a single
-# policy for a given SKU. For simplicity, the policy is the same as
-# what is deployed for the Python example from the Onboard Wizard.
-
-def deploy_policy( certificate_arn, region, account ):
-    policy_name = os.environ["SKUNAME"]
-    iot = boto3.client('iot')
-    create_policy = False
-    
-    policy_document = '''{{
-  "Version": "2012-10-17",
-  "Statement": [
-    {{
-      "Effect": "Allow",
-      "Action": [
-        "iot:Publish",
-        "iot:Receive"
-      ],
-      "Resource": [
-        "arn:aws:iot:{0}:{1}:topic/sdk/test/java",
-        "arn:aws:iot:{0}:{1}:topic/sdk/test/Python",
-        "arn:aws:iot:{0}:{1}:topic/topic_1",
-        "arn:aws:iot:{0}:{1}:topic/topic_2"
-      ]
-    }},
-    {{
-      "Effect": "Allow",
-      "Action": [
-        "iot:Subscribe"
-      ],
-      "Resource": [
-        "arn:aws:iot:{0}:{1}:topicfilter/sdk/test/java",
-        "arn:aws:iot:{0}:{1}:topicfilter/sdk/test/Python",
-        "arn:aws:iot:{0}:{1}:topicfilter/topic_1",
-        "arn:aws:iot:{0}:{1}:topicfilter/topic_2"
-      ]
-    }},
-    {{
-      "Effect": "Allow",
-      "Action": [
-        "iot:Connect"
-      ],
-      "Resource": [
-        "arn:aws:iot:{0}:{1}:client/sdk-java",
-        "arn:aws:iot:{0}:{1}:client/basicPubSub",
-        "arn:aws:iot:{0}:{1}:client/sdk-nodejs-*"
-      ]
-    }}
-  ]
-}}'''
-    print(policy_document.format( region, account ))
-    try:
-        iot.get_policy( policyName = policy_name )
-    except:
-        create_policy = True
-
-    if create_policy is True:
-        iot.create_policy( policyName = policy_name,
-                           policyDocument = policy_document.format( region, account ) )
+        logger.error("Certificate creation failed: %s: %s.", error_code, error_message)
+        return {}
 
-    iot.attach_policy(policyName=policy_name, target=certificate_arn)
 
 def get_cn_attribute(csr: bytes) -> str:
     """ Fetch the CN value from the certificate request """
-    req = load_pem_x509_csr(csr)
-    req_name = req.subject
-    req_cn_attr = req_name.get_attributes_for_oid(NameOID.COMMON_NAME)
-    return str(req_cn_attr[0].value)
-
+    return common_name(load_csr(csr))
+
+def complete_provisioning(device_id: str, certificate_arn: str, region: str, account: str,
+                          sku: SkuConfig = None) -> bool:
+    """Create the Thing and the SKU's Policy for an issued certificate"""
+    sku = sku or SKU_CONFIG.get()
+    iot = get_client('iot')
+    result = register_device(iot, device_id, certificate_arn, sku.policy_name,
+                             region, account, sku.policy_template)
+    logger.info("Provisioning result: %s", result.as_dict())
+
+    # Report failure if any part of the transaction failed.
+    return result.ok
+
+@instrumented('issuer_iotcore')
+@within_deadline
 def lambda_handler(event: dict, context: LambdaContext):
     """Lambda function main entry point"""
-    csr = base64.b64decode(event['headers']['device-csr'])
-    #req = load_certificate_request(FILETYPE_PEM, csr)
-    response = provision_certificate(csr)
+    with span('csr_decode'):
+        csr = base64.b64decode(event['headers']['device-csr'])
+        # The authorizer already parsed this CSR; only parse it when its
+        # context is missing or was issued for another request.
+        device_id = verified_device_id(event, csr) or get_cn_attribute(csr)
+        digest = csr_digest(csr)
+        try:
+            sku = request_config(event, csr, verified_sku(event, csr))
+        except UnknownSku:
+            logger.error("No configuration for the SKU of [%s].", device_id)
+            return None
+    if routing_mode():
+        current().sku = sku.name
+
+    # A device that rebooted before persisting its certificate presents the
+    # same CSR again; hand back what was issued instead of issuing anew.
+    with span('reissue_lookup'):
+        previous = recent_issuance(device_id, digest)
+    if previous is not None:
+        logger.info("Returning certificate %s issued to [%s] at %d.",
+                    previous['serial'], device_id, previous['issued_at'])
+        return proxy_response(200, previous['certificate'], PEM_HEADERS)
 
+    response = provision_certificate(csr)
 
     region = context.invoked_function_arn.split(":")[3]
     account = context.invoked_function_arn.split(":")[4]
 
     # Send the certificate to AWS IoT. We assume the issuing CA has already
     # been registered.
-    if response is None:
+    if not response:
         return None
 
     certificate_body = response['certificatePem']
     certificate_arn = response['certificateArn']
 
-    # Create the Thing object and attach to the deployed certificate
-    device_id = get_cn_attribute(csr)
-    response = deploy_thing( device_id, certificate_arn )
-
-    # The entire transaction failed, so report failure.
-    if response is False:
+    # In two-phase mode the worker runs the registry steps and writes the
+    # certificate where the returned pre-signed URL points.
+    if async_enabled():
+        key = certificate_key(device_id, context.aws_request_id)
+        dispatch_worker({ 'device_id': device_id,
+                          'sku': sku.name,
+                          'certificate': certificate_body,
+                          'certificate_arn': certificate_arn,
+                          'csr_digest': digest,
+                          'region': region,
+                          'account': account,
+                          'key': key })
+        return accepted_response(retrieval_url(key))
+
+    if complete_provisioning(device_id, certificate_arn, region, account, sku) is False:
         return None
+    record_issuance(device_id, digest, certificate_body, certificate_arn)
 
-    # Create the Policy if necessary, and attach the created Policy (or
-    # existing Policy) to the Thing.
+    # Return the certificate to API Gateway.
+    return proxy_response(200, certificate_body, PEM_HEADERS)
 
-    deploy_policy( certificate_arn, region, account )
-    if response is False:
-        return None
+@instrumented('issuer_iotcore_worker')
+@within_deadline
+def worker_handler(event: dict, context: LambdaContext):
+    """Second phase of asynchronous issuance, invoked by lambda_handler"""
+    payload = { 'status': 'FAILED' }
+    try:
+        if complete_provisioning(event['device_id'], event['certificate_arn'],
+                                 event['region'], event['account'],
+                                 SKU_CONFIG.get(event.get('sku'))):
+            payload = { 'status': 'ISSUED', 'certificate': event['certificate'] }
+            if event.get('csr_digest'):
+                record_issuance(event['device_id'], event['csr_digest'], event['certificate'],
+                                event['certificate_arn'])
+    except UnknownSku:
+        logger.error("No configuration for SKU [%s] of [%s].", event.get('sku'), event['device_id'])
+    except ClientError as error:
+        error_code = error.response['Error']['Code']
+        error_message = error.response['Error']['Message']
+        logger.error("Provisioning %s failed: %s: %s.", event['device_id'],
+                     error_code, error_message)
 
-    # Return the certificate to API Gateway.
-    return certificate_body
+    # The device polls the pre-signed URL, so always leave it an answer.
+    store_result(event['key'], payload)
+    return payload['status']
+
+def provision_record(body: str, region: str, account: str) -> bool:
+    """
+    Provision one queued device. The message body carries the same base64
+    CSR the API sends in the device-csr header: {"device-csr": "..."}, and
+    with SKU routing optionally the SKU: {"device-csr": "...", "sku": "..."}.
+    """
+    message = json.loads(body)
+    csr = base64.b64decode(message['device-csr'])
+    sku = SKU_CONFIG.get(message['sku']) if message.get('sku') else request_config({}, csr)
+    device_id = get_cn_attribute(csr)
+    digest = csr_digest(csr)
+    # A redelivered message for an already provisioned device is done
+    if recent_issuance(device_id, digest) is not None:
+        return True
+    response = provision_certificate(csr)
+    if not response:
+        return False
+    if not complete_provisioning(device_id, response['certificateArn'], region, account, sku):
+        return False
+    record_issuance(device_id, digest, response['certificatePem'], response['certificateArn'])
+    return True
+
+@instrumented('issuer_iotcore_batch')
+@within_deadline
+def sqs_handler(event: dict, context: LambdaContext):
+    """
+    Batch provisioning entry point for factory pre-provisioning. Records
+    are provisioned with bounded concurrency and only the failed ones are
+    reported back, so SQS redelivers just those.
+    """
+    region = context.invoked_function_arn.split(":")[3]
+    account = context.invoked_function_arn.split(":")[4]
+    # Powertools is only needed on the batch path, so it is not loaded for
+    # API invocations.
+    # pylint: disable-next=import-outside-toplevel
+    from aws_lambda_powertools.utilities.data_classes import SQSEvent
+    records = list(SQSEvent(event).records)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(SQS_CONCURRENCY, len(records)))) as pool:
+        futures = [(record.message_id,
+                    pool.submit(run_in_context(provision_record), record.body, region, account))
+                   for record in records]
+
+    failures = []
+    for message_id, future in futures:
+        error = future.exception()
+        if error is not None:
+            logger.error("Record %s failed: %s", message_id, error)
+        if error is not None or future.result() is False:
+            failures.append({ 'itemIdentifier': message_id })
+
+    logger.info("Provisioned %d of %d records.", len(records) - len(failures), len(records))
+    return { 'batchItemFailures': failures }
@@ -0,0 +1,70 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Lambda function consuming the provisioning table stream and folding every
+registration, key change and removal into the authorizer's key index, and
+every registration into its membership filter
+"""
+import logging
+import os
+from key_utils import item_fingerprint
+from keyindex_utils import TOMBSTONE, index_key, publish_changes
+from membership_utils import add_members
+from metrics_utils import instrumented, span
+
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+def record_change(record: dict) -> tuple:
+    """
+    The index key and fingerprint bytes for one stream record, TOMBSTONE
+    for a removal, or None when the new image carries no usable key.
+    """
+    device_id = record['dynamodb']['Keys']['device-id']['S']
+    if record['eventName'] == 'REMOVE':
+        return index_key(device_id), TOMBSTONE
+    try:
+        fingerprint = item_fingerprint(record['dynamodb'].get('NewImage', {}))
+    except ValueError as error:
+        logger.error("Device [%s] public key could not be loaded: %s.", device_id, error)
+        return None
+    if fingerprint is None:
+        return None
+    return index_key(device_id), bytes.fromhex(fingerprint)
+
+@instrumented('key_index')
+def lambda_handler(event, context):
+    """
+    Stream records arrive in order per item, so a later record for the same
+    device-id overrides an earlier one. A failed publish raises and the
+    batch is retried by the event source mapping; both publishes are
+    idempotent, so a retried batch is harmless.
+    """
+    changes = {}
+    members = set()
+    for record in event['Records']:
+        if record['eventName'] != 'REMOVE':
+            members.add(record['dynamodb']['Keys']['device-id']['S'])
+        change = record_change(record)
+        if change is not None:
+            changes[change[0]] = change[1]
+
+    result = { 'changes': len(changes) }
+    # Removed device-ids stay in the filter until the next rebuild; the
+    # authorizer then reads the table and refuses them there
+    if members and os.environ.get('MEMBERSHIP_BUCKET'):
+        with span('membership_publish'):
+            added = add_members(members, os.environ['MEMBERSHIP_BUCKET'],
+                                os.environ.get('MEMBERSHIP_KEY', 'membership/device-ids.bloom'))
+        if added is not None:
+            result['members'] = added
+
+    if changes:
+        with span('index_publish'):
+            manifest = publish_changes(changes, os.environ['KEY_INDEX_BUCKET'],
+                                       prefix=os.environ.get('KEY_INDEX_PREFIX', 'keyindex'))
+        logger.info("Key index version %d: %d records, %d in delta.", manifest['version'],
+                    manifest['records'], manifest['delta_records'])
+        result['version'] = manifest['version']
+    return result
@@ -0,0 +1,59 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Two-phase (asynchronous) issuance helpers. The API facing handler submits
+the issuance, hands the remaining steps to a worker function, and answers
+202 with a pre-signed S3 URL from which the device retrieves its
+certificate once the worker has written it. The synchronous answers are
+built with proxy_response() as well, so both modes give API Gateway's
+Lambda proxy integration the same response shape.
+"""
+import json
+import os
+import logging
+from aws_utils import get_client
+
+logger = logging.getLogger()
+
+def async_enabled() -> bool:
+    """True when the issuers should answer 202 and defer to the worker"""
+    return os.environ.get('ASYNC_ISSUANCE', 'false').lower() in ('1', 'true', 'yes')
+
+def certificate_key( device_id: str, request_id: str ) -> str:
+    """Object key under which the worker writes the issuance result"""
+    return "{0}/{1}.json".format(device_id, request_id)
+
+def retrieval_url( key: str, s3=None ) -> str:
+    """Pre-signed GET URL for the issuance result object"""
+    s3 = s3 or get_client('s3')
+    return s3.generate_presigned_url( 'get_object',
+                                      Params={ 'Bucket': os.environ['CERTIFICATE_BUCKET'],
+                                               'Key': key },
+                                      ExpiresIn=int(os.environ.get('RETRIEVAL_URL_TTL', '3600')) )
+
+def dispatch_worker( payload: dict ):
+    """Invoke the issuance worker function without waiting for it"""
+    awslambda = get_client('lambda')
+    awslambda.invoke( FunctionName=os.environ['ISSUANCE_WORKER_FUNCTION'],
+                      InvocationType='Event',
+                      Payload=json.dumps(payload).encode('utf-8') )
+
+def store_result( key: str, result: dict, s3=None ):
+    """Write the issuance result where the pre-signed URL points"""
+    s3 = s3 or get_client('s3')
+    s3.put_object( Bucket=os.environ['CERTIFICATE_BUCKET'],
+                   Key=key,
+                   Body=json.dumps(result).encode('utf-8'),
+                   ContentType='application/json' )
+
+def proxy_response( status: int, body: str, headers: dict = None ) -> dict:
+    """A Lambda proxy integration answer; the body is JSON unless headers say otherwise"""
+    return { 'statusCode': status,
+             'headers': { 'Content-Type': 'application/json', **( headers or {} ) },
+             'body': body }
+
+def accepted_response( url: str ) -> dict:
+    """The 202 answer handed back through API Gateway"""
+    return proxy_response( 202, json.dumps({ 'status': 'PENDING', 'location': url }),
+                           { 'Location': url } )
@@ -0,0 +1,81 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+AWS client access for the secretfree Lambda functions. boto3 is imported on
+first use rather than at module load: it is the single largest contributor
+to cold start import time, and requests rejected before any AWS call never
+pay for it.
+
+Clients are created once per container for each service and region and
+shared by every request and thread, so service models are loaded once and
+keep-alive connections in the client's pool are reused across invocations.
+"""
+import os
+import threading
+
+_CLIENTS = {}
+_LOCK = threading.Lock()
+
+# Services whose calls all go through ratelimit_utils.rate_limited, which
+# retries throttles and transient errors itself. Retries in the client
+# underneath would multiply the attempts of every call and hide throttles
+# from the limiter, so their clients make a single attempt.
+RATE_LIMITED_SERVICES = frozenset({ 'iot', 'acm-pca' })
+SINGLE_ATTEMPT = { 'mode': 'standard', 'total_max_attempts': 1 }
+
+def client_config(**overrides):
+    """
+    botocore configuration of every client: TCP keep-alive, a connection
+    pool large enough for the provisioning pool's parallel calls, bounded
+    connect and read timeouts, and adaptive retries. Keyword arguments
+    replace individual settings.
+    """
+    from botocore.config import Config  # pylint: disable=import-outside-toplevel
+    config = Config(tcp_keepalive=True,
+                    max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '16')),
+                    connect_timeout=float(os.environ.get('AWS_CONNECT_TIMEOUT', '2')),
+                    read_timeout=float(os.environ.get('AWS_READ_TIMEOUT', '10')),
+                    retries={ 'mode': os.environ.get('AWS_RETRY_MODE', 'adaptive'),
+                              'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '3')) })
+    return config.merge(Config(**overrides)) if overrides else config
+
+def _region(region_name: str = None) -> str:
+    return region_name or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+
+def get_client(service_name: str, region_name: str = None, **overrides):
+    """
+    The container's boto3 client for service_name in region_name; clients
+    with overridden config settings are cached separately. Clients of
+    RATE_LIMITED_SERVICES make a single attempt unless retries are given.
+    """
+    if service_name in RATE_LIMITED_SERVICES:
+        overrides.setdefault('retries', SINGLE_ATTEMPT)
+    key = (service_name, _region(region_name), repr(sorted(overrides.items())))
+    client = _CLIENTS.get(key)
+    if client is None:
+        # Creation through the default session is not thread safe
+        with _LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                import boto3  # pylint: disable=import-outside-toplevel
+                client = boto3.client(service_name, region_name=key[1],
+                                      config=client_config(**overrides))
+                _CLIENTS[key] = client
+    return client
+
+def reset_clients():
+    """Drop every cached client, e.g. after the default session changed"""
+    with _LOCK:
+        _CLIENTS.clear()
+
+def warm_up(services: str = None):
+    """
+    Create the clients for a comma separated list of services, by default
+    from AWS_CLIENT_WARM_UP, so that the Lambda init phase rather than the
+    first request pays for loading boto3 and the service models. Nothing
+    happens when no services are named.
+    """
+    services = os.environ.get('AWS_CLIENT_WARM_UP', '') if services is None else services
+    for service_name in filter(None, (name.strip() for name in services.split(','))):
+        get_client(service_name)
@@ -0,0 +1,75 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Warm container caching primitives shared by the secretfree Lambda functions
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class TtlLruCache:
+    """
+    Bounded least-recently-used cache where every entry also expires after
+    a fixed time-to-live. The cache lives for the life of the container, so
+    it is meant to be instantiated at module level. A maxsize or ttl of zero
+    disables caching entirely.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, clock=time.monotonic):
+        self.maxsize = max(0, maxsize)
+        self.ttl = max(0.0, ttl)
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        """True when the cache is able to hold entries"""
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on a miss or expiry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Store value for key, evicting the least recently used entry if full"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop a single key, or every entry when no key is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and occupancy, suitable for logging"""
+        with self._lock:
+            return { 'hits': self.hits,
+                     'misses': self.misses,
+                     'size': len(self._entries),
+                     'maxsize': self.maxsize,
+                     'ttl': self.ttl }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
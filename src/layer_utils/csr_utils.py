@@ -0,0 +1,132 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Certificate signing request helpers built on cryptography, and the staged
+screening of the device-csr header. The screening stages run cheapest
+first, so junk is refused by a length or alphabet check before anything
+pays for ASN.1 parsing; every refusal names its stage and reason.
+"""
+import base64
+import binascii
+import os
+import re
+from dataclasses import dataclass
+from cryptography.x509 import (load_pem_x509_csr, load_der_x509_csr,
+                               CertificateSigningRequest)
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+# base64 of a PEM CSR for an RSA 4096 key with a modest subject is ~2.5k
+MAX_HEADER_LENGTH = int(os.environ.get('CSR_MAX_HEADER_LENGTH', '8192'))
+MAX_DEVICE_ID = 64
+
+_BASE64 = re.compile(r'[A-Za-z0-9+/]*={0,2}')
+_PEM = re.compile(rb'\s*-----BEGIN (NEW )?CERTIFICATE REQUEST-----\r?\n'
+                  rb'([A-Za-z0-9+/=\r\n]+)'
+                  rb'-----END (NEW )?CERTIFICATE REQUEST-----\s*')
+
+class CsrRejected(ValueError):
+    """A device-csr refused by one of the screening stages"""
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f'{stage}: {reason}')
+        self.stage = stage
+        self.reason = reason
+
+@dataclass
+class ScreenedCsr:
+    """A device-csr that passed every stage up to the device-id"""
+    pem: bytes
+    req: CertificateSigningRequest
+    device_id: str
+
+def load_csr(csr: bytes) -> CertificateSigningRequest:
+    """Parse a PEM encoded certificate signing request"""
+    return load_pem_x509_csr(csr)
+
+def common_name(req: CertificateSigningRequest) -> str:
+    """The subject CN, which carries the device-id"""
+    return str(req.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value)
+
+def public_key_der(req: CertificateSigningRequest) -> bytes:
+    """The request's public key as DER encoded SubjectPublicKeyInfo"""
+    return req.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+
+def decode_header(header, max_length: int = MAX_HEADER_LENGTH) -> bytes:
+    """Stages 'header' and 'base64': the PEM carried by the header value"""
+    if not isinstance(header, str) or not header:
+        raise CsrRejected('header', 'missing')
+    if len(header) > max_length:
+        raise CsrRejected('header', 'too_long')
+    if len(header) % 4 or not _BASE64.fullmatch(header):
+        raise CsrRejected('base64', 'alphabet')
+    return base64.b64decode(header)
+
+def pem_body(pem: bytes) -> bytes:
+    """Stage 'pem': the DER inside the CERTIFICATE REQUEST armor"""
+    match = _PEM.fullmatch(pem)
+    if match is None:
+        raise CsrRejected('pem', 'armor')
+    try:
+        return base64.b64decode(re.sub(rb'\s', b'', match.group(2)), validate=True)
+    except binascii.Error as error:
+        raise CsrRejected('pem', 'body') from error
+
+def check_der_length(der: bytes):
+    """Stage 'der': a single SEQUENCE whose length prefix covers the data exactly"""
+    if len(der) < 2 or der[0] != 0x30:
+        raise CsrRejected('der', 'not_sequence')
+    size = der[1]
+    offset = 2
+    if size & 0x80:
+        count = size & 0x7f
+        # Indefinite lengths are not DER; four length bytes is already 4GB
+        if count == 0 or count > 4 or len(der) < 2 + count:
+            raise CsrRejected('der', 'length')
+        size = int.from_bytes(der[2:2 + count], 'big')
+        offset += count
+    if offset + size != len(der):
+        raise CsrRejected('der', 'length')
+
+def parse_der(der: bytes) -> CertificateSigningRequest:
+    """Stage 'asn1': the full parse, only for data that looks like a CSR"""
+    try:
+        return load_der_x509_csr(der)
+    except ValueError as error:
+        raise CsrRejected('asn1', 'malformed') from error
+
+def device_id_of(req: CertificateSigningRequest) -> str:
+    """Stage 'subject': the device-id in the CN"""
+    try:
+        names = req.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    except ValueError as error:
+        raise CsrRejected('subject', 'malformed') from error
+    if len(names) != 1:
+        raise CsrRejected('subject', 'common_name')
+    device_id = str(names[0].value)
+    if not device_id or len(device_id) > MAX_DEVICE_ID:
+        raise CsrRejected('subject', 'device_id')
+    return device_id
+
+def screen_csr(header, max_length: int = MAX_HEADER_LENGTH) -> ScreenedCsr:
+    """
+    Run the cheap stages over a device-csr header value and return the
+    parsed request and its device-id. Raises CsrRejected at the first
+    stage that refuses it. The signature is not checked here: see
+    verify_signature.
+    """
+    pem = decode_header(header, max_length)
+    der = pem_body(pem)
+    check_der_length(der)
+    req = parse_der(der)
+    return ScreenedCsr(pem, req, device_id_of(req))
+
+def verify_signature(req: CertificateSigningRequest):
+    """Stage 'signature': proof the requester holds the private key"""
+    try:
+        valid = req.is_signature_valid
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        # Unsupported or malformed key and signature algorithms
+        raise CsrRejected('signature', 'unsupported') from error
+    if not valid:
+        raise CsrRejected('signature', 'invalid')
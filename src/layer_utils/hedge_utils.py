@@ -0,0 +1,154 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Hedged reads across the replicas of a DynamoDB global table. A read goes
+to the preferred region first; when it has not answered within that
+region's recent latency percentile, the same read is sent to the next
+region and whichever answer arrives first is used. Per-region latency is
+tracked from every completed read, including the ones that lost the race,
+so the preferred region follows whichever replica is currently fastest.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger()
+
+# Shared by every hedged read of the container; losers finish in the background
+HEDGE_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get('HEDGE_WORKERS', '8')),
+                                thread_name_prefix='hedge')
+
+class LookupUnavailable(RuntimeError):
+    """No region answered within the deadline"""
+
+class RegionLatency:
+    """Recent read latencies and failures of one region"""
+    def __init__(self, region: str, window: int = 128):
+        self.region = region
+        self.samples = deque(maxlen=window)
+        self.failures = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, failed: bool = False):
+        """Add the outcome of one completed read"""
+        with self._lock:
+            self.samples.append(seconds)
+            self.failures.append(1 if failed else 0)
+
+    def percentile(self, pct: float) -> float:
+        """Nearest rank percentile of the recent latencies, None without samples"""
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+        return ordered[rank]
+
+    def failure_rate(self) -> float:
+        """Share of the recent reads that failed"""
+        with self._lock:
+            return sum(self.failures) / len(self.failures) if self.failures else 0.0
+
+    def __len__(self):
+        return len(self.samples)
+
+class HedgedLookup:
+    """
+    Reads through fetch(region) from the regions of a global table, in the
+    configured order until enough samples rank them by median latency,
+    penalized by failure rate. Results rejected by accept(), such as a
+    missing item that may simply not have replicated yet, are confirmed
+    with the next region before being returned.
+    """
+    def __init__(self, regions: list, hedge_percentile: float = 95.0, min_delay: float = 0.01,
+                 max_delay: float = 0.2, timeout: float = 1.0, min_samples: int = 10,
+                 window: int = 128, pool: ThreadPoolExecutor = None, clock=time.perf_counter):
+        if not regions:
+            raise ValueError("A hedged lookup needs at least one region")
+        self.regions = list(regions)
+        self.hedge_percentile = hedge_percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.min_samples = min_samples
+        self.latency = { region: RegionLatency(region, window) for region in self.regions }
+        self.hedges = 0
+        self._pool = pool or HEDGE_POOL
+        self._clock = clock
+
+    def ranked(self) -> list:
+        """Regions in order of preference"""
+        def score(region: str):
+            stats = self.latency[region]
+            if len(stats) < self.min_samples:
+                # Not enough data: keep the configured order, the local replica first
+                return (1, self.regions.index(region))
+            median = stats.percentile(50)
+            return (0, median * (1.0 + 10.0 * stats.failure_rate()))
+        return sorted(self.regions, key=score)
+
+    def hedge_delay(self, region: str) -> float:
+        """How long to wait on region before hedging to the next one"""
+        delay = self.latency[region].percentile(self.hedge_percentile)
+        if delay is None or len(self.latency[region]) < self.min_samples:
+            return self.max_delay
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def _submit(self, fetch, region: str):
+        def timed():
+            start = self._clock()
+            try:
+                result = fetch(region)
+            except Exception:
+                self.latency[region].record(self._clock() - start, failed=True)
+                raise
+            self.latency[region].record(self._clock() - start)
+            return result
+        future = self._pool.submit(timed)
+        future.region = region
+        return future
+
+    def call(self, fetch, accept=lambda result: True):
+        """
+        The first accepted result of fetch(region). Falls back to a result
+        accept() rejected when no region has a better one, and raises the
+        last error, or LookupUnavailable, when no region answered in time.
+        """
+        deadline = self._clock() + self.timeout
+        remaining = self.ranked()
+        pending = { self._submit(fetch, remaining.pop(0)) }
+        fallback, error = None, None
+        have_fallback = False
+        while pending:
+            # Hedge once the oldest read is slower than its region usually is
+            delay = self.hedge_delay(next(iter(pending)).region) if remaining else None
+            budget = max(0.0, deadline - self._clock())
+            done, pending = wait(pending, timeout=budget if delay is None else min(budget, delay),
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except (ClientError, BotoCoreError, OSError) as failure:
+                    error = failure
+                    logger.warning("Lookup in %s failed: %s.", future.region, failure)
+                    continue
+                if accept(result):
+                    return result
+                fallback, have_fallback = result, True
+            if self._clock() >= deadline:
+                break
+            if remaining:
+                # The read failed, was not accepted or is slow: ask the next region
+                if not done:
+                    self.hedges += 1
+                pending.add(self._submit(fetch, remaining.pop(0)))
+        if have_fallback:
+            return fallback
+        if error is not None:
+            raise error
+        raise LookupUnavailable("No region answered within %.3fs" % self.timeout)
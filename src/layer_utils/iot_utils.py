@@ -0,0 +1,116 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Warm container registry of AWS IoT control plane values that are static per
+SKU and region: whether the SKU policy exists (and the document it was
+rendered with) and the ATS data endpoint.
+"""
+import os
+import logging
+from botocore.exceptions import ClientError
+from cache_utils import TtlLruCache
+from ratelimit_utils import rate_limited
+
+logger = logging.getLogger()
+
+REGISTRY_CACHE = TtlLruCache(maxsize=int(os.environ.get('REGISTRY_CACHE_SIZE', '64')),
+                             ttl=float(os.environ.get('REGISTRY_CACHE_TTL', '3600')))
+
+# The policy is an example for deploying a single policy for a given SKU.
+# For simplicity, the policy is the same as what is deployed for the Python
+# example from the Onboard Wizard.
+POLICY_TEMPLATE = '''{{
+  "Version": "2012-10-17",
+  "Statement": [
+    {{
+      "Effect": "Allow",
+      "Action": [
+        "iot:Publish",
+        "iot:Receive"
+      ],
+      "Resource": [
+        "arn:aws:iot:{0}:{1}:topic/sdk/test/java",
+        "arn:aws:iot:{0}:{1}:topic/sdk/test/Python",
+        "arn:aws:iot:{0}:{1}:topic/topic_1",
+        "arn:aws:iot:{0}:{1}:topic/topic_2"
+      ]
+    }},
+    {{
+      "Effect": "Allow",
+      "Action": [
+        "iot:Subscribe"
+      ],
+      "Resource": [
+        "arn:aws:iot:{0}:{1}:topicfilter/sdk/test/java",
+        "arn:aws:iot:{0}:{1}:topicfilter/sdk/test/Python",
+        "arn:aws:iot:{0}:{1}:topicfilter/topic_1",
+        "arn:aws:iot:{0}:{1}:topicfilter/topic_2"
+      ]
+    }},
+    {{
+      "Effect": "Allow",
+      "Action": [
+        "iot:Connect"
+      ],
+      "Resource": [
+        "arn:aws:iot:{0}:{1}:client/sdk-java",
+        "arn:aws:iot:{0}:{1}:client/basicPubSub",
+        "arn:aws:iot:{0}:{1}:client/sdk-nodejs-*"
+      ]
+    }}
+  ]
+}}'''
+
+def render_policy(region: str, account: str, template: str = None) -> str:
+    """
+    The SKU policy document for a region and account, from template or by
+    default POLICY_TEMPLATE. Templates use {0} for the region and {1} for
+    the account.
+    """
+    return (template or POLICY_TEMPLATE).format(region, account)
+
+def ensure_policy(iot, policy_name: str, region: str, account: str,
+                  template: str = None) -> str:
+    """
+    Make sure the SKU policy exists, creating it from template on first
+    use, and return its document. Looked up once per (region, account, SKU)
+    per container. A create_policy race lost to a concurrent invocation
+    counts as success.
+    """
+    key = ('policy', region, account, policy_name)
+    document = REGISTRY_CACHE.get(key)
+    if document is not None:
+        return document
+
+    try:
+        document = rate_limited('GetPolicy', iot.get_policy,
+                                policyName=policy_name)['policyDocument']
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ResourceNotFoundException':
+            raise error
+        document = render_policy(region, account, template)
+        try:
+            rate_limited('CreatePolicy', iot.create_policy,
+                         policyName=policy_name, policyDocument=document)
+        except ClientError as error_cr:
+            if error_cr.response['Error']['Code'] != 'ResourceAlreadyExistsException':
+                raise error_cr
+            logger.info("Policy [%s] was created concurrently.", policy_name)
+
+    REGISTRY_CACHE.put(key, document)
+    return document
+
+def data_endpoint(iot, region: str, account: str) -> str:
+    """The iot:Data-ATS endpoint address, looked up once per container"""
+    key = ('endpoint', region, account)
+    endpoint = REGISTRY_CACHE.get(key)
+    if endpoint is None:
+        endpoint = rate_limited('DescribeEndpoint', iot.describe_endpoint,
+                                endpointType='iot:Data-ATS')['endpointAddress']
+        REGISTRY_CACHE.put(key, endpoint)
+    return endpoint
+
+def invalidate_registry():
+    """Forget every cached registry value"""
+    REGISTRY_CACHE.invalidate()
@@ -0,0 +1,138 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Helpers for recognizing repeated issuance of the same certificate request
+"""
+import hashlib
+import hmac
+import logging
+import os
+import time
+from botocore.exceptions import ClientError
+from cryptography import x509
+from aws_utils import get_client
+
+logger = logging.getLogger()
+
+# ACM PCA honours an IssueCertificate idempotency token for five minutes
+IDEMPOTENCY_WINDOW = int(os.environ.get('IDEMPOTENCY_WINDOW', '300'))
+
+# A device presenting the CSR it was last issued a certificate for within
+# this many seconds gets that certificate back instead of a new one.
+REISSUE_WINDOW = int(os.environ.get('REISSUE_WINDOW', '600'))
+
+def csr_digest(csr: bytes) -> str:
+    """Hex SHA-256 of the PEM CSR, ignoring surrounding whitespace"""
+    return hashlib.sha256(csr.strip()).hexdigest()
+
+def idempotency_token(csr: bytes, device_id: str, window: int = IDEMPOTENCY_WINDOW,
+                      now: float = None) -> str:
+    """
+    Deterministic IssueCertificate idempotency token. A device retrying the
+    same CSR within the same time bucket gets the same token, so ACM PCA
+    answers with the certificate it already issued instead of minting a
+    new one. The token is capped at the 36 characters ACM PCA accepts.
+    """
+    bucket = int((time.time() if now is None else now) // max(1, window))
+    digest = hashlib.sha256()
+    digest.update(device_id.encode('utf-8'))
+    digest.update(b'\n')
+    digest.update(str(bucket).encode('ascii'))
+    digest.update(b'\n')
+    digest.update(csr.strip())
+    return digest.hexdigest()[:36]
+
+def authorizer_context(device_id: str, fingerprint: str, csr: bytes, sku: str = None) -> dict:
+    """
+    The identity the authorizer verified, handed to the issuers through the
+    API Gateway authorizer context so they need not parse the CSR again.
+    """
+    context = { 'deviceId': device_id,
+                'keyFingerprint': fingerprint,
+                'csrDigest': csr_digest(csr) }
+    if sku:
+        context['sku'] = sku
+    return context
+
+def _verified_context(event: dict, csr: bytes) -> dict:
+    """The authorizer context when it was produced for this CSR, else {}"""
+    context = (event.get('requestContext') or {}).get('authorizer') or {}
+    digest = context.get('csrDigest')
+    if not context.get('deviceId') or not digest:
+        return {}
+    if not hmac.compare_digest(digest, csr_digest(csr)):
+        return {}
+    return context
+
+def verified_device_id(event: dict, csr: bytes) -> str:
+    """
+    The device-id from the authorizer context, or None when there is no
+    context or it was produced for a different CSR (e.g. a cached
+    authorizer result), in which case the caller must parse the CSR.
+    """
+    return _verified_context(event, csr).get('deviceId')
+
+def verified_sku(event: dict, csr: bytes) -> str:
+    """The SKU the authorizer resolved for this CSR, or None"""
+    return _verified_context(event, csr).get('sku')
+
+def record_issuance(device_id: str, digest: str, certificate: str, certificate_arn: str,
+                    window: int = REISSUE_WINDOW, now: float = None, ddb=None) -> bool:
+    """
+    Record the certificate issued for a CSR in the issuance table, named by
+    ISSUANCE_TABLENAME, replacing the device's previous record. The record
+    outlives the reissue window: the stale certificate cleanup keeps the
+    certificate it names. Recording is best effort: False when disabled or
+    the write failed.
+    """
+    table_name = os.environ.get('ISSUANCE_TABLENAME')
+    if not table_name or window <= 0:
+        return False
+    issued_at = int(time.time() if now is None else now)
+    serial = x509.load_pem_x509_certificate(certificate.encode('ascii')).serial_number
+    ddb = ddb or get_client('dynamodb')
+    try:
+        ddb.put_item(TableName=table_name,
+                     Item={ 'device-id': { 'S': device_id },
+                            'csr_digest': { 'S': digest },
+                            'certificate': { 'S': certificate },
+                            'certificate_arn': { 'S': certificate_arn },
+                            'serial': { 'S': format(serial, 'x') },
+                            'issued_at': { 'N': str(issued_at) } })
+        return True
+    except ClientError as error:
+        error_code = error.response['Error']['Code']
+        error_message = error.response['Error']['Message']
+        logger.error("Issuance record for [%s] not written: %s: %s.",
+                     device_id, error_code, error_message)
+        return False
+
+def recent_issuance(device_id: str, digest: str, window: int = REISSUE_WINDOW,
+                    now: float = None, ddb=None) -> dict:
+    """
+    The certificate recorded for this device and CSR digest when it was
+    issued within the window, else None. Lookup failures are a miss.
+    """
+    table_name = os.environ.get('ISSUANCE_TABLENAME')
+    if not table_name or window <= 0:
+        return None
+    ddb = ddb or get_client('dynamodb')
+    try:
+        item = ddb.get_item(TableName=table_name,
+                            Key={ 'device-id': { 'S': device_id } }).get('Item')
+    except ClientError as error:
+        error_code = error.response['Error']['Code']
+        error_message = error.response['Error']['Message']
+        logger.error("Issuance record for [%s] not read: %s: %s.",
+                     device_id, error_code, error_message)
+        return None
+    if item is None or not hmac.compare_digest(item['csr_digest']['S'], digest):
+        return None
+    issued_at = int(item['issued_at']['N'])
+    if (time.time() if now is None else now) - issued_at > window:
+        return None
+    return { 'certificate': item['certificate']['S'],
+             'certificate_arn': item['certificate_arn']['S'],
+             'serial': item['serial']['S'],
+             'issued_at': issued_at }
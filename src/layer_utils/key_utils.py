@@ -0,0 +1,94 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Public key helpers shared by the authorizer and the device registration tools
+"""
+import base64
+import hashlib
+import hmac
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import (load_pem_public_key,
+                                                          load_der_public_key,
+                                                          Encoding, PublicFormat)
+
+# DynamoDB attribute holding the canonical SPKI SHA-256 fingerprint
+FINGERPRINT_ATTRIBUTE = 'fingerprint'
+
+# Legacy string attribute: base64 of the PEM SubjectPublicKeyInfo
+PUBKEY_ATTRIBUTE = 'pubkey'
+# Compact binary attribute, interpreted according to the key type tag
+PUBKEY_DER_ATTRIBUTE = 'pubkey_der'
+KEYTYPE_ATTRIBUTE = 'keytype'
+
+# Key type tags: DER SubjectPublicKeyInfo, or a compressed SEC1 EC point
+KEYTYPE_SPKI = 'spki'
+EC_POINT_CURVES = { 'ec-p256': ec.SECP256R1, 'ec-p384': ec.SECP384R1 }
+
+def spki_fingerprint(spki_der: bytes) -> str:
+    """
+    Canonical fingerprint of a public key: the lowercase hex SHA-256 digest
+    of its DER encoded SubjectPublicKeyInfo.
+    """
+    return hashlib.sha256(spki_der).hexdigest()
+
+def fingerprints_match(expected: str, actual: str) -> bool:
+    """Constant time comparison of two fingerprints"""
+    if expected is None or actual is None:
+        return False
+    return hmac.compare_digest(expected.lower().encode('ascii'),
+                               actual.lower().encode('ascii'))
+
+def compact_public_key(key) -> tuple:
+    """
+    The key type tag and smallest stored form of a public key: the
+    compressed point for the named EC curves, DER SubjectPublicKeyInfo
+    for anything else.
+    """
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        for keytype, curve in EC_POINT_CURVES.items():
+            if isinstance(key.curve, curve):
+                return keytype, key.public_bytes(Encoding.X962, PublicFormat.CompressedPoint)
+    return KEYTYPE_SPKI, key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+
+def load_compact_public_key(keytype: str, data: bytes):
+    """Load a key stored by compact_public_key; ValueError if it does not load"""
+    if keytype == KEYTYPE_SPKI:
+        return load_der_public_key(data)
+    if keytype in EC_POINT_CURVES:
+        return ec.EllipticCurvePublicKey.from_encoded_point(EC_POINT_CURVES[keytype](), data)
+    raise ValueError("Unknown key type %s" % keytype)
+
+def _binary(value: dict) -> bytes:
+    # boto3 hands back bytes; stream records in Lambda events carry base64
+    data = value['B']
+    return base64.b64decode(data) if isinstance(data, str) else bytes(data)
+
+def item_public_key(item: dict):
+    """
+    The public key of a provisioning table item in DynamoDB JSON, read from
+    the compact binary attribute or else the legacy base64 PEM one. None
+    when the item has neither; ValueError when the stored key cannot be
+    loaded.
+    """
+    if PUBKEY_DER_ATTRIBUTE in item:
+        keytype = item.get(KEYTYPE_ATTRIBUTE, { 'S': KEYTYPE_SPKI })['S']
+        return load_compact_public_key(keytype, _binary(item[PUBKEY_DER_ATTRIBUTE]))
+    if PUBKEY_ATTRIBUTE in item:
+        # Whole key is base64 encoded for maintaining textual integrity
+        return load_pem_public_key(base64.b64decode(item[PUBKEY_ATTRIBUTE]['S']))
+    return None
+
+def item_fingerprint(item: dict) -> str:
+    """
+    Fingerprint of a provisioning table item in DynamoDB JSON. Items that
+    carry a precomputed fingerprint are used as-is; others are fingerprinted
+    from whichever key format they hold. None when the item has no key;
+    ValueError when the stored key cannot be loaded.
+    """
+    if FINGERPRINT_ATTRIBUTE in item:
+        return item[FINGERPRINT_ATTRIBUTE]['S']
+    key = item_public_key(item)
+    if key is None:
+        return None
+    return spki_fingerprint(key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo))
@@ -0,0 +1,321 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Precomputed device-id to key fingerprint index kept in S3 next to the
+membership filter. The index is a sorted, fixed width binary snapshot plus
+a small delta of the changes streamed from the provisioning table since the
+snapshot was written. A manifest object names the current pair and is only
+ever replaced conditionally on its ETag, so concurrent writers cannot lose
+each other's changes.
+
+Layout of a snapshot or delta object: a header (magic, format version,
+record count) followed by records of the first 16 bytes of SHA-256 of the
+device-id and the 32 byte SPKI SHA-256 fingerprint, sorted by the former.
+A fingerprint of all zeros is a tombstone for a removed device.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from botocore.exceptions import ClientError
+from aws_utils import get_client
+
+logger = logging.getLogger()
+
+KEY_INDEX_PREFIX = os.environ.get('KEY_INDEX_PREFIX', 'keyindex')
+KEY_INDEX_COMPACT_AT = int(os.environ.get('KEY_INDEX_COMPACT_AT', '10000'))
+
+MAGIC = b'SFKI'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>4sIQ')
+KEY_SIZE = 16
+FINGERPRINT_SIZE = 32
+RECORD_SIZE = KEY_SIZE + FINGERPRINT_SIZE
+TOMBSTONE = bytes(FINGERPRINT_SIZE)
+
+class IndexConflict(RuntimeError):
+    """The manifest kept changing underneath a writer"""
+
+def index_key(device_id: str) -> bytes:
+    """Fixed width index key of a device-id"""
+    return hashlib.sha256(device_id.encode('utf-8')).digest()[:KEY_SIZE]
+
+def encode_records(records: dict) -> bytes:
+    """Serialize index key to fingerprint records, sorted by key"""
+    body = b''.join(key + records[key] for key in sorted(records))
+    return HEADER.pack(MAGIC, FORMAT_VERSION, len(records)) + body
+
+def _check_header(data) -> int:
+    if len(data) < HEADER.size:
+        raise ValueError("Key index data is truncated")
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a key index")
+    if len(data) != HEADER.size + count * RECORD_SIZE:
+        raise ValueError("Key index size does not match its record count")
+    return count
+
+def decode_records(data: bytes) -> dict:
+    """Load records serialized by encode_records"""
+    count = _check_header(data)
+    records = {}
+    for i in range(count):
+        offset = HEADER.size + i * RECORD_SIZE
+        records[data[offset:offset + KEY_SIZE]] = data[offset + KEY_SIZE:offset + RECORD_SIZE]
+    return records
+
+class SnapshotIndex:
+    """Binary search over a serialized snapshot held in a buffer or mmap"""
+    def __init__(self, buffer):
+        self.count = _check_header(buffer)
+        self._buffer = buffer
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, i: int) -> bytes:
+        offset = HEADER.size + i * RECORD_SIZE
+        return self._buffer[offset:offset + KEY_SIZE]
+
+    def find(self, key: bytes) -> bytes:
+        """The fingerprint bytes stored for key, or None"""
+        keys = _KeyView(self)
+        i = bisect.bisect_left(keys, key)
+        if i == self.count or self._key(i) != key:
+            return None
+        offset = HEADER.size + i * RECORD_SIZE + KEY_SIZE
+        return self._buffer[offset:offset + FINGERPRINT_SIZE]
+
+class _KeyView:
+    """Sequence of a snapshot's keys, so bisect can search it in place"""
+    def __init__(self, index: SnapshotIndex):
+        self._index = index
+    def __len__(self):
+        return self._index.count
+    def __getitem__(self, i: int) -> bytes:
+        return self._index._key(i)  # pylint: disable=protected-access
+
+def _object_key(prefix: str, kind: str, version: int) -> str:
+    # Competing writers derive the same version, so the name must not clash
+    return f'{prefix}/{kind}/{version:012d}-{uuid.uuid4().hex[:12]}.bin'
+
+def read_manifest(s3, bucket: str, prefix: str = KEY_INDEX_PREFIX) -> tuple:
+    """The current manifest and its ETag, or an empty manifest and None"""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f'{prefix}/manifest.json')
+    except ClientError as error:
+        if error.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}, None
+        raise
+    return json.loads(response['Body'].read()), response['ETag']
+
+def _read_records(s3, bucket: str, key: str) -> dict:
+    if not key:
+        return {}
+    return decode_records(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+def _delete_quietly(s3, bucket: str, key: str):
+    if not key:
+        return
+    try:
+        s3.delete_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        logger.warning("Superseded key index object %s not deleted: %s.",
+                       key, error.response['Error']['Code'])
+
+def _replace_manifest(s3, bucket: str, prefix: str, manifest: dict, etag: str) -> bool:
+    """Write manifest if the current one still has etag; False on conflict"""
+    conditions = { 'IfMatch': etag } if etag else { 'IfNoneMatch': '*' }
+    try:
+        s3.put_object(Bucket=bucket, Key=f'{prefix}/manifest.json',
+                      Body=json.dumps(manifest).encode('utf-8'),
+                      ContentType='application/json', **conditions)
+        return True
+    except ClientError as error:
+        if error.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            return False
+        raise
+
+def _publish(s3, bucket: str, prefix: str, attempts: int, build) -> dict:
+    """
+    Optimistic read-modify-write of the manifest. build(manifest) writes the
+    new objects and returns the new manifest plus the objects it supersedes.
+    """
+    for _ in range(max(1, attempts)):
+        manifest, etag = read_manifest(s3, bucket, prefix)
+        updated, superseded = build(manifest)
+        if _replace_manifest(s3, bucket, prefix, updated, etag):
+            for key in superseded:
+                _delete_quietly(s3, bucket, key)
+            return updated
+        # Lost the race; drop what this attempt wrote and start over
+        for key in (updated.get('snapshot'), updated.get('delta')):
+            if key not in (manifest.get('snapshot'), manifest.get('delta')):
+                _delete_quietly(s3, bucket, key)
+    raise IndexConflict("Key index manifest changed on every attempt")
+
+def publish_changes(changes: dict, bucket: str, prefix: str = KEY_INDEX_PREFIX,
+                    compact_at: int = KEY_INDEX_COMPACT_AT, attempts: int = 5,
+                    s3=None) -> dict:
+    """
+    Fold index key to fingerprint changes (TOMBSTONE for removals) into the
+    delta. Once the delta holds compact_at records, or there is no snapshot
+    yet, it is merged into a new snapshot instead.
+    """
+    s3 = s3 or get_client('s3')
+
+    def build(manifest: dict):
+        version = manifest.get('version', 0) + 1
+        delta = _read_records(s3, bucket, manifest.get('delta'))
+        delta.update(changes)
+        superseded = [manifest.get('delta')]
+        if manifest.get('snapshot') is None or len(delta) >= compact_at:
+            records = _read_records(s3, bucket, manifest.get('snapshot'))
+            _merge(records, delta)
+            key = _object_key(prefix, 'snapshots', version)
+            s3.put_object(Bucket=bucket, Key=key, Body=encode_records(records))
+            superseded.append(manifest.get('snapshot'))
+            return { 'version': version, 'snapshot': key, 'records': len(records),
+                     'delta': None, 'delta_records': 0 }, superseded
+        key = _object_key(prefix, 'deltas', version)
+        s3.put_object(Bucket=bucket, Key=key, Body=encode_records(delta))
+        return { 'version': version, 'snapshot': manifest['snapshot'],
+                 'records': manifest.get('records', 0),
+                 'delta': key, 'delta_records': len(delta) }, superseded
+
+    return _publish(s3, bucket, prefix, attempts, build)
+
+def publish_snapshot(records: dict, bucket: str, prefix: str = KEY_INDEX_PREFIX,
+                     attempts: int = 5, s3=None) -> dict:
+    """
+    Replace the snapshot with records, e.g. from a table scan. The current
+    delta is kept: it holds changes streamed while the scan ran.
+    """
+    s3 = s3 or get_client('s3')
+    records = { key: value for key, value in records.items() if value != TOMBSTONE }
+
+    def build(manifest: dict):
+        version = manifest.get('version', 0) + 1
+        key = _object_key(prefix, 'snapshots', version)
+        s3.put_object(Bucket=bucket, Key=key, Body=encode_records(records))
+        return { 'version': version, 'snapshot': key, 'records': len(records),
+                 'delta': manifest.get('delta'),
+                 'delta_records': manifest.get('delta_records', 0) }, [manifest.get('snapshot')]
+
+    return _publish(s3, bucket, prefix, attempts, build)
+
+def _merge(records: dict, delta: dict):
+    for key, value in delta.items():
+        if value == TOMBSTONE:
+            records.pop(key, None)
+        else:
+            records[key] = value
+
+class KeyIndex:
+    """
+    Container-lifetime view of the published index. The manifest is checked
+    at most once per refresh interval, conditionally on its ETag; a new
+    snapshot is downloaded to local storage and memory-mapped, and the delta
+    is held in memory. Lookups that miss return None and the caller falls
+    back to the table, which stays the source of truth.
+
+    Lookups take the snapshot and delta under the lock and search them
+    outside it. A replaced snapshot is therefore never closed explicitly:
+    its mapping is released once the last lookup still searching it lets
+    go of it.
+    """
+    def __init__(self, bucket: str = None, prefix: str = KEY_INDEX_PREFIX,
+                 refresh: float = 60.0, clock=time.monotonic, s3=None,
+                 directory: str = None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.refresh = max(0.0, refresh)
+        self._clock = clock
+        self._s3 = s3
+        self._directory = directory or tempfile.gettempdir()
+        self._lock = threading.Lock()
+        self._etag = None
+        self._next_check = None
+        self._snapshot_key = None
+        self._snapshot = None
+        self._delta = {}
+
+    @property
+    def enabled(self) -> bool:
+        """True when an index location is configured"""
+        return bool(self.bucket)
+
+    def lookup(self, device_id: str) -> str:
+        """The indexed fingerprint of device_id, or None when not indexed"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._refresh_if_due()
+            snapshot, delta = self._snapshot, self._delta
+        key = index_key(device_id)
+        value = delta.get(key)
+        if value is None and snapshot is not None:
+            value = snapshot.find(key)
+        if value is None or value == TOMBSTONE:
+            return None
+        return bytes(value).hex()
+
+    def invalidate(self):
+        """Check the manifest again on the next lookup"""
+        with self._lock:
+            self._etag = None
+            self._next_check = None
+
+    def _refresh_if_due(self):
+        # Called with the lock held
+        now = self._clock()
+        if self._next_check is not None and now < self._next_check:
+            return
+        self._next_check = now + self.refresh
+        s3 = self._s3 or get_client('s3')
+        arguments = { 'Bucket': self.bucket, 'Key': f'{self.prefix}/manifest.json' }
+        if self._etag:
+            arguments['IfNoneMatch'] = self._etag
+        try:
+            response = s3.get_object(**arguments)
+            manifest = json.loads(response['Body'].read())
+            snapshot = self._snapshot
+            if manifest.get('snapshot') != self._snapshot_key:
+                snapshot = self._map_snapshot(s3, manifest.get('snapshot'))
+            delta = _read_records(s3, self.bucket, manifest.get('delta'))
+            # Swap the pair together so no lookup sees one without the other
+            self._snapshot, self._snapshot_key = snapshot, manifest.get('snapshot')
+            self._delta = delta
+            self._etag = response['ETag']
+        except ClientError as error:
+            error_code = error.response['Error']['Code']
+            if error_code in ('304', 'NotModified'):
+                return
+            error_message = error.response['Error']['Message']
+            logger.error("Key index load failed: %s: %s.", error_code, error_message)
+        except ValueError as error:
+            logger.error("Key index is invalid: %s.", error)
+
+    def _map_snapshot(self, s3, key: str) -> SnapshotIndex:
+        """Download a snapshot and memory-map it, or None without a key"""
+        if not key:
+            return None
+        path = os.path.join(self._directory, 'secretfree-' + key.replace('/', '-'))
+        s3.download_file(self.bucket, key, path)
+        with open(path, 'rb') as handle:
+            mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        # The mapping keeps the data; the file is not needed any more
+        os.unlink(path)
+        try:
+            return SnapshotIndex(mapping)
+        except ValueError:
+            mapping.close()
+            raise
@@ -0,0 +1,203 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Membership filter of registered device-ids. A Bloom filter built from a
+scan of the provisioning table is published to S3 and kept current by the
+table stream consumer; the authorizer loads it once per refresh interval
+and refuses device-ids that are certainly not registered without reading
+the table.
+"""
+import hashlib
+import logging
+import math
+import struct
+import threading
+import time
+from botocore.exceptions import ClientError
+from aws_utils import get_client
+
+logger = logging.getLogger()
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over strings. Membership tests never produce
+    false negatives; false positives occur at roughly the error rate the
+    filter was sized for.
+    """
+    MAGIC = b'SFBF'
+    HEADER = struct.Struct('>4sQI')
+
+    def __init__(self, size: int, hashes: int, bits: bytearray = None):
+        if size <= 0 or hashes <= 0:
+            raise ValueError("Bloom filter size and hash count must be positive")
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+        if len(self.bits) != (size + 7) // 8:
+            raise ValueError("Bloom filter bit array does not match its size")
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = 0.001) -> 'BloomFilter':
+        """A filter sized to hold capacity items at the given false positive rate"""
+        capacity = max(1, capacity)
+        size = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return cls(size, hashes)
+
+    def _positions(self, item: str):
+        # Double hashing over a single SHA-256 digest (Kirsch-Mitzenmacher)
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str):
+        """Add item to the filter"""
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+    def to_bytes(self) -> bytes:
+        """Serialized form published to S3"""
+        return self.HEADER.pack(self.MAGIC, self.size, self.hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        """Load a filter serialized by to_bytes"""
+        if len(data) < cls.HEADER.size:
+            raise ValueError("Bloom filter data is truncated")
+        magic, size, hashes = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a Bloom filter")
+        return cls(size, hashes, bytearray(data[cls.HEADER.size:]))
+
+class FilterConflict(RuntimeError):
+    """The published filter changed on every attempt to replace it"""
+
+def read_filter(bucket: str, key: str, s3=None) -> tuple:
+    """The published filter and its ETag, or None and None"""
+    s3 = s3 or get_client('s3')
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        if error.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    return BloomFilter.from_bytes(response['Body'].read()), response['ETag']
+
+def publish_filter(bloom: BloomFilter, bucket: str, key: str, s3=None,
+                   etag: str = None) -> bool:
+    """
+    Upload a filter where MembershipFilter instances will pick it up. With
+    an etag the upload only replaces the published filter it was read as,
+    and False means another writer got there first.
+    """
+    s3 = s3 or get_client('s3')
+    conditions = { 'IfMatch': etag } if etag else {}
+    try:
+        s3.put_object(Bucket=bucket, Key=key, Body=bloom.to_bytes(),
+                      ContentType='application/octet-stream', **conditions)
+        return True
+    except ClientError as error:
+        if error.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            return False
+        raise
+
+def add_members(device_ids, bucket: str, key: str, attempts: int = 5, s3=None) -> int:
+    """
+    Add device_ids to the published filter with an optimistic
+    read-modify-write. Returns the number added, or None when no filter is
+    published yet: the authorizer then reads the table for every device-id,
+    and the first rebuild will hold these ones too.
+    """
+    s3 = s3 or get_client('s3')
+    device_ids = set(device_ids)
+    for _ in range(max(1, attempts)):
+        bloom, etag = read_filter(bucket, key, s3)
+        if bloom is None:
+            return None
+        for device_id in device_ids:
+            bloom.add(device_id)
+        if publish_filter(bloom, bucket, key, s3, etag):
+            return len(device_ids)
+    raise FilterConflict("Membership filter changed on every attempt")
+
+class MembershipFilter:
+    """
+    Container-lifetime view of the published filter. The object is fetched
+    at most once per refresh interval, conditionally on its ETag. Without a
+    bucket, or while no filter could be loaded, every device-id is reported
+    as possibly registered so the table stays the source of truth.
+
+    A device registered since the copy was loaded is missing from it, so a
+    miss is confirmed against the published filter, at most once per
+    recheck interval, before it is reported. Only a device whose
+    registration has not reached the filter through the table stream yet
+    can still be missed.
+    """
+    def __init__(self, bucket: str = None, key: str = None, refresh: float = 300.0,
+                 recheck: float = 1.0, clock=time.monotonic, s3=None):
+        self.bucket = bucket
+        self.key = key
+        self.refresh = max(0.0, refresh)
+        self.recheck = max(0.0, recheck)
+        self._clock = clock
+        self._s3 = s3
+        self._lock = threading.Lock()
+        self._filter = None
+        self._etag = None
+        self._checked = None
+
+    @property
+    def enabled(self) -> bool:
+        """True when a filter location is configured"""
+        return bool(self.bucket and self.key)
+
+    def might_contain(self, device_id: str) -> bool:
+        """False only when device_id is certainly not registered"""
+        if not self.enabled:
+            return True
+        self._refresh_if_due(self.refresh)
+        if self._contains(device_id):
+            return True
+        self._refresh_if_due(self.recheck)
+        return self._contains(device_id)
+
+    def _contains(self, device_id: str) -> bool:
+        bloom = self._filter
+        return bloom is None or device_id in bloom
+
+    def invalidate(self):
+        """Fetch the filter again on the next lookup"""
+        with self._lock:
+            self._etag = None
+            self._checked = None
+
+    def _refresh_if_due(self, interval: float):
+        """Check for a newer filter unless the last check is under interval old"""
+        with self._lock:
+            now = self._clock()
+            if self._checked is not None and now - self._checked < interval:
+                return
+            self._checked = now
+            s3 = self._s3 or get_client('s3')
+            arguments = { 'Bucket': self.bucket, 'Key': self.key }
+            if self._etag:
+                arguments['IfNoneMatch'] = self._etag
+            try:
+                response = s3.get_object(**arguments)
+                self._filter = BloomFilter.from_bytes(response['Body'].read())
+                self._etag = response.get('ETag')
+            except ClientError as error:
+                error_code = error.response['Error']['Code']
+                if error_code in ('304', 'NotModified'):
+                    return
+                error_message = error.response['Error']['Message']
+                logger.error("Membership filter load failed: %s: %s.", error_code, error_message)
+            except ValueError as error:
+                logger.error("Membership filter is invalid: %s.", error)
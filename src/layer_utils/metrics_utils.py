@@ -0,0 +1,133 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Per-stage latency instrumentation emitted as CloudWatch Embedded Metric
+Format (EMF) log lines. A handler decorated with instrumented() collects
+the spans timed anywhere during its invocation, including shared layer
+code, and writes one EMF line with Handler, Sku, Outcome and ColdStart
+dimensions when it returns.
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Secretfree')
+DIMENSIONS = ['Handler', 'Sku', 'Outcome', 'ColdStart']
+
+_current = contextvars.ContextVar('secretfree_metrics', default=None)
+_cold_start = True
+
+class Metrics:
+    """Stage timings, in milliseconds, for one invocation"""
+    def __init__(self, handler: str, sku: str = None):
+        self.handler = handler
+        self.sku = sku or os.environ.get('SKUNAME', 'none')
+        self.outcome = None
+        self.values = {}
+        self.properties = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, milliseconds: float):
+        """Add to a stage timing; a stage timed more than once accumulates"""
+        with self._lock:
+            self.values[name] = self.values.get(name, 0.0) + milliseconds
+
+    def annotate(self, name: str, value: str):
+        """Attach a searchable property, not a metric, to the EMF line"""
+        with self._lock:
+            self.properties[name] = value
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the enclosed block as stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def document(self, cold_start: bool) -> dict:
+        """The EMF document for this invocation"""
+        with self._lock:
+            values = { name: round(value, 3) for name, value in self.values.items() }
+            properties = dict(self.properties)
+        document = { '_aws': { 'Timestamp': int(time.time() * 1000),
+                               'CloudWatchMetrics': [{
+                                   'Namespace': NAMESPACE,
+                                   'Dimensions': [DIMENSIONS],
+                                   'Metrics': [{ 'Name': name, 'Unit': 'Milliseconds' }
+                                               for name in sorted(values)] }] },
+                     'Handler': self.handler,
+                     'Sku': self.sku,
+                     'Outcome': self.outcome or 'success',
+                     'ColdStart': 'true' if cold_start else 'false' }
+        document.update(properties)
+        document.update(values)
+        return document
+
+class _NullMetrics(Metrics):
+    """Stand-in used when no instrumented handler is active"""
+    def record(self, name: str, milliseconds: float):
+        pass
+
+    def annotate(self, name: str, value: str):
+        pass
+
+def current() -> Metrics:
+    """The active invocation's metrics, or a no-op collector"""
+    metrics = _current.get()
+    return metrics if metrics is not None else _NullMetrics('none')
+
+def span(name: str):
+    """Time the enclosed block as stage name on the active invocation"""
+    return current().span(name)
+
+def annotate(name: str, value: str):
+    """Attach a property to the active invocation's EMF line"""
+    current().annotate(name, value)
+
+def run_in_context(function):
+    """Wrap function so it records into the caller's metrics from another thread"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, function)
+
+def emit(metrics: Metrics, stream=None):
+    """Write the EMF line for metrics and clear the cold start flag"""
+    global _cold_start  # pylint: disable=global-statement
+    document = metrics.document(_cold_start)
+    _cold_start = False
+    print(json.dumps(document), file=stream or sys.stdout, flush=True)
+
+def instrumented(handler: str):
+    """
+    Decorator for Lambda entry points. The outcome is 'success' unless the
+    handler set one, returned None ('failure') or raised ('error', or
+    'unauthorized' for the authorizer's Unauthorized exception).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(event, context):
+            metrics = Metrics(handler)
+            token = _current.set(metrics)
+            start = time.perf_counter()
+            try:
+                result = function(event, context)
+                if metrics.outcome is None and result is None:
+                    metrics.outcome = 'failure'
+                return result
+            except Exception as error:
+                if metrics.outcome is None:
+                    metrics.outcome = 'unauthorized' if str(error) == 'Unauthorized' else 'error'
+                raise
+            finally:
+                _current.reset(token)
+                metrics.record('total', (time.perf_counter() - start) * 1000)
+                emit(metrics)
+        return wrapper
+    return decorator
@@ -0,0 +1,119 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Provisioning core shared by the issuers: Thing upsert and the certificate
+attachments, run with as few serial registry round trips as possible.
+"""
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from botocore.exceptions import ClientError
+from iot_utils import ensure_policy, invalidate_registry
+from metrics_utils import span, run_in_context
+from ratelimit_utils import rate_limited
+
+logger = logging.getLogger()
+
+# Small pool kept for the life of the container; boto3 clients are thread safe.
+PROVISIONING_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PROVISIONING_WORKERS', '4')),
+    thread_name_prefix='provisioning')
+
+@dataclass
+class StepResult:
+    """Outcome of a single registry step"""
+    step: str
+    ok: bool
+    elapsed: float = 0.0
+    error_code: str = None
+    error_message: str = None
+
+@dataclass
+class ProvisioningResult:
+    """Outcome of every registry step for one device"""
+    device_id: str
+    steps: list = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """True when every step succeeded"""
+        return all(step.ok for step in self.steps)
+
+    def as_dict(self) -> dict:
+        """Plain representation for logging and responses"""
+        return { 'device_id': self.device_id,
+                 'ok': self.ok,
+                 'steps': [asdict(step) for step in self.steps] }
+
+def _run_step(name: str, stage: str, operation, tolerated=()) -> StepResult:
+    """
+    Run operation, mapping its ClientError (if any) onto a StepResult and
+    timing it as stage on the active invocation's metrics.
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            operation()
+        return StepResult(name, True, time.perf_counter() - start)
+    except ClientError as error:
+        error_code = error.response['Error']['Code']
+        error_message = error.response['Error']['Message']
+        if error_code in tolerated:
+            return StepResult(name, True, time.perf_counter() - start)
+        logger.error("Provisioning step %s failed: %s: %s.", name, error_code, error_message)
+        return StepResult(name, False, time.perf_counter() - start, error_code, error_message)
+
+def upsert_thing(iot, thing_name: str) -> StepResult:
+    """
+    Create the Thing optimistically. The device-id is unique for a given SKU
+    and this can be a certificate reissue, so an existing Thing is success.
+    """
+    return _run_step('create_thing', 'thing_upsert',
+                     lambda: rate_limited('CreateThing', iot.create_thing,
+                                          thingName=thing_name),
+                     tolerated=('ResourceAlreadyExistsException',))
+
+def attach_thing(iot, thing_name: str, certificate_arn: str) -> StepResult:
+    """Attach the certificate to the Thing"""
+    return _run_step('attach_thing_principal', 'thing_attach',
+                     lambda: rate_limited('AttachThingPrincipal', iot.attach_thing_principal,
+                                          thingName=thing_name, principal=certificate_arn))
+
+def attach_policy(iot, policy_name: str, certificate_arn: str,
+                  region: str, account: str, policy_template: str = None) -> StepResult:
+    """Create the SKU policy if necessary, then attach it to the certificate"""
+    def operation():
+        ensure_policy(iot, policy_name, region, account, policy_template)
+        rate_limited('AttachPolicy', iot.attach_policy,
+                     policyName=policy_name, target=certificate_arn)
+    result = _run_step('attach_policy', 'policy_attach', operation)
+    if result.error_code == 'ResourceNotFoundException':
+        # The policy was deleted behind the registry cache's back.
+        invalidate_registry()
+    return result
+
+def register_device(iot, device_id: str, certificate_arn: str, policy_name: str,
+                    region: str, account: str, policy_template: str = None) -> ProvisioningResult:
+    """
+    Create the Thing for device_id, attach it to the certificate and attach
+    the SKU policy. The policy attachment does not depend on the Thing, so it
+    runs concurrently with the Thing steps, leaving two serial round trips on
+    the critical path. A policy that does not exist yet is created from
+    policy_template, by default the stock SKU policy. Certificates
+    previously attached to the Thing are left alone here and retired
+    offline by src/tools/cleanup_certificates.
+    """
+    result = ProvisioningResult(device_id)
+    policy_future = PROVISIONING_POOL.submit(run_in_context(attach_policy), iot, policy_name,
+                                             certificate_arn, region, account, policy_template)
+
+    thing = upsert_thing(iot, device_id)
+    result.steps.append(thing)
+    if thing.ok:
+        result.steps.append(attach_thing(iot, device_id, certificate_arn))
+
+    result.steps.append(policy_future.result())
+    return result
@@ -0,0 +1,296 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Client-side rate limiting for the ACM PCA and AWS IoT control-plane calls.
+Every API gets a token bucket started at its default service quota, which
+adapts AIMD style: a throttle response halves the rate, successes win it
+back additively up to the quota. Rates are per Lambda instance; with
+RATE_LIMIT_TABLENAME set, instances also draw from a per-second budget kept
+in DynamoDB so that together they stay within the account quota. Waits
+for permission are bounded by RATE_LIMIT_MAX_WAIT seconds and, in handlers
+decorated with within_deadline(), by the invocation's remaining time;
+running out raises RateLimitTimeout, a throttle the caller did not send.
+"""
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+from aws_utils import get_client
+from retry_utils import Backoff
+
+logger = logging.getLogger()
+
+# Error codes meaning "slow down" rather than "this request is wrong"
+THROTTLE_CODES = frozenset({ 'ThrottlingException', 'Throttling', 'TooManyRequestsException',
+                             'RequestLimitExceeded', 'SlowDown' })
+
+# Longest wait, in seconds, for permission to make one call
+MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', '10'))
+# Time kept back from the invocation deadline to report a timed out wait
+DEADLINE_MARGIN_MS = int(os.environ.get('RATE_LIMIT_DEADLINE_MARGIN_MS', '1000'))
+
+_deadline = contextvars.ContextVar('secretfree_rate_deadline', default=None)
+
+class RateLimitTimeout(ClientError):
+    """
+    Permission to call an API did not come within the allowed wait. It is
+    a ClientError with the ThrottlingException code, so callers handle it
+    as they would the service throttling them.
+    """
+    def __init__(self, name: str, timeout: float):
+        super().__init__({ 'Error': { 'Code': 'ThrottlingException',
+                                      'Message': 'No %s rate limit permission within %.3fs' %
+                                                 (name, timeout) } }, name)
+
+def _transient(error: ClientError) -> bool:
+    """A service side failure worth retrying, as botocore's standard mode would"""
+    return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+# Default per-account requests per second; override with RATE_LIMIT_<OPERATION>
+DEFAULT_RATES = { 'IssueCertificate': 25.0,
+                  'GetCertificate': 75.0,
+                  'RegisterCertificate': 10.0,
+                  'CreateCertificateFromCsr': 15.0,
+                  'CreateThing': 15.0,
+                  'AttachThingPrincipal': 15.0,
+                  'AttachPolicy': 15.0 }
+FALLBACK_RATE = 10.0
+
+def configured_rate(name: str) -> float:
+    """The ceiling rate for operation name"""
+    value = os.environ.get('RATE_LIMIT_' + name.upper())
+    return float(value) if value else DEFAULT_RATES.get(name, FALLBACK_RATE)
+
+class TokenBucket:
+    """
+    Thread safe token bucket refilled at rate tokens per second and holding
+    at most burst tokens. acquire() blocks until a token is available.
+    """
+    def __init__(self, rate: float, burst: float = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = max(rate, 1e-3)
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self.tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float):
+        """Change the refill rate, keeping the tokens accrued so far"""
+        with self._lock:
+            self._refill()
+            self.rate = max(rate, 1e-3)
+
+    def drain(self):
+        """Drop accrued tokens so the next call waits a full interval"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def acquire(self, timeout: float = None) -> bool:
+        """Take one token, waiting for it; False if that would exceed timeout"""
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                # Tolerate float error so a wait of exactly one interval suffices
+                if self.tokens >= 1.0 - 1e-9:
+                    self.tokens -= 1.0
+                    return True
+                wait = (1.0 - self.tokens) / self.rate
+            if deadline is not None and self._clock() + wait > deadline:
+                return False
+            self._sleep(wait)
+
+class SharedBudget:
+    """
+    Per-second request budget shared by every Lambda instance through
+    conditional counter updates in a DynamoDB table keyed by 'bucket'.
+    Table errors fail open, leaving the local buckets in charge.
+    """
+    def __init__(self, table_name: str, ddb=None, clock=time.time, sleep=time.sleep):
+        self.table_name = table_name
+        self._ddb = ddb
+        self._clock = clock
+        self._sleep = sleep
+
+    def acquire(self, name: str, limit: float, timeout: float = None) -> bool:
+        """Count one request against this second's budget for name"""
+        ddb = self._ddb or get_client('dynamodb')
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            now = self._clock()
+            second = int(now)
+            values = { ':one': { 'N': '1' },
+                       ':limit': { 'N': str(max(1, int(limit))) },
+                       ':expires': { 'N': str(second + 60) } }
+            try:
+                ddb.update_item(TableName=self.table_name,
+                                Key={ 'bucket': { 'S': f'{name}#{second}' } },
+                                UpdateExpression='ADD #count :one SET expires_at = :expires',
+                                ConditionExpression=('attribute_not_exists(#count) '
+                                                     'OR #count < :limit'),
+                                ExpressionAttributeNames={ '#count': 'count' },
+                                ExpressionAttributeValues=values)
+                return True
+            except ClientError as error:
+                error_code = error.response['Error']['Code']
+                if error_code != 'ConditionalCheckFailedException':
+                    error_message = error.response['Error']['Message']
+                    logger.warning("Shared rate budget unavailable: %s: %s.",
+                                   error_code, error_message)
+                    return True
+            # This second's budget is spent; wait for the next one
+            wait = second + 1 - now
+            if deadline is not None and now + wait > deadline:
+                return False
+            self._sleep(wait)
+
+class AdaptiveLimiter:
+    """
+    AIMD rate for one API: multiplicative decrease on throttles down to the
+    floor, additive increase on successes, about increase requests per
+    second per second, up to the ceiling.
+    """
+    def __init__(self, name: str, ceiling: float, floor: float = None, increase: float = 1.0,
+                 decrease: float = 0.5, budget: SharedBudget = None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.ceiling = ceiling
+        self.floor = floor if floor is not None else max(ceiling / 20, 0.5)
+        self.increase = increase
+        self.decrease = decrease
+        self.budget = budget
+        self.bucket = TokenBucket(ceiling, clock=clock, sleep=sleep)
+        self._clock = clock
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """The current allowed rate"""
+        return self.bucket.rate
+
+    def acquire(self, timeout: float = None) -> bool:
+        """Wait for permission to make one call; False if that would exceed timeout"""
+        start = self._clock()
+        if not self.bucket.acquire(timeout):
+            return False
+        if self.budget is None:
+            return True
+        remaining = None if timeout is None else max(0.0, timeout - (self._clock() - start))
+        # The budget is the account quota shared by every instance; this
+        # instance's adaptive rate only paces its own calls
+        return self.budget.acquire(self.name, self.ceiling, timeout=remaining)
+
+    def on_throttle(self):
+        """Back off after a throttle response"""
+        with self._lock:
+            self.throttles += 1
+            self.bucket.set_rate(max(self.floor, self.rate * self.decrease))
+            # A burst saved up at the old rate would only be throttled again
+            self.bucket.drain()
+
+    def on_success(self):
+        """Win back rate after a successful call"""
+        with self._lock:
+            if self.rate < self.ceiling:
+                self.bucket.set_rate(min(self.ceiling, self.rate + self.increase / self.rate))
+
+class RateLimits:
+    """The adaptive limiters of every API, created on first use"""
+    def __init__(self, budget: SharedBudget = None, max_attempts: int = 3,
+                 backoff: Backoff = None, max_wait: float = MAX_WAIT,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.budget = budget
+        self.max_attempts = max(1, max_attempts)
+        self.max_wait = max_wait
+        self.backoff = backoff or Backoff()
+        self._clock = clock
+        self._sleep = sleep
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, name: str) -> AdaptiveLimiter:
+        """The limiter for operation name"""
+        with self._lock:
+            if name not in self._limiters:
+                self._limiters[name] = AdaptiveLimiter(name, configured_rate(name),
+                                                       budget=self.budget, clock=self._clock,
+                                                       sleep=self._sleep)
+            return self._limiters[name]
+
+    def wait_limit(self) -> float:
+        """Seconds a call may wait for permission: max_wait, or less near the deadline"""
+        deadline = _deadline.get()
+        if deadline is None:
+            return self.max_wait
+        return max(0.0, min(self.max_wait, deadline - time.monotonic()))
+
+    def call(self, name: str, operation, *args, **kwargs):
+        """
+        Call operation within the rate for name. Throttle responses lower the
+        rate and are retried, with backoff, up to max_attempts in total, as
+        are service side failures; other errors, and the last retryable
+        one, propagate. The clients of these calls do not retry themselves.
+        Raises RateLimitTimeout when permission does not come in time.
+        """
+        limiter = self.limiter(name)
+        for attempt in range(self.max_attempts):
+            timeout = self.wait_limit()
+            if not limiter.acquire(timeout):
+                logger.warning("%s rate limit wait exceeded %.3fs.", name, timeout)
+                raise RateLimitTimeout(name, timeout)
+            try:
+                result = operation(*args, **kwargs)
+            except ClientError as error:
+                error_code = error.response['Error']['Code']
+                if error_code in THROTTLE_CODES:
+                    limiter.on_throttle()
+                    logger.warning("%s throttled, rate now %.2f/s.", name, limiter.rate)
+                elif _transient(error):
+                    logger.warning("%s failed with %s, retrying.", name, error_code)
+                else:
+                    raise
+                if attempt + 1 == self.max_attempts:
+                    raise
+                self._sleep(self.backoff.delay(attempt))
+                continue
+            limiter.on_success()
+            return result
+        return None
+
+def _shared_budget():
+    table_name = os.environ.get('RATE_LIMIT_TABLENAME')
+    return SharedBudget(table_name) if table_name else None
+
+RATE_LIMITS = RateLimits(budget=_shared_budget())
+
+def rate_limited(name: str, operation, *args, **kwargs):
+    """Call operation through the container's limiter for API name"""
+    return RATE_LIMITS.call(name, operation, *args, **kwargs)
+
+def within_deadline(function):
+    """
+    Decorator for Lambda entry points: rate limit waits during the
+    invocation, including on threads started with run_in_context, end
+    DEADLINE_MARGIN_MS before the invocation times out.
+    """
+    @functools.wraps(function)
+    def wrapper(event, context):
+        remaining_ms = context.get_remaining_time_in_millis() - DEADLINE_MARGIN_MS
+        token = _deadline.set(time.monotonic() + max(0, remaining_ms) / 1000)
+        try:
+            return function(event, context)
+        finally:
+            _deadline.reset(token)
+    return wrapper
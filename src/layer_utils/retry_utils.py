@@ -0,0 +1,65 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Backoff and bounded polling helpers shared by the secretfree Lambda functions
+"""
+import random
+import time
+from dataclasses import dataclass
+
+class PollTimeout(TimeoutError):
+    """Raised when a poll did not succeed before its deadline"""
+    def __init__(self, message, metrics):
+        super().__init__(message)
+        self.metrics = metrics
+
+@dataclass
+class PollMetrics:
+    """Attempt count and total time spent sleeping between attempts"""
+    attempts: int = 0
+    waited: float = 0.0
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th delay is drawn uniformly
+    from [0, min(cap, base * factor ** n)].
+    """
+    def __init__(self, base: float = 0.1, cap: float = 2.0, factor: float = 2.0,
+                 rng=random.random):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self._rng = rng
+
+    def delay(self, attempt: int) -> float:
+        """Jittered delay before retry number attempt (zero based)"""
+        return self._rng() * min(self.cap, self.base * self.factor ** attempt)
+
+def poll(operation, is_retryable, deadline: float, backoff: Backoff = None,
+         first_delay: float = 0.0, sleep=time.sleep, clock=time.monotonic):
+    """
+    Call operation until it returns without raising a retryable exception.
+    deadline is an absolute time on clock. Exceptions for which is_retryable
+    returns False propagate immediately; running out of time raises
+    PollTimeout. Returns the operation result and the PollMetrics.
+    """
+    backoff = backoff or Backoff()
+    metrics = PollMetrics()
+    delay = first_delay
+
+    while True:
+        if delay > 0:
+            delay = min(delay, max(0.0, deadline - clock()))
+            sleep(delay)
+            metrics.waited += delay
+        metrics.attempts += 1
+        try:
+            return operation(), metrics
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            if not is_retryable(error):
+                raise
+            if clock() >= deadline:
+                raise PollTimeout("Deadline reached after %d attempts" % metrics.attempts,
+                                  metrics) from error
+            delay = backoff.delay(metrics.attempts - 1)
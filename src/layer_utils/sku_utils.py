@@ -0,0 +1,216 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Per-SKU configuration, so one deployment can serve several product lines.
+Without SKU_ROUTING every request belongs to the deployment's own SKU,
+configured from the environment as before. With SKU_ROUTING set to
+'subject' the SKU is the CSR subject OU; with 'path' it is the first
+segment of the request path. The settings of every SKU come from a JSON
+document in S3:
+
+    { "version": 3,
+      "skus": { "widgiot": { "ca_arn": "arn:aws:acm-pca:...",
+                             "validity_days": 180,
+                             "signing_algorithm": "SHA256WITHRSA",
+                             "table_name": "widgiot-iot-provisioning-secretfree",
+                             "policy_name": "widgiot",
+                             "policy_template": "..." } } }
+
+which is held in memory and checked at most once per refresh interval,
+conditionally on its ETag. A document with a lower version than the one
+loaded is ignored, so a stale read never rolls the configuration back.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from botocore.exceptions import ClientError
+from cryptography.x509.oid import NameOID
+from csr_utils import load_csr
+from aws_utils import get_client
+
+logger = logging.getLogger()
+
+# Used in table, policy and API resource names, so kept to what all accept
+_SKU_NAME = re.compile(r'[A-Za-z0-9.-]{1,64}')
+
+class UnknownSku(LookupError):
+    """A request for a SKU this deployment has no configuration for"""
+
+@dataclass(frozen=True)
+class SkuConfig:
+    """Everything the functions need to know about one SKU"""
+    name: str
+    table_name: str
+    ca_arn: str = None
+    validity_days: int = 180
+    signing_algorithm: str = 'SHA256WITHRSA'
+    policy_name: str = None
+    policy_template: str = None
+
+    @classmethod
+    def from_environment(cls) -> 'SkuConfig':
+        """The deployment's own SKU, as configured by the template"""
+        name = os.environ.get('SKUNAME', 'widgiot')
+        return cls(name=name,
+                   table_name=os.environ.get('SECRETFREE_TABLENAME',
+                                             f'{name}-iot-provisioning-secretfree'),
+                   ca_arn=os.environ.get('ACMPCA_CA_ARN'),
+                   validity_days=int(os.environ.get('CERT_VALIDITY_DAYS', '180')),
+                   signing_algorithm=os.environ.get('CERT_SIGNING_ALGO', 'SHA256WITHRSA'),
+                   policy_name=name)
+
+    @classmethod
+    def from_document(cls, name: str, settings: dict) -> 'SkuConfig':
+        """One SKU's entry of the configuration document"""
+        return cls(name=name,
+                   table_name=settings.get('table_name', f'{name}-iot-provisioning-secretfree'),
+                   ca_arn=settings.get('ca_arn'),
+                   validity_days=int(settings.get('validity_days', 180)),
+                   signing_algorithm=settings.get('signing_algorithm', 'SHA256WITHRSA'),
+                   policy_name=settings.get('policy_name', name),
+                   policy_template=settings.get('policy_template'))
+
+def routing_mode() -> str:
+    """'subject', 'path' or '' when every request is for the deployment's SKU"""
+    return os.environ.get('SKU_ROUTING', '').lower()
+
+def subject_sku(req) -> str:
+    """The SKU named by a parsed CSR's subject OU, or None"""
+    names = req.subject.get_attributes_for_oid(NameOID.ORGANIZATIONAL_UNIT_NAME)
+    return str(names[0].value) if names else None
+
+def path_sku(event: dict) -> str:
+    """
+    The SKU named by the request path /{sku}/new: the sku path parameter of
+    a proxy integration, or else the resource in an authorizer's methodArn.
+    """
+    sku = (event.get('pathParameters') or {}).get('sku')
+    if sku:
+        return sku
+    # arn:aws:execute-api:region:account:api/stage/VERB/{sku}/new
+    resource = event.get('methodArn', '').split(':', 5)[-1].split('/')
+    return resource[3] if len(resource) > 4 else None
+
+def requested_sku(event: dict, req=None) -> str:
+    """The SKU a request names under the routing mode, None if it names none"""
+    mode = routing_mode()
+    if mode == 'subject':
+        return subject_sku(req) if req is not None else None
+    if mode == 'path':
+        return path_sku(event)
+    return None
+
+class SkuConfigStore:
+    """
+    Container-lifetime view of the configuration document. Without a
+    bucket only the deployment's own SKU exists.
+    """
+    def __init__(self, bucket: str = None, key: str = None, refresh: float = 60.0,
+                 clock=time.monotonic, s3=None):
+        self.bucket = bucket
+        self.key = key
+        self.refresh = max(0.0, refresh)
+        self.version = None
+        self._clock = clock
+        self._s3 = s3
+        self._lock = threading.Lock()
+        self._configs = {}
+        self._etag = None
+        self._next_check = None
+
+    @property
+    def enabled(self) -> bool:
+        """True when a configuration document location is configured"""
+        return bool(self.bucket and self.key)
+
+    def get(self, name: str = None) -> SkuConfig:
+        """
+        The configuration of SKU name, or of the deployment's own SKU when
+        name is None. Raises UnknownSku for a SKU without configuration.
+        """
+        home = SkuConfig.from_environment()
+        if name is None:
+            return home
+        if not _SKU_NAME.fullmatch(name):
+            raise UnknownSku(name)
+        if self.enabled:
+            self._refresh_if_due()
+        # The document may override the deployment's own SKU
+        config = self._configs.get(name)
+        if config is None and name == home.name:
+            return home
+        if config is None:
+            raise UnknownSku(name)
+        return config
+
+    def invalidate(self):
+        """Check the document again on the next lookup"""
+        with self._lock:
+            self._etag = None
+            self._next_check = None
+
+    def _refresh_if_due(self):
+        with self._lock:
+            now = self._clock()
+            if self._next_check is not None and now < self._next_check:
+                return
+            self._next_check = now + self.refresh
+            s3 = self._s3 or get_client('s3')
+            arguments = { 'Bucket': self.bucket, 'Key': self.key }
+            if self._etag:
+                arguments['IfNoneMatch'] = self._etag
+            try:
+                response = s3.get_object(**arguments)
+                document = json.loads(response['Body'].read())
+                version = int(document.get('version', 0))
+                if self.version is not None and version < self.version:
+                    logger.warning("Ignoring SKU configuration version %d older than %d.",
+                                   version, self.version)
+                    return
+                self._configs = { name: SkuConfig.from_document(name, settings)
+                                  for name, settings in document.get('skus', {}).items()
+                                  if _SKU_NAME.fullmatch(name) }
+                self.version = version
+                self._etag = response.get('ETag')
+            except ClientError as error:
+                error_code = error.response['Error']['Code']
+                if error_code in ('304', 'NotModified'):
+                    return
+                error_message = error.response['Error']['Message']
+                logger.error("SKU configuration load failed: %s: %s.", error_code, error_message)
+            except (ValueError, AttributeError) as error:
+                logger.error("SKU configuration is invalid: %s.", error)
+
+SKU_CONFIG = SkuConfigStore(bucket=os.environ.get('SKU_CONFIG_BUCKET'),
+                            key=os.environ.get('SKU_CONFIG_KEY', 'sku-config.json'),
+                            refresh=float(os.environ.get('SKU_CONFIG_REFRESH', '60')))
+
+def sku_config(event: dict, req=None) -> SkuConfig:
+    """
+    The configuration for a request: the SKU it names under the routing
+    mode, or the deployment's own. Raises UnknownSku when routing is on
+    and the request names no SKU, or one without configuration.
+    """
+    if not routing_mode():
+        return SKU_CONFIG.get()
+    name = requested_sku(event, req)
+    if not name:
+        raise UnknownSku(None)
+    return SKU_CONFIG.get(name)
+
+def request_config(event: dict, csr: bytes, verified: str = None) -> SkuConfig:
+    """
+    The configuration for an issuer request: the SKU the authorizer
+    verified for this CSR, or else the one the request names. The CSR is
+    only parsed when the SKU is read from its subject.
+    """
+    if not routing_mode():
+        return SKU_CONFIG.get()
+    if verified:
+        return SKU_CONFIG.get(verified)
+    return sku_config(event, load_csr(csr) if routing_mode() == 'subject' else None)
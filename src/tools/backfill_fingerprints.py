@@ -0,0 +1,90 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+One-shot migration that backfills the SPKI SHA-256 fingerprint attribute
+for provisioning table items that only carry the base64 encoded PEM
+public key.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.backfill_fingerprints \\
+        --table widgiot-iot-provisioning-secretfree [--dry-run]
+"""
+import argparse
+import base64
+import json
+import logging
+import boto3
+from botocore.exceptions import ClientError
+from cryptography.hazmat.primitives.serialization import (load_pem_public_key,
+                                                          Encoding, PublicFormat)
+from key_utils import FINGERPRINT_ATTRIBUTE, spki_fingerprint
+
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+def pubkey_fingerprint(pubkey_b64: str) -> str:
+    """Fingerprint of a base64 encoded PEM public key as stored in the table"""
+    key = load_pem_public_key(base64.b64decode(pubkey_b64))
+    return spki_fingerprint(key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo))
+
+def backfill(table_name: str, dry_run: bool = False, ddb=None) -> dict:
+    """
+    Scan the table for items without a fingerprint and add one. The update
+    is conditional on the stored key being unchanged so a concurrent
+    re-registration is never overwritten with a stale fingerprint.
+    """
+    ddb = ddb or boto3.client('dynamodb')
+    report = { 'scanned': 0, 'updated': 0, 'skipped': 0, 'failed': 0 }
+
+    paginator = ddb.get_paginator('scan')
+    pages = paginator.paginate(TableName=table_name,
+                               ProjectionExpression='#id, pubkey',
+                               FilterExpression='attribute_not_exists(#fp)',
+                               ExpressionAttributeNames={ '#id': 'device-id',
+                                                          '#fp': FINGERPRINT_ATTRIBUTE })
+    for page in pages:
+        report['scanned'] += page['ScannedCount']
+        for item in page['Items']:
+            device_id = item['device-id']['S']
+            if 'pubkey' not in item:
+                report['skipped'] += 1
+                continue
+            try:
+                fingerprint = pubkey_fingerprint(item['pubkey']['S'])
+            except ValueError as error:
+                logger.error("Device [%s] public key could not be loaded: %s.", device_id, error)
+                report['failed'] += 1
+                continue
+            if dry_run:
+                report['updated'] += 1
+                continue
+            try:
+                ddb.update_item(TableName=table_name,
+                                Key={ 'device-id': item['device-id'] },
+                                UpdateExpression='SET #fp = :fp',
+                                ConditionExpression='pubkey = :pk',
+                                ExpressionAttributeNames={ '#fp': FINGERPRINT_ATTRIBUTE },
+                                ExpressionAttributeValues={ ':fp': { 'S': fingerprint },
+                                                            ':pk': item['pubkey'] })
+                report['updated'] += 1
+            except ClientError as error:
+                error_code = error.response['Error']['Code']
+                error_message = error.response['Error']['Message']
+                logger.error("Device [%s] fingerprint update failed: %s: %s.",
+                             device_id, error_code, error_message)
+                report['failed'] += 1
+    return report
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', required=True, help='provisioning table name')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be updated without writing')
+    args = parser.parse_args()
+    print(json.dumps(backfill(args.table, dry_run=args.dry_run)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Seed or rebuild the authorizer's key index snapshot from a parallel scan of
+the provisioning table. The stream consumer keeps the index current from
+then on; changes it streamed while the scan ran are kept in the delta.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.build_key_index \\
+        --table widgiot-iot-provisioning-secretfree \\
+        --bucket <authorizer index bucket> [--prefix keyindex] [--segments 4]
+"""
+import argparse
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from key_utils import (FINGERPRINT_ATTRIBUTE, PUBKEY_ATTRIBUTE, PUBKEY_DER_ATTRIBUTE,
+                       KEYTYPE_ATTRIBUTE, item_fingerprint)
+from keyindex_utils import KEY_INDEX_PREFIX, index_key, publish_snapshot
+
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+def scan_segment(ddb, table_name: str, segment: int, segments: int) -> tuple:
+    """Index records of one parallel scan segment, and its unusable item count"""
+    records, failed = {}, 0
+    paginator = ddb.get_paginator('scan')
+    pages = paginator.paginate(TableName=table_name,
+                               # Every attribute item_fingerprint reads a key from
+                               ProjectionExpression='#id, #pk, #der, #kt, #fp',
+                               ExpressionAttributeNames={ '#id': 'device-id',
+                                                          '#pk': PUBKEY_ATTRIBUTE,
+                                                          '#der': PUBKEY_DER_ATTRIBUTE,
+                                                          '#kt': KEYTYPE_ATTRIBUTE,
+                                                          '#fp': FINGERPRINT_ATTRIBUTE },
+                               Segment=segment,
+                               TotalSegments=segments)
+    for page in pages:
+        for item in page['Items']:
+            device_id = item['device-id']['S']
+            try:
+                fingerprint = item_fingerprint(item)
+            except ValueError as error:
+                logger.error("Device [%s] public key could not be loaded: %s.", device_id, error)
+                fingerprint = None
+            if fingerprint is None:
+                failed += 1
+                continue
+            records[index_key(device_id)] = bytes.fromhex(fingerprint)
+    return records, failed
+
+def build(table_name: str, bucket: str, prefix: str = KEY_INDEX_PREFIX, segments: int = 4,
+          ddb=None, s3=None) -> dict:
+    """Scan the table and publish the result as the new snapshot"""
+    ddb = ddb or boto3.client('dynamodb')
+    segments = max(1, segments)
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        parts = list(pool.map(lambda segment: scan_segment(ddb, table_name, segment, segments),
+                              range(segments)))
+
+    records = {}
+    for part, _ in parts:
+        records.update(part)
+    manifest = publish_snapshot(records, bucket, prefix, s3=s3 or boto3.client('s3'))
+    return { 'version': manifest['version'],
+             'records': manifest['records'],
+             'failed': sum(failed for _, failed in parts) }
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', required=True, help='provisioning table name')
+    parser.add_argument('--bucket', required=True, help='bucket the authorizer loads from')
+    parser.add_argument('--prefix', default=KEY_INDEX_PREFIX, help='key index object prefix')
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    args = parser.parse_args()
+    print(json.dumps(build(args.table, args.bucket, args.prefix, args.segments)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Streaming bulk loader for the ${SkuName}-iot-provisioning-secretfree table.
+
+Reads a manufacturing manifest of device-id and public key pairs, either CSV
+with a 'device-id,pubkey' header or JSON lines with the same keys. The public
+key may be PEM text or base64 encoded PEM. Keys are validated, normalized
+and fingerprinted, then written in 25 item BatchWriteItem calls spread over
+a worker pool. Unprocessed items are retried with backoff, and progress is
+checkpointed so an interrupted load resumes where it stopped.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.bulk_load \\
+        --table widgiot-iot-provisioning-secretfree --manifest devices.csv \\
+        [--checkpoint devices.ckpt] [--workers 8]
+"""
+import argparse
+import base64
+import binascii
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import boto3
+from botocore.exceptions import ClientError
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import (load_pem_public_key,
+                                                          Encoding, PublicFormat)
+from key_utils import (FINGERPRINT_ATTRIBUTE, PUBKEY_DER_ATTRIBUTE, KEYTYPE_ATTRIBUTE,
+                       compact_public_key, spki_fingerprint)
+from retry_utils import Backoff
+
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+BATCH_SIZE = 25
+MAX_DEVICE_ID = 64
+MIN_RSA_BITS = 2048
+
+class InvalidRecord(ValueError):
+    """A manifest record that cannot be registered"""
+
+def read_manifest(path: str):
+    """Yield (line number, device-id, pubkey) from a CSV or JSON lines manifest"""
+    with open(path, newline='', encoding='utf-8') as manifest:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(manifest)
+            for record in reader:
+                yield reader.line_num, record.get('device-id'), record.get('pubkey')
+        else:
+            for line_num, line in enumerate(manifest, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_num, None, None
+                    continue
+                # Valid JSON that is not an object is as unusable as invalid JSON
+                if not isinstance(record, dict):
+                    yield line_num, None, None
+                    continue
+                yield line_num, record.get('device-id'), record.get('pubkey')
+
+def normalize_pubkey(pubkey: str):
+    """
+    Load a PEM or base64 encoded PEM public key, returning the table's
+    compact representation (key type tag and binary key) and the SPKI
+    fingerprint.
+    """
+    if pubkey is None:
+        raise InvalidRecord('missing public key')
+    data = pubkey.strip().encode('ascii', errors='replace')
+    if not data.startswith(b'-----BEGIN'):
+        try:
+            data = base64.b64decode(data, validate=True)
+        except binascii.Error as error:
+            raise InvalidRecord('public key is neither PEM nor base64 PEM') from error
+    try:
+        key = load_pem_public_key(data)
+    except ValueError as error:
+        raise InvalidRecord('public key does not load') from error
+    if isinstance(key, rsa.RSAPublicKey) and key.key_size < MIN_RSA_BITS:
+        raise InvalidRecord('rsa key shorter than %d bits' % MIN_RSA_BITS)
+    if not isinstance(key, (rsa.RSAPublicKey, ec.EllipticCurvePublicKey)):
+        raise InvalidRecord('unsupported key type')
+    keytype, data = compact_public_key(key)
+    der = key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+    return keytype, data, spki_fingerprint(der)
+
+def device_item(device_id: str, pubkey: str) -> dict:
+    """The DynamoDB item for a validated manifest record"""
+    if not device_id or len(device_id) > MAX_DEVICE_ID:
+        raise InvalidRecord('device-id must be 1 to %d characters' % MAX_DEVICE_ID)
+    keytype, data, fingerprint = normalize_pubkey(pubkey)
+    return { 'device-id': { 'S': device_id },
+             PUBKEY_DER_ATTRIBUTE: { 'B': data },
+             KEYTYPE_ATTRIBUTE: { 'S': keytype },
+             FINGERPRINT_ATTRIBUTE: { 'S': fingerprint } }
+
+class Checkpoint:
+    """
+    Tracks completed batches, which finish out of order, and persists the
+    highest manifest line below which every record has been handled.
+    """
+    def __init__(self, path: str = None):
+        self.path = path
+        self.line = 0
+        self._done = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as checkpoint:
+                self.line = int(json.load(checkpoint)['line'])
+        self._pending = []
+
+    def submitted(self, first: int, last: int):
+        """Register a batch spanning manifest lines first..last"""
+        with self._lock:
+            self._pending.append((first, last))
+
+    def completed(self, first: int, last: int):
+        """Mark a batch done and advance the persisted line if possible"""
+        with self._lock:
+            self._done[first] = last
+            advanced = False
+            while self._pending and self._pending[0][0] in self._done:
+                batch_first, batch_last = self._pending.pop(0)
+                del self._done[batch_first]
+                self.line = batch_last
+                advanced = True
+            if advanced and self.path:
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as checkpoint:
+                    json.dump({ 'line': self.line }, checkpoint)
+                os.replace(tmp, self.path)
+
+class Report:
+    """Thread safe load counters"""
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.invalid = 0
+        self.failed = 0
+        self.retries = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        """Increment the named counters"""
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self) -> dict:
+        """Counters plus elapsed time and throughput"""
+        elapsed = time.monotonic() - self.started
+        return { 'read': self.read,
+                 'written': self.written,
+                 'invalid': self.invalid,
+                 'failed': self.failed,
+                 'retries': self.retries,
+                 'elapsed': round(elapsed, 3),
+                 'items_per_second': round(self.written / elapsed, 1) if elapsed else 0.0 }
+
+def write_batch(ddb, table_name: str, items: list, report: Report,
+                max_attempts: int = 8, backoff: Backoff = None, sleep=time.sleep) -> bool:
+    """
+    Write up to 25 items, retrying unprocessed items with backoff. Returns
+    False when some items could not be written.
+    """
+    backoff = backoff or Backoff(base=0.05, cap=5.0)
+    requests = [{ 'PutRequest': { 'Item': item } } for item in items]
+    for attempt in range(max_attempts):
+        try:
+            response = ddb.batch_write_item(RequestItems={ table_name: requests })
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+        except ClientError as error:
+            error_code = error.response['Error']['Code']
+            if error_code not in ('ProvisionedThroughputExceededException',
+                                  'ThrottlingException', 'RequestLimitExceeded'):
+                logger.error("Batch write failed: %s: %s.", error_code,
+                             error.response['Error']['Message'])
+                break
+        if not requests:
+            report.add(written=len(items))
+            return True
+        report.add(retries=1)
+        sleep(backoff.delay(attempt))
+    report.add(written=len(items) - len(requests), failed=len(requests))
+    return False
+
+def load(table_name: str, manifest: str, checkpoint_path: str = None, workers: int = 8,
+         ddb=None) -> dict:
+    """Stream the manifest into the table, returning the throughput report"""
+    ddb = ddb or boto3.client('dynamodb')
+    checkpoint = Checkpoint(checkpoint_path)
+    report = Report()
+    batch, first = {}, None
+    in_flight = set()
+
+    def flush(pool, items, first_line, last_line):
+        checkpoint.submitted(first_line, last_line)
+        future = pool.submit(write_batch, ddb, table_name, items, report)
+        def finished(future):
+            # A batch that did not fully land holds the checkpoint back, so a
+            # resumed load writes it (and the idempotent puts after it) again.
+            if future.exception() is None and future.result():
+                checkpoint.completed(first_line, last_line)
+            elif future.exception() is not None:
+                logger.error("Batch at line %d failed: %s.", first_line, future.exception())
+                report.add(failed=len(items))
+        future.add_done_callback(finished)
+        in_flight.add(future)
+        # Bound memory: never hold more than a couple of batches per worker.
+        if len(in_flight) >= workers * 2:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.difference_update(done)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        line_num = checkpoint.line
+        for line_num, device_id, pubkey in read_manifest(manifest):
+            if line_num <= checkpoint.line:
+                continue
+            report.add(read=1)
+            first = first or line_num
+            try:
+                # Keyed by device-id: a batch may not hold the same key twice.
+                batch[device_id] = device_item(device_id, pubkey)
+            except InvalidRecord as error:
+                logger.error("Manifest line %d rejected: %s.", line_num, error)
+                report.add(invalid=1)
+            if len(batch) == BATCH_SIZE:
+                flush(pool, list(batch.values()), first, line_num)
+                batch, first = {}, None
+        if batch:
+            flush(pool, list(batch.values()), first, line_num)
+        elif first is not None:
+            checkpoint.submitted(first, line_num)
+            checkpoint.completed(first, line_num)
+        wait(in_flight)
+
+    return report.as_dict()
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', required=True, help='provisioning table name')
+    parser.add_argument('--manifest', required=True, help='CSV or JSON lines manifest')
+    parser.add_argument('--checkpoint', help='checkpoint file for resumable loads')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent batch writers')
+    args = parser.parse_args()
+    print(json.dumps(load(args.table, args.manifest, args.checkpoint, args.workers)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Factory pre-provisioning through an AWS IoT bulk registration task.
+
+Registering devices one by one costs four control-plane calls each
+(RegisterCertificate, CreateThing, AttachThingPrincipal, AttachPolicy).
+For a factory batch this tool writes one JSON lines registration file
+instead and submits it as a single thing registration task, whose
+provisioning template does what register_device does for one device:
+create the Thing, register the certificate as ACTIVE, attach it to the
+Thing and attach the SKU policy. Throughput is then bounded by the bulk
+registration service rather than the per-API rate limits.
+
+The input is JSON lines with a device-id and either the issued PEM
+certificate ("certificate") or the base64 PEM CSR ("csr", as written by
+generate_fleet), which is first issued by the ACM PCA CA given with
+--ca-arn. The task is followed until it finishes, and the lines of its
+error reports are mapped back to device-ids. A task still running after
+--timeout is reported with its id and last status, to be described later. Failed devices are written
+to --failures in the input format, ready to be submitted again.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.bulk_register \\
+        --input devices.jsonl --bucket widgiot-registration \\
+        --role-arn arn:aws:iam::123456789012:role/widgiot-bulk-registration \\
+        [--policy widgiot] [--ca-arn arn:aws:acm-pca:...] [--validity-days 180] \\
+        [--workers 8] [--failures failed.jsonl]
+"""
+import argparse
+import base64
+import json
+import logging
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from aws_utils import SINGLE_ATTEMPT
+from csr_utils import load_csr, common_name
+from iot_utils import ensure_policy
+from issuance_utils import idempotency_token
+from ratelimit_utils import rate_limited
+from retry_utils import Backoff, PollTimeout, poll
+
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Thing names allowed by AWS IoT
+_THING_NAME = re.compile(r'[a-zA-Z0-9:_-]{1,128}')
+
+# register_device as a provisioning template: one Thing, its certificate
+# and the SKU policy, which must already exist, per registration line.
+PROVISIONING_TEMPLATE = {
+    'Parameters': {
+        'ThingName': { 'Type': 'String' },
+        'CertificatePem': { 'Type': 'String' },
+        'PolicyName': { 'Type': 'String' }
+    },
+    'Resources': {
+        'thing': {
+            'Type': 'AWS::IoT::Thing',
+            'Properties': { 'ThingName': { 'Ref': 'ThingName' } }
+        },
+        'certificate': {
+            'Type': 'AWS::IoT::Certificate',
+            'Properties': { 'CertificatePem': { 'Ref': 'CertificatePem' },
+                            'Status': 'ACTIVE' }
+        },
+        'policy': {
+            'Type': 'AWS::IoT::Policy',
+            'Properties': { 'PolicyName': { 'Ref': 'PolicyName' } }
+        }
+    }
+}
+
+TASK_DONE = ('Completed', 'Failed', 'Cancelled')
+
+class InvalidRecord(ValueError):
+    """An input record that cannot be registered"""
+
+class TaskInProgress(RuntimeError):
+    """The registration task has not finished yet"""
+
+def read_records(path: str):
+    """Yield the records of a JSON lines input file, skipping blank lines"""
+    with open(path, encoding='utf-8') as records:
+        for line_num, line in enumerate(records, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.error("Input line %d is not JSON.", line_num)
+                yield {}
+
+def issue_certificate(acmpca, ca_arn: str, csr: bytes, device_id: str, validity_days: int = 180,
+                      signing_algorithm: str = 'SHA256WITHRSA', timeout: float = 60.0) -> str:
+    """
+    Issue a CSR with ACM PCA and wait for the PEM certificate. The issuer's
+    idempotency token is used, so a rerun within the window does not mint
+    a second certificate for the device.
+    """
+    certificate_arn = rate_limited('IssueCertificate', acmpca.issue_certificate,
+                                   CertificateAuthorityArn=ca_arn,
+                                   SigningAlgorithm=signing_algorithm,
+                                   Csr=csr,
+                                   Validity={ 'Value': validity_days, 'Type': 'DAYS' },
+                                   IdempotencyToken=idempotency_token(csr, device_id)
+                                   )['CertificateArn']
+    response, _ = poll(lambda: rate_limited('GetCertificate', acmpca.get_certificate,
+                                            CertificateAuthorityArn=ca_arn,
+                                            CertificateArn=certificate_arn),
+                       lambda error: (isinstance(error, ClientError) and
+                                      error.response['Error']['Code'] ==
+                                      'RequestInProgressException'),
+                       time.monotonic() + timeout,
+                       backoff=Backoff(base=0.2, cap=2.0),
+                       first_delay=0.05)
+    return response['Certificate']
+
+def registration_line(record: dict, policy_name: str, acmpca=None, ca_arn: str = None,
+                      validity_days: int = 180, signing_algorithm: str = 'SHA256WITHRSA') -> dict:
+    """
+    The registration file line of one input record, issuing its CSR first
+    when it carries no certificate. Raises InvalidRecord.
+    """
+    device_id = record.get('device-id')
+    certificate = record.get('certificate')
+    if certificate is None and record.get('csr'):
+        if acmpca is None:
+            raise InvalidRecord('a csr needs --ca-arn to be issued')
+        csr = base64.b64decode(record['csr'])
+        device_id = device_id or common_name(load_csr(csr))
+        certificate = issue_certificate(acmpca, ca_arn, csr, device_id,
+                                        validity_days, signing_algorithm)
+    if not device_id or not _THING_NAME.fullmatch(device_id):
+        raise InvalidRecord('device-id is not a valid thing name')
+    if not certificate or not certificate.startswith('-----BEGIN CERTIFICATE-----'):
+        raise InvalidRecord('missing PEM certificate')
+    return { 'ThingName': device_id,
+             'CertificatePem': certificate,
+             'PolicyName': policy_name }
+
+def collect(records, policy_name: str, acmpca=None, ca_arn: str = None, workers: int = 8,
+            **issuance) -> tuple:
+    """
+    Registration lines for every valid record, in input order, issuing
+    CSRs on a worker pool. Returns the lines and the (record, error) pairs
+    of the records left out.
+    """
+    records = list(records)
+
+    def line_for(record):
+        try:
+            return registration_line(record, policy_name, acmpca, ca_arn, **issuance), None
+        except (InvalidRecord, ClientError, PollTimeout, ValueError) as error:
+            return None, error
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(line_for, records))
+
+    lines, rejected = [], []
+    for record, (line, error) in zip(records, results):
+        if line is None:
+            logger.error("Device [%s] left out: %s.", record.get('device-id'), error)
+            rejected.append((record, error))
+        else:
+            lines.append(line)
+    return lines, rejected
+
+def start_task(iot, s3, lines: list, bucket: str, key: str, role_arn: str) -> str:
+    """Upload the registration file and start the task, returning its id"""
+    body = ''.join(json.dumps(line) + '\n' for line in lines)
+    s3.put_object(Bucket=bucket, Key=key, Body=body.encode('utf-8'))
+    response = iot.start_thing_registration_task(templateBody=json.dumps(PROVISIONING_TEMPLATE),
+                                                 inputFileBucket=bucket,
+                                                 inputFileKey=key,
+                                                 roleArn=role_arn)
+    return response['taskId']
+
+def wait_for_task(iot, task_id: str, timeout: float = 3600.0, backoff: Backoff = None,
+                  sleep=time.sleep, clock=time.monotonic) -> dict:
+    """
+    Poll the task until it completes, fails or is cancelled, logging its
+    progress. Returns the final describe_thing_registration_task response.
+    """
+    def describe():
+        task = iot.describe_thing_registration_task(taskId=task_id)
+        if task['status'] not in TASK_DONE:
+            logger.info("Task %s %s: %s%%, %d succeeded, %d failed.", task_id, task['status'],
+                        task.get('percentageProgress', 0), task.get('successCount', 0),
+                        task.get('failureCount', 0))
+            raise TaskInProgress(task['status'])
+        return task
+
+    task, _ = poll(describe, lambda error: isinstance(error, TaskInProgress),
+                   clock() + timeout, backoff=backoff or Backoff(base=5.0, cap=30.0),
+                   sleep=sleep, clock=clock)
+    return task
+
+def task_failures(iot, task_id: str, lines: list, fetch=urlopen) -> list:
+    """
+    The failed registrations of a task as (device-id, error message) pairs.
+    Each error report line carries the offset of the registration line it
+    is about, which maps it back to a device-id.
+    """
+    failures = []
+    token = None
+    while True:
+        arguments = { 'taskId': task_id, 'reportType': 'ERRORS' }
+        if token:
+            arguments['nextToken'] = token
+        response = iot.list_thing_registration_task_reports(**arguments)
+        for url in response.get('resourceLinks', []):
+            with fetch(url) as report:
+                for entry in report.read().decode('utf-8').splitlines():
+                    if not entry.strip():
+                        continue
+                    error = json.loads(entry)
+                    offset = int(error.get('offset', -1))
+                    device_id = lines[offset]['ThingName'] if 0 <= offset < len(lines) else None
+                    failures.append((device_id, error.get('errorMessage', '')))
+        token = response.get('nextToken')
+        if not token:
+            return failures
+
+def register(path: str, bucket: str, role_arn: str, policy_name: str, account: str = None,
+             ca_arn: str = None, workers: int = 8, failures_path: str = None,
+             timeout: float = 3600.0, backoff: Backoff = None, iot=None, s3=None,
+             acmpca=None, fetch=urlopen, **issuance) -> dict:
+    """Register an input file with one bulk registration task, returning a report"""
+    started = time.monotonic()
+    # Every AWS IoT and ACM PCA call is rate limited, which retries it
+    iot = iot or boto3.client('iot', config=Config(retries=SINGLE_ATTEMPT))
+    s3 = s3 or boto3.client('s3')
+    if ca_arn and acmpca is None:
+        acmpca = boto3.client('acm-pca', config=Config(retries=SINGLE_ATTEMPT))
+    account = account or boto3.client('sts').get_caller_identity()['Account']
+
+    records = list(read_records(path))
+    lines, rejected = collect(records, policy_name, acmpca if ca_arn else None, ca_arn,
+                              workers, **issuance)
+    report = { 'records': len(records), 'invalid': len(rejected), 'submitted': len(lines) }
+    failed = [record for record, _ in rejected]
+    if lines:
+        # The template attaches the policy by name, so it must exist first
+        ensure_policy(iot, policy_name, iot.meta.region_name, account)
+        key = 'registration/%s.jsonl' % uuid.uuid4()
+        task_id = start_task(iot, s3, lines, bucket, key, role_arn)
+        try:
+            task = wait_for_task(iot, task_id, timeout, backoff)
+        except PollTimeout as error:
+            # The task keeps running; its outcome is left to describe later
+            status = str(error.__cause__)
+            logger.error("Task %s still %s after %.0f seconds.", task_id, status, timeout)
+            report.update({ 'task_id': task_id, 'status': status, 'timed_out': True })
+            task = None
+        if task is not None:
+            failures = task_failures(iot, task_id, lines, fetch)
+            report.update({ 'task_id': task_id,
+                            'status': task['status'],
+                            'succeeded': task.get('successCount', 0),
+                            'failed': task.get('failureCount', len(failures)),
+                            'failures': [{ 'device-id': device_id, 'error': message }
+                                         for device_id, message in failures] })
+            by_device = { record.get('device-id'): record for record in records }
+            failed += [by_device.get(device_id) or { 'device-id': device_id }
+                       for device_id, _ in failures]
+    if failures_path:
+        with open(failures_path, 'w', encoding='utf-8') as output:
+            for record in failed:
+                output.write(json.dumps(record) + '\n')
+    report['elapsed'] = round(time.monotonic() - started, 3)
+    return report
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', required=True, help='JSON lines of certificates or csrs')
+    parser.add_argument('--bucket', required=True, help='bucket for the registration file')
+    parser.add_argument('--role-arn', required=True,
+                        help='role AWS IoT assumes to read the file and register')
+    parser.add_argument('--policy', default='widgiot', help='SKU policy to attach')
+    parser.add_argument('--ca-arn', help='ACM PCA CA issuing the csrs of the input')
+    parser.add_argument('--validity-days', type=int, default=180, help='certificate validity')
+    parser.add_argument('--signing-algorithm', default='SHA256WITHRSA',
+                        help='ACM PCA signing algorithm')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent issuances')
+    parser.add_argument('--failures', help='write failed records here for resubmission')
+    parser.add_argument('--timeout', type=float, default=3600.0, help='seconds to follow the task')
+    args = parser.parse_args()
+    print(json.dumps(register(args.input, args.bucket, args.role_arn, args.policy,
+                              ca_arn=args.ca_arn, workers=args.workers,
+                              failures_path=args.failures, timeout=args.timeout,
+                              validity_days=args.validity_days,
+                              signing_algorithm=args.signing_algorithm)))
+
+if __name__ == '__main__':
+    main()
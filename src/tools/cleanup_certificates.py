@@ -0,0 +1,308 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Stale certificate cleanup for a SKU.
+
+Every reissue attaches a new certificate to the device's Thing and leaves
+the previous one ACTIVE and attached. This job walks the Things of a SKU,
+the device-ids of its provisioning table, and retires the certificates
+created before the one the issuance table last recorded for the device:
+detached from the Thing, deactivated, stripped of their policies and
+deleted. Certificates as new as the recorded one or newer are kept, since
+the device may still be using any of them. A Thing without a record, such
+as a bulk registered device or one issued before the issuance table
+existed, or whose recorded certificate is not attached to it, keeps its
+newest certificate by creation date. A certificate still attached to
+another Thing is only detached from this one.
+
+The table is scanned in parallel segments and the Things of each page
+are handled on a bounded worker pool, with every AWS IoT call going
+through the shared client-side rate limiter. The position of each
+segment is checkpointed after every page, so an interrupted run resumes
+where it stopped. With --dry-run nothing is changed, the checkpoint is
+neither read nor written, and the report says what would have been
+retired.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.cleanup_certificates \\
+        --sku widgiot [--table widgiot-iot-provisioning-secretfree] \\
+        [--issuance-table widgiot-iot-provisioning-secretfree-issuance] \\
+        [--segments 4] [--workers 8] [--checkpoint cleanup.ckpt] \\
+        [--output decisions.jsonl] [--dry-run]
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from aws_utils import SINGLE_ATTEMPT
+from ratelimit_utils import rate_limited
+
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+PAGE_SIZE = 100
+
+class Checkpoint:
+    """
+    The scan position of every segment, persisted after each page. A
+    finished segment is recorded as done; a missing one starts over.
+    """
+    def __init__(self, path: str = None, segments: int = 1):
+        self.path = path
+        self.segments = { str(segment): { 'key': None, 'done': False }
+                          for segment in range(segments) }
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as checkpoint:
+                saved = json.load(checkpoint)
+            if saved.get('total') != segments:
+                raise ValueError('checkpoint was written for %s segments' % saved.get('total'))
+            self.segments.update(saved['segments'])
+
+    def position(self, segment: int) -> dict:
+        """Where segment resumes: its last evaluated key and whether it is done"""
+        with self._lock:
+            return dict(self.segments[str(segment)])
+
+    def advance(self, segment: int, key: dict):
+        """Record that segment is handled up to key, or completely when key is None"""
+        with self._lock:
+            self.segments[str(segment)] = { 'key': key, 'done': key is None }
+            if self.path:
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as checkpoint:
+                    json.dump({ 'total': len(self.segments), 'segments': self.segments },
+                              checkpoint)
+                os.replace(tmp, self.path)
+
+class Report:
+    """Thread safe cleanup counters and per-Thing decisions"""
+    def __init__(self, output: str = None):
+        self.things = 0
+        self.certificates = 0
+        self.stale = 0
+        self.unrecorded = 0
+        self.detached = 0
+        self.deactivated = 0
+        self.deleted = 0
+        self.shared = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._output = open(output, 'a', encoding='utf-8') if output else None
+
+    def add(self, **counts):
+        """Increment the named counters"""
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def decision(self, entry: dict):
+        """Write one Thing's decision to the output file, if any"""
+        if self._output is not None:
+            with self._lock:
+                self._output.write(json.dumps(entry) + '\n')
+
+    def close(self):
+        """Flush the output file"""
+        if self._output is not None:
+            self._output.close()
+
+    def as_dict(self, dry_run: bool) -> dict:
+        """Counters plus elapsed time"""
+        return { 'dry_run': dry_run,
+                 'things': self.things,
+                 'certificates': self.certificates,
+                 'stale': self.stale,
+                 'unrecorded': self.unrecorded,
+                 'detached': self.detached,
+                 'deactivated': self.deactivated,
+                 'deleted': self.deleted,
+                 'shared': self.shared,
+                 'errors': self.errors,
+                 'elapsed': round(time.monotonic() - self.started, 3) }
+
+def thing_principals(iot, thing_name: str) -> list:
+    """Every principal attached to a Thing, across pages"""
+    principals, token = [], None
+    while True:
+        arguments = { 'thingName': thing_name }
+        if token:
+            arguments['nextToken'] = token
+        response = rate_limited('ListThingPrincipals', iot.list_thing_principals, **arguments)
+        principals += response.get('principals', [])
+        token = response.get('nextToken')
+        if not token:
+            return principals
+
+def certificate_id(certificate_arn: str) -> str:
+    """The certificate id at the end of an AWS IoT certificate ARN"""
+    return certificate_arn.rsplit('/', 1)[-1]
+
+def recorded_certificate(ddb, issuance_table: str, thing_name: str) -> str:
+    """The ARN of the certificate last issued to the device, or None"""
+    item = ddb.get_item(TableName=issuance_table, Key={ 'device-id': { 'S': thing_name } },
+                        ProjectionExpression='certificate_arn', ConsistentRead=True).get('Item')
+    return item['certificate_arn']['S'] if item else None
+
+def creation_dates(iot, certificate_arns: list) -> dict:
+    """Creation date of each certificate ARN"""
+    created = {}
+    for arn in certificate_arns:
+        description = rate_limited('DescribeCertificate', iot.describe_certificate,
+                                   certificateId=certificate_id(arn))['certificateDescription']
+        created[arn] = description['creationDate']
+    return created
+
+def retire(iot, thing_name: str, certificate_arn: str, report: Report):
+    """
+    Detach a stale certificate from the Thing and, unless another Thing
+    still uses it, deactivate it, detach its policies and delete it.
+    """
+    rate_limited('DetachThingPrincipal', iot.detach_thing_principal,
+                 thingName=thing_name, principal=certificate_arn)
+    report.add(detached=1)
+    others = rate_limited('ListPrincipalThings', iot.list_principal_things,
+                          principal=certificate_arn).get('things', [])
+    if [other for other in others if other != thing_name]:
+        logger.info("Certificate [%s] is still attached to %s, kept.", certificate_arn, others)
+        report.add(shared=1)
+        return
+    cert_id = certificate_id(certificate_arn)
+    rate_limited('UpdateCertificate', iot.update_certificate,
+                 certificateId=cert_id, newStatus='INACTIVE')
+    report.add(deactivated=1)
+    policies = rate_limited('ListAttachedPolicies', iot.list_attached_policies,
+                            target=certificate_arn).get('policies', [])
+    for policy in policies:
+        rate_limited('DetachPolicy', iot.detach_policy,
+                     policyName=policy['policyName'], target=certificate_arn)
+    # Detaching is asynchronous; a delete refused while the attachment
+    # lingers is counted as an error and picked up again by a rerun.
+    rate_limited('DeleteCertificate', iot.delete_certificate, certificateId=cert_id)
+    report.add(deleted=1)
+
+def clean_thing(ddb, iot, issuance_table: str, thing_name: str, report: Report,
+                dry_run: bool = False):
+    """
+    Retire the certificates of a Thing older than its recorded one, or
+    all but the newest when it has no usable record
+    """
+    try:
+        certificates = [principal for principal in thing_principals(iot, thing_name)
+                        if ':cert/' in principal]
+        report.add(things=1, certificates=len(certificates))
+        if len(certificates) < 2:
+            return
+        recorded = recorded_certificate(ddb, issuance_table, thing_name)
+        created = creation_dates(iot, certificates)
+        if recorded in certificates:
+            keep = recorded
+            stale = sorted(arn for arn in certificates if created[arn] < created[keep])
+        else:
+            # Equal creation dates are ordered by ARN so reruns keep the same one
+            keep = max(certificates, key=lambda arn: (created[arn], arn))
+            stale = sorted(arn for arn in certificates if arn != keep)
+            report.add(unrecorded=1)
+        report.add(stale=len(stale))
+        report.decision({ 'device-id': thing_name, 'keep': keep, 'stale': stale,
+                          'recorded': keep == recorded })
+        if dry_run:
+            return
+        for certificate_arn in stale:
+            retire(iot, thing_name, certificate_arn, report)
+    except ClientError as error:
+        error_code = error.response['Error']['Code']
+        error_message = error.response['Error']['Message']
+        # A Thing that is not in the registry has nothing to clean up
+        if error_code == 'ResourceNotFoundException':
+            return
+        logger.error("Cleanup of [%s] failed: %s: %s.", thing_name, error_code, error_message)
+        report.add(errors=1)
+
+def clean_segment(ddb, iot, table_name: str, issuance_table: str, segment: int,
+                  segments: int, pool, checkpoint: Checkpoint, report: Report, dry_run: bool):
+    """Scan one table segment page by page, cleaning the Things of each page"""
+    position = checkpoint.position(segment)
+    if position['done']:
+        return
+    key = position['key']
+    while True:
+        arguments = { 'TableName': table_name,
+                      'Segment': segment,
+                      'TotalSegments': segments,
+                      'ProjectionExpression': '#id',
+                      'ExpressionAttributeNames': { '#id': 'device-id' },
+                      'Limit': PAGE_SIZE }
+        if key:
+            arguments['ExclusiveStartKey'] = key
+        response = ddb.scan(**arguments)
+        futures = { pool.submit(clean_thing, ddb, iot, issuance_table, item['device-id']['S'],
+                                report, dry_run): item['device-id']['S']
+                    for item in response.get('Items', []) }
+        wait(futures)
+        for future, thing_name in futures.items():
+            if future.exception() is not None:
+                logger.error("Cleanup of [%s] failed: %s.", thing_name, future.exception())
+                report.add(errors=1)
+        key = response.get('LastEvaluatedKey')
+        checkpoint.advance(segment, key)
+        if not key:
+            return
+
+def cleanup(sku: str, table_name: str = None, issuance_table: str = None, segments: int = 4,
+            workers: int = 8, checkpoint_path: str = None, output: str = None,
+            dry_run: bool = False, ddb=None, iot=None) -> dict:
+    """Retire the stale certificates of every Thing of a SKU, returning the report"""
+    table_name = table_name or f'{sku}-iot-provisioning-secretfree'
+    issuance_table = issuance_table or f'{table_name}-issuance'
+    ddb = ddb or boto3.client('dynamodb')
+    # Fail up front rather than once per Thing when the records are missing
+    ddb.describe_table(TableName=issuance_table)
+    # Every AWS IoT call is rate limited, which retries it
+    iot = iot or boto3.client('iot', config=Config(retries=SINGLE_ATTEMPT))
+    segments = max(1, segments)
+    # A dry run must not move a real run's checkpoint past what it only reported
+    checkpoint = Checkpoint(None if dry_run else checkpoint_path, segments)
+    report = Report(output)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='thing') as pool, \
+             ThreadPoolExecutor(max_workers=segments, thread_name_prefix='segment') as scanners:
+            futures = [scanners.submit(clean_segment, ddb, iot, table_name, issuance_table,
+                                       segment, segments, pool, checkpoint, report, dry_run)
+                       for segment in range(segments)]
+            for future in futures:
+                # A failed scan leaves its segment's checkpoint behind for a rerun
+                if future.exception() is not None:
+                    logger.error("Segment scan failed: %s.", future.exception())
+                    report.add(errors=1)
+    finally:
+        report.close()
+    return report.as_dict(dry_run)
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sku', required=True, help='SKU whose Things are cleaned up')
+    parser.add_argument('--table', help='provisioning table, by default the SKU\'s')
+    parser.add_argument('--issuance-table',
+                        help='issuance record table, by default the provisioning table\'s')
+    parser.add_argument('--segments', type=int, default=4, help='parallel table scan segments')
+    parser.add_argument('--workers', type=int, default=8, help='Things cleaned concurrently')
+    parser.add_argument('--checkpoint', help='checkpoint file for resumable runs')
+    parser.add_argument('--output', help='append per-Thing decisions as JSON lines')
+    parser.add_argument('--dry-run', action='store_true', help='report without changing anything')
+    args = parser.parse_args()
+    print(json.dumps(cleanup(args.sku, args.table, args.issuance_table, args.segments,
+                             args.workers, args.checkpoint, args.output, args.dry_run)))
+
+if __name__ == '__main__':
+    main()
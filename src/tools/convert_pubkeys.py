@@ -0,0 +1,144 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Migration that rewrites legacy provisioning table items, holding the public
+key as base64 encoded PEM in a string attribute, into the compact binary
+format: a key type tag plus DER SubjectPublicKeyInfo or a compressed EC
+point. The fingerprint is added where missing. The table is scanned in
+parallel segments and every update is conditional on the legacy key being
+unchanged, so the migration can run against a live table and be rerun.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.convert_pubkeys \\
+        --table widgiot-iot-provisioning-secretfree [--segments 8] \\
+        [--keep-legacy] [--dry-run]
+"""
+import argparse
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from key_utils import (FINGERPRINT_ATTRIBUTE, PUBKEY_ATTRIBUTE, PUBKEY_DER_ATTRIBUTE,
+                       KEYTYPE_ATTRIBUTE, compact_public_key, item_public_key,
+                       spki_fingerprint)
+
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+class Report:
+    """Thread safe migration counters"""
+    def __init__(self):
+        self.scanned = 0
+        self.converted = 0
+        self.failed = 0
+        self.saved_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        """Add to the named counters"""
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self) -> dict:
+        """Counters for printing"""
+        return { 'scanned': self.scanned, 'converted': self.converted,
+                 'failed': self.failed, 'saved_bytes': self.saved_bytes }
+
+def compact_update(item: dict, keep_legacy: bool = False) -> dict:
+    """The update_item arguments converting one legacy item"""
+    key = item_public_key({ PUBKEY_ATTRIBUTE: item[PUBKEY_ATTRIBUTE] })
+    keytype, data = compact_public_key(key)
+    fingerprint = spki_fingerprint(key.public_bytes(Encoding.DER,
+                                                    PublicFormat.SubjectPublicKeyInfo))
+    expression = 'SET #der = :der, #kt = :kt, #fp = if_not_exists(#fp, :fp)'
+    names = { '#der': PUBKEY_DER_ATTRIBUTE, '#kt': KEYTYPE_ATTRIBUTE,
+              '#fp': FINGERPRINT_ATTRIBUTE, '#pk': PUBKEY_ATTRIBUTE }
+    if not keep_legacy:
+        expression += ' REMOVE #pk'
+    return { 'Key': { 'device-id': item['device-id'] },
+             'UpdateExpression': expression,
+             'ConditionExpression': '#pk = :pk',
+             'ExpressionAttributeNames': names,
+             'ExpressionAttributeValues': { ':der': { 'B': data },
+                                            ':kt': { 'S': keytype },
+                                            ':fp': { 'S': fingerprint },
+                                            ':pk': item[PUBKEY_ATTRIBUTE] } }
+
+def convert_segment(ddb, table_name: str, segment: int, segments: int, report: Report,
+                    keep_legacy: bool = False, dry_run: bool = False):
+    """Convert the legacy items of one parallel scan segment"""
+    # Items converted with the legacy attribute kept are picked up again
+    # by a later run that drops it.
+    condition = 'attribute_exists(#pk)'
+    names = { '#id': 'device-id', '#pk': PUBKEY_ATTRIBUTE }
+    if keep_legacy:
+        condition += ' AND attribute_not_exists(#der)'
+        names['#der'] = PUBKEY_DER_ATTRIBUTE
+    paginator = ddb.get_paginator('scan')
+    pages = paginator.paginate(TableName=table_name,
+                               ProjectionExpression='#id, #pk',
+                               FilterExpression=condition,
+                               ExpressionAttributeNames=names,
+                               Segment=segment,
+                               TotalSegments=segments)
+    for page in pages:
+        report.add(scanned=page['ScannedCount'])
+        for item in page['Items']:
+            device_id = item['device-id']['S']
+            try:
+                update = compact_update(item, keep_legacy)
+            except ValueError as error:
+                logger.error("Device [%s] public key could not be loaded: %s.", device_id, error)
+                report.add(failed=1)
+                continue
+            compact = update['ExpressionAttributeValues'][':der']['B']
+            saved = len(item[PUBKEY_ATTRIBUTE]['S']) - len(compact)
+            if not dry_run:
+                try:
+                    ddb.update_item(TableName=table_name, **update)
+                except ClientError as error:
+                    error_code = error.response['Error']['Code']
+                    error_message = error.response['Error']['Message']
+                    logger.error("Device [%s] conversion failed: %s: %s.",
+                                 device_id, error_code, error_message)
+                    report.add(failed=1)
+                    continue
+            report.add(converted=1, saved_bytes=0 if keep_legacy else saved)
+
+def convert(table_name: str, segments: int = 8, keep_legacy: bool = False,
+            dry_run: bool = False, ddb=None) -> dict:
+    """
+    Convert every legacy item. With keep_legacy the string attribute stays
+    in place, for a migration window in which older authorizers still run.
+    """
+    ddb = ddb or boto3.client('dynamodb')
+    segments = max(1, segments)
+    report = Report()
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        futures = [pool.submit(convert_segment, ddb, table_name, segment, segments,
+                               report, keep_legacy, dry_run)
+                   for segment in range(segments)]
+    for future in futures:
+        future.result()
+    return report.as_dict()
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', required=True, help='provisioning table name')
+    parser.add_argument('--segments', type=int, default=8, help='parallel scan segments')
+    parser.add_argument('--keep-legacy', action='store_true',
+                        help='keep the base64 PEM attribute alongside the binary one')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be converted without writing')
+    args = parser.parse_args()
+    print(json.dumps(convert(args.table, args.segments, args.keep_legacy, args.dry_run)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Synthetic device fleet generator for load testing.
+
+Generates device keypairs and CSRs with the subject layout the issuers
+expect (OU is the SKU name, CN the device-id) across a process pool. Devices
+are cached on disk in chunks of JSON lines records holding device-id,
+pubkey (base64 PEM), csr (base64 PEM, as sent in the device-csr header) and
+key (PEM private key), so a fleet is generated once and reused by later
+runs; asking for a larger fleet only generates the missing chunks. Every
+chunk is also a valid bulk_load manifest.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.generate_fleet \\
+        --devices 100000 [--sku widgiot] [--keytype ec-p256] \\
+        [--cache .fleet] [--workers 8] [--manifest devices.jsonl]
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import (Encoding, PrivateFormat,
+                                                          PublicFormat, NoEncryption)
+from cryptography.x509.oid import NameOID
+
+CHUNK_SIZE = 1000
+DEFAULT_CACHE = '.fleet'
+
+# Key generators by the names used for the cache directories
+KEY_TYPES = { 'rsa-2048': lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+              'rsa-3072': lambda: rsa.generate_private_key(public_exponent=65537, key_size=3072),
+              'ec-p256': lambda: ec.generate_private_key(curve=ec.SECP256R1()),
+              'ec-p384': lambda: ec.generate_private_key(curve=ec.SECP384R1()) }
+
+def make_device(sku: str, keytype: str) -> dict:
+    """One device: a fresh keypair and its signed CSR"""
+    device_id = str(uuid.uuid4())
+    key = KEY_TYPES[keytype]()
+    # Same layout as script/load-verify-data.sh
+    subject = x509.Name([x509.NameAttribute(NameOID.COUNTRY_NAME, 'US'),
+                         x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, 'VA'),
+                         x509.NameAttribute(NameOID.LOCALITY_NAME, 'Anywhere'),
+                         x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'Automatra'),
+                         x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, sku),
+                         x509.NameAttribute(NameOID.COMMON_NAME, device_id)])
+    csr = x509.CertificateSigningRequestBuilder().subject_name(subject).sign(key, hashes.SHA256())
+    pubkey = key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+    private = key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+    return { 'device-id': device_id,
+             'pubkey': base64.b64encode(pubkey).decode('ascii'),
+             'csr': base64.b64encode(csr.public_bytes(Encoding.PEM)).decode('ascii'),
+             'key': private.decode('ascii') }
+
+def chunk_path(cache: str, sku: str, keytype: str, chunk: int) -> str:
+    """Cache file of one chunk of devices"""
+    return os.path.join(cache, f'{sku}-{keytype}', f'chunk-{chunk:06d}.jsonl')
+
+def generate_chunk(path: str, sku: str, keytype: str, count: int) -> str:
+    """Generate count devices into path; run in a pool worker"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and renamed so an interrupted run never leaves a short chunk
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as chunk:
+        for _ in range(count):
+            chunk.write(json.dumps(make_device(sku, keytype)) + '\n')
+    os.replace(tmp, path)
+    return path
+
+def read_chunk(path: str):
+    """Yield the device records of a chunk"""
+    with open(path, encoding='utf-8') as chunk:
+        for line in chunk:
+            if line.strip():
+                yield json.loads(line)
+
+def generate(devices: int, sku: str = 'widgiot', keytype: str = 'ec-p256',
+             cache: str = DEFAULT_CACHE, workers: int = None) -> dict:
+    """
+    Make sure the cache holds at least devices devices, generating missing
+    chunks in parallel. Returns the chunk paths covering the fleet.
+    """
+    if keytype not in KEY_TYPES:
+        raise ValueError("Unknown key type %s" % keytype)
+    started = time.monotonic()
+    paths = [chunk_path(cache, sku, keytype, chunk)
+             for chunk in range((max(0, devices) + CHUNK_SIZE - 1) // CHUNK_SIZE)]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        count = len(missing)
+        # Spawned, not forked: callers such as the load driver run threads
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(generate_chunk, missing, [sku] * count, [keytype] * count,
+                          [CHUNK_SIZE] * count))
+    return { 'devices': devices,
+             'chunks': paths,
+             'generated_chunks': len(missing),
+             'cached_chunks': len(paths) - len(missing),
+             'elapsed': round(time.monotonic() - started, 3) }
+
+def load_fleet(devices: int, sku: str = 'widgiot', keytype: str = 'ec-p256',
+               cache: str = DEFAULT_CACHE, workers: int = None) -> list:
+    """The first devices device records of the cached fleet, generated as needed"""
+    fleet = []
+    for path in generate(devices, sku, keytype, cache, workers)['chunks']:
+        fleet.extend(read_chunk(path))
+    return fleet[:devices]
+
+def write_manifest(fleet: list, path: str):
+    """Write a bulk_load JSON lines manifest of the fleet's public keys"""
+    with open(path, 'w', encoding='utf-8') as manifest:
+        for device in fleet:
+            manifest.write(json.dumps({ 'device-id': device['device-id'],
+                                        'pubkey': device['pubkey'] }) + '\n')
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, required=True, help='fleet size')
+    parser.add_argument('--sku', default='widgiot', help='SKU name placed in the CSR subject OU')
+    parser.add_argument('--keytype', default='ec-p256', choices=sorted(KEY_TYPES),
+                        help='device key algorithm')
+    parser.add_argument('--cache', default=DEFAULT_CACHE, help='fixture cache directory')
+    parser.add_argument('--workers', type=int, help='generator processes, default one per CPU')
+    parser.add_argument('--manifest', help='also write a bulk_load manifest of the fleet here')
+    args = parser.parse_args()
+    report = generate(args.devices, args.sku, args.keytype, args.cache, args.workers)
+    if args.manifest:
+        write_manifest(load_fleet(args.devices, args.sku, args.keytype, args.cache), args.manifest)
+    report['chunks'] = len(report['chunks'])
+    print(json.dumps(report))
+
+if __name__ == '__main__':
+    main()
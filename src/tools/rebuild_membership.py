@@ -0,0 +1,112 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Rebuild the authorizer's membership filter of registered device-ids from a
+parallel scan of the provisioning table and publish it to S3. Run it once
+to seed the filter; from then on the key index stream consumer adds every
+registered device-id to it. Rebuild now and then to drop removed devices
+and to resize the filter as the fleet grows.
+
+The filter's ETag is read before the scan and the new filter only
+replaces that one, so device-ids the stream consumer added while the scan
+ran are never lost: on a conflict the scan is simply run again.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m src.tools.rebuild_membership \\
+        --table widgiot-iot-provisioning-secretfree \\
+        --bucket <authorizer index bucket> [--key membership/device-ids.bloom] \\
+        [--error-rate 0.001] [--headroom 1.5] [--segments 4] [--attempts 3] [--dry-run]
+"""
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+from membership_utils import BloomFilter, FilterConflict, publish_filter
+
+DEFAULT_KEY = 'membership/device-ids.bloom'
+
+def scan_segment(ddb, table_name: str, segment: int, segments: int) -> list:
+    """Device-ids held by one parallel scan segment"""
+    paginator = ddb.get_paginator('scan')
+    pages = paginator.paginate(TableName=table_name,
+                               ProjectionExpression='#id',
+                               ExpressionAttributeNames={ '#id': 'device-id' },
+                               Segment=segment,
+                               TotalSegments=segments)
+    return [item['device-id']['S'] for page in pages for item in page['Items']]
+
+def published_etag(s3, bucket: str, key: str) -> str:
+    """ETag of the published filter, or None when there is none yet"""
+    try:
+        return s3.head_object(Bucket=bucket, Key=key)['ETag']
+    except ClientError as error:
+        if error.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+def build(table_name: str, error_rate: float = 0.001, headroom: float = 1.5,
+          segments: int = 4, ddb=None) -> tuple:
+    """
+    Build a filter holding every device-id in the table, returned with the
+    number of device-ids added. It is sized for headroom times the current
+    population so the false positive rate holds as the fleet grows.
+    """
+    ddb = ddb or boto3.client('dynamodb')
+    segments = max(1, segments)
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        parts = list(pool.map(lambda segment: scan_segment(ddb, table_name, segment, segments),
+                              range(segments)))
+
+    device_ids = [device_id for part in parts for device_id in part]
+    bloom = BloomFilter.for_capacity(int(len(device_ids) * max(1.0, headroom)), error_rate)
+    for device_id in device_ids:
+        bloom.add(device_id)
+    return bloom, len(device_ids)
+
+def rebuild(table_name: str, bucket: str, key: str = DEFAULT_KEY, error_rate: float = 0.001,
+            headroom: float = 1.5, segments: int = 4, dry_run: bool = False,
+            attempts: int = 3, ddb=None, s3=None) -> dict:
+    """Build the filter and publish it unless dry_run"""
+    if dry_run:
+        bloom, devices = build(table_name, error_rate, headroom, segments, ddb)
+    else:
+        s3 = s3 or boto3.client('s3')
+        for _ in range(max(1, attempts)):
+            # The stream consumer only adds to a published filter, so with
+            # none there is nothing to race against
+            etag = published_etag(s3, bucket, key)
+            bloom, devices = build(table_name, error_rate, headroom, segments, ddb)
+            if publish_filter(bloom, bucket, key, s3, etag):
+                break
+        else:
+            raise FilterConflict("Membership filter changed during every rebuild")
+    return { 'devices': devices,
+             'bits': bloom.size,
+             'hashes': bloom.hashes,
+             'bytes': len(bloom.to_bytes()),
+             'published': not dry_run }
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', required=True, help='provisioning table name')
+    parser.add_argument('--bucket', required=True, help='bucket the authorizer loads from')
+    parser.add_argument('--key', default=DEFAULT_KEY, help='object key of the filter')
+    parser.add_argument('--error-rate', type=float, default=0.001,
+                        help='target false positive rate')
+    parser.add_argument('--headroom', type=float, default=1.5,
+                        help='capacity as a multiple of the current device count')
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--attempts', type=int, default=3,
+                        help='scans to run while the stream keeps changing the filter')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='build and report without publishing')
+    args = parser.parse_args()
+    print(json.dumps(rebuild(args.table, args.bucket, args.key, args.error_rate,
+                             args.headroom, args.segments, args.dry_run, args.attempts)))
+
+if __name__ == '__main__':
+    main()
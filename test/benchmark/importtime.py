@@ -0,0 +1,82 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Cold start import time harness. Imports each handler module in a fresh
+interpreter under -X importtime and reports its cumulative import time,
+the heaviest top-level dependencies, and which heavy modules were loaded.
+
+Usage:
+    python -m test.benchmark.importtime [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HANDLERS = ('src.authorizer.main', 'src.issuer_acmpca.main', 'src.issuer_iotcore.main')
+
+# Modules that must not be paid for at module load
+DEFERRED = ('boto3', 'aws_lambda_powertools', 'OpenSSL')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def parse_importtime(stderr: str) -> list:
+    """(cumulative microseconds, depth, module) for every -X importtime line"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((int(cumulative), depth, name.strip()))
+    return entries
+
+def measure(module: str) -> dict:
+    """Import module once in a fresh interpreter"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.join(ROOT, 'src', 'layer_utils'),
+                                                      ROOT, env.get('PYTHONPATH')]))
+    code = ('import json, sys; import {0}; '
+            'print(json.dumps(sorted(sys.modules)))').format(module)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    entries = parse_importtime(result.stderr)
+    loaded = set(json.loads(result.stdout))
+    index = next(i for i, (_, _, name) in enumerate(entries) if name == module)
+    total, module_depth, _ = entries[index]
+
+    # -X importtime prints children before their parent, one level deeper
+    children = []
+    for cumulative, depth, name in reversed(entries[:index]):
+        if depth <= module_depth:
+            break
+        if depth == module_depth + 1:
+            children.append((cumulative, name))
+    top = sorted(children, reverse=True)[:5]
+    return { 'cumulative_ms': total / 1000,
+             'top_ms': { name: cumulative / 1000 for cumulative, name in top },
+             'deferred_loaded': sorted(name for name in DEFERRED if name in loaded) }
+
+def run(repeat: int = 3) -> dict:
+    """Median import time of every handler over repeat fresh interpreters"""
+    results = {}
+    for module in HANDLERS:
+        runs = [measure(module) for _ in range(repeat)]
+        results[module] = dict(runs[-1])
+        results[module]['cumulative_ms'] = round(statistics.median(
+            run['cumulative_ms'] for run in runs), 3)
+    return results
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per handler')
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+if __name__ == '__main__':
+    main()
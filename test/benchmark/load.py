@@ -0,0 +1,236 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Load driver replaying device-csr requests from a generated fleet against
+the authorizer and issuers, backed by moto, at a target concurrency and
+arrival rate.
+
+With --rate the driver is open loop: requests arrive on a Poisson (or, with
+--uniform, evenly spaced) schedule whether or not earlier ones finished,
+and latency is measured from the scheduled arrival so time spent queued for
+one of the --concurrency workers counts. Without --rate every worker sends
+its next request as soon as the previous one completes.
+
+The fleet comes from the src.tools.generate_fleet cache, so only the first
+run for a given size pays for key generation. The issuers stay subject to
+the client-side control-plane rate limits unless --unthrottled is given.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m test.benchmark.load \\
+        --devices 100000 --concurrency 64 --rate 500 \\
+        [--handlers authorizer,issuer_iotcore] [--keytype ec-p256] \\
+        [--cache .fleet] [--unthrottled] [--output load.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import threading
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from moto import mock_aws
+
+import ratelimit_utils
+from aws_utils import reset_clients
+from iot_utils import invalidate_registry
+from src.tools.bulk_load import BATCH_SIZE, Report, device_item, write_batch
+from src.tools.generate_fleet import DEFAULT_CACHE, load_fleet
+from test.benchmark.run import (MOCK_CONFIG, METHOD_ARN, REGION, SKUNAME, TABLE_NAME,
+                                CallCounter, current_rss_kb, git_commit, make_context,
+                                percentile, setup_backends)
+
+HANDLERS = ('authorizer', 'issuer_iotcore', 'issuer_acmpca')
+
+def arrival_times(count: int, rate: float = None, poisson: bool = True, seed: int = None) -> list:
+    """
+    Offsets in seconds from the start of the run at which each request is
+    sent; all zero, i.e. as fast as the workers allow, without a rate.
+    """
+    if not rate:
+        return [0.0] * count
+    generator = random.Random(seed)
+    offsets, offset = [], 0.0
+    for _ in range(count):
+        offsets.append(offset)
+        offset += generator.expovariate(rate) if poisson else 1.0 / rate
+    return offsets
+
+def summarize(samples: list) -> dict:
+    """Latency percentiles of samples in seconds, reported in milliseconds"""
+    if not samples:
+        return {}
+    return { 'p50_ms': round(percentile(samples, 50) * 1000, 3),
+             'p90_ms': round(percentile(samples, 90) * 1000, 3),
+             'p99_ms': round(percentile(samples, 99) * 1000, 3),
+             'max_ms': round(max(samples) * 1000, 3),
+             'mean_ms': round(statistics.fmean(samples) * 1000, 3) }
+
+def drive(handler, events: list, concurrency: int, rate: float = None, poisson: bool = True,
+          seed: int = None, clock=time.perf_counter, sleep=time.sleep) -> dict:
+    """
+    Replay events against handler on concurrency worker threads following
+    the arrival schedule for rate, returning latency and throughput.
+    """
+    schedule = arrival_times(len(events), rate, poisson, seed)
+    latencies, service = [], []
+    errors = Counter()
+    lock = threading.Lock()
+
+    def invoke(event, arrival):
+        begin = clock()
+        try:
+            # The issuers report a failed provisioning by returning None
+            if handler(event, make_context()) is None:
+                with lock:
+                    errors['NoResult'] += 1
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            with lock:
+                errors[type(error).__name__] += 1
+        end = clock()
+        with lock:
+            service.append(end - begin)
+            latencies.append(end - (begin if arrival is None else arrival))
+
+    start = clock()
+    lag = 0.0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for event, offset in zip(events, schedule):
+            if not rate:
+                # Closed loop: a request arrives when a worker picks it up
+                pool.submit(invoke, event, None)
+                continue
+            arrival = start + offset
+            now = clock()
+            if arrival > now:
+                sleep(arrival - now)
+            else:
+                lag = max(lag, now - arrival)
+            pool.submit(invoke, event, arrival)
+    wall = clock() - start
+
+    return { 'requests': len(events),
+             'errors': dict(errors),
+             'offered_rps': rate,
+             'throughput_rps': round(len(events) / wall, 2) if wall else None,
+             'max_dispatch_lag_ms': round(lag * 1000, 3),
+             'latency': summarize(latencies),
+             'service': summarize(service) }
+
+def load_table(fleet: list, ddb=None) -> dict:
+    """Register the fleet's keys in the provisioning table"""
+    ddb = ddb or boto3.client('dynamodb')
+    report = Report()
+    items = [device_item(device['device-id'], device['pubkey']) for device in fleet]
+    for first in range(0, len(items), BATCH_SIZE):
+        write_batch(ddb, TABLE_NAME, items[first:first + BATCH_SIZE], report)
+    return report.as_dict()
+
+def events_for(name: str, fleet: list) -> list:
+    """The API Gateway events a handler receives for every device of the fleet"""
+    if name == 'authorizer':
+        return [{ 'headers': { 'device-csr': device['csr'] }, 'methodArn': METHOD_ARN }
+                for device in fleet]
+    return [{ 'headers': { 'device-csr': device['csr'] } } for device in fleet]
+
+def unthrottle():
+    """Lift the client-side rate limits so only the handlers are measured"""
+    for name in ratelimit_utils.DEFAULT_RATES:
+        os.environ['RATE_LIMIT_' + name.upper()] = '1000000'
+    ratelimit_utils.RATE_LIMITS = ratelimit_utils.RateLimits()
+
+def run(devices: int = 1000, concurrency: int = 16, rate: float = None,
+        handlers: tuple = HANDLERS, keytype: str = 'ec-p256', cache: str = DEFAULT_CACHE,
+        workers: int = None, poisson: bool = True, seed: int = None,
+        unthrottled: bool = False) -> dict:
+    """Generate or load the fleet, then drive every requested handler"""
+    os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+    started = time.monotonic()
+    fleet = load_fleet(devices, SKUNAME, keytype, cache, workers)
+    results = { 'meta': { 'commit': git_commit(),
+                          'python': platform.python_version(),
+                          'timestamp': time.time(),
+                          'devices': len(fleet),
+                          'keytype': keytype,
+                          'concurrency': concurrency,
+                          'rate': rate,
+                          'arrivals': 'poisson' if poisson else 'uniform',
+                          'fleet_seconds': round(time.monotonic() - started, 3) },
+                'handlers': {} }
+    if unthrottled:
+        unthrottle()
+
+    counter = CallCounter()
+    with mock_aws(config=MOCK_CONFIG):
+        boto3.setup_default_session()
+        reset_clients()
+        setup_backends([])
+        results['meta']['table_load'] = load_table(fleet)
+        invalidate_registry()
+        boto3.DEFAULT_SESSION.events.register('before-call', counter)
+
+        # pylint: disable=import-outside-toplevel
+        from src.authorizer import main as authorizer
+        from src.issuer_iotcore import main as issuer_iotcore
+        from src.issuer_acmpca import main as issuer_acmpca
+        entry_points = { 'authorizer': authorizer.lambda_handler,
+                         'issuer_iotcore': issuer_iotcore.lambda_handler,
+                         'issuer_acmpca': issuer_acmpca.lambda_handler }
+        authorizer.invalidate_pubkey()
+
+        for name in handlers:
+            counter.reset()
+            result = drive(entry_points[name], events_for(name, fleet), concurrency,
+                           rate, poisson, seed)
+            calls = dict(counter.calls)
+            result['aws_calls_per_request'] = round(sum(calls.values()) / max(1, len(fleet)), 2)
+            results['handlers'][name] = result
+        boto3.DEFAULT_SESSION.events.unregister('before-call', counter)
+
+    results['rss_kb'] = current_rss_kb()
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1000, help='fleet size')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent invocations')
+    parser.add_argument('--rate', type=float, help='target arrival rate in requests per second')
+    parser.add_argument('--uniform', action='store_true',
+                        help='evenly spaced instead of Poisson arrivals')
+    parser.add_argument('--seed', type=int, help='arrival schedule seed')
+    parser.add_argument('--handlers', default=','.join(HANDLERS),
+                        help='comma separated handlers to drive, in order')
+    parser.add_argument('--keytype', default='ec-p256', help='device key algorithm')
+    parser.add_argument('--cache', default=DEFAULT_CACHE, help='fleet cache directory')
+    parser.add_argument('--workers', type=int, help='fleet generator processes')
+    parser.add_argument('--unthrottled', action='store_true',
+                        help='lift the client-side control-plane rate limits')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+    handlers = tuple(name for name in args.handlers.split(',') if name)
+    unknown = set(handlers) - set(HANDLERS)
+    if unknown:
+        parser.error('unknown handlers: ' + ', '.join(sorted(unknown)))
+    # The handlers' EMF lines go to stdout too and would corrupt the JSON
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, redirect_stdout(devnull):
+        results = run(args.devices, args.concurrency, args.rate, handlers, args.keytype,
+                      args.cache, args.workers, not args.uniform, args.seed, args.unthrottled)
+    results = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(results + '\n')
+    else:
+        print(results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Offline end-to-end benchmark of the authorizer and both issuers against
+moto backed DynamoDB, AWS IoT and ACM PCA with a synthetic device fleet.
+
+Reports per handler p50/p95/p99 latency, throughput at the requested
+concurrency, AWS API calls per request and process RSS as JSON so results
+can be compared across commits.
+
+Usage:
+    PYTHONPATH=src/layer_utils python -m test.benchmark.run \\
+        --devices 50 --concurrency 8 --output bench.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import boto3
+from moto import mock_aws
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from cryptography.x509.oid import NameOID
+
+from aws_utils import reset_clients
+from iot_utils import invalidate_registry
+
+REGION = 'us-east-1'
+ACCOUNT = '123456789012'
+SKUNAME = 'widgiot'
+TABLE_NAME = SKUNAME + '-iot-provisioning-secretfree'
+METHOD_ARN = 'arn:aws:execute-api:{0}:{1}:abcdef1234/dev/POST/new'.format(REGION, ACCOUNT)
+MOCK_CONFIG = { 'core': { 'mock_credentials': True,
+                          'reset_boto3_session': False,
+                          'service_whitelist': None },
+                'iot': { 'use_valid_cert': True } }
+
+class CallCounter:
+    """Counts AWS API calls made through any boto3 client"""
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, model, **kwargs):
+        with self._lock:
+            self.calls[model.service_model.service_name + '.' + model.name] += 1
+
+    def reset(self):
+        """Forget every counted call"""
+        with self._lock:
+            self.calls.clear()
+
+def make_fleet(size: int) -> list:
+    """Synthetic devices: (device-id, base64 PEM CSR, base64 PEM public key)"""
+    fleet = []
+    for _ in range(size):
+        device_id = str(uuid.uuid4())
+        key = ec.generate_private_key(curve=ec.SECP256R1())
+        builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, SKUNAME),
+            x509.NameAttribute(NameOID.COMMON_NAME, device_id)]))
+        csr = builder.sign(key, hashes.SHA256()).public_bytes(Encoding.PEM)
+        pubkey = key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+        fleet.append((device_id, base64.b64encode(csr).decode('ascii'),
+                      base64.b64encode(pubkey).decode('ascii')))
+    return fleet
+
+def make_context():
+    """Lambda context stand-in with a generous deadline"""
+    context = MagicMock()
+    context.invoked_function_arn = 'arn:aws:lambda:{0}:{1}:function:bench'.format(REGION, ACCOUNT)
+    context.aws_request_id = str(uuid.uuid4())
+    context.get_remaining_time_in_millis.return_value = 30000
+    return context
+
+def setup_backends(fleet: list):
+    """Create the table, the CA and load the fleet's keys"""
+    ddb = boto3.client('dynamodb')
+    ddb.create_table(TableName=TABLE_NAME,
+                     KeySchema=[{ 'AttributeName': 'device-id', 'KeyType': 'HASH' }],
+                     AttributeDefinitions=[{ 'AttributeName': 'device-id',
+                                             'AttributeType': 'S' }],
+                     BillingMode='PAY_PER_REQUEST')
+    for device_id, _, pubkey in fleet:
+        ddb.put_item(TableName=TABLE_NAME, Item={ 'device-id': { 'S': device_id },
+                                                  'pubkey': { 'S': pubkey } })
+    acmpca = boto3.client('acm-pca')
+    ca = acmpca.create_certificate_authority(
+        CertificateAuthorityConfiguration={ 'KeyAlgorithm': 'RSA_2048',
+                                            'SigningAlgorithm': 'SHA256WITHRSA',
+                                            'Subject': { 'CommonName': 'bench-ca' } },
+        CertificateAuthorityType='ROOT')
+    os.environ.update({ 'SECRETFREE_TABLENAME': TABLE_NAME,
+                        'SKUNAME': SKUNAME,
+                        'ACMPCA_CA_ARN': ca['CertificateAuthorityArn'],
+                        'CERT_VALIDITY_DAYS': '180',
+                        'CERT_SIGNING_ALGO': 'SHA256WITHRSA' })
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest rank percentile of samples"""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def bench_handler(handler, events: list, concurrency: int, counter: CallCounter) -> dict:
+    """Invoke handler for every event at the given concurrency"""
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+
+    def invoke(event):
+        start = time.perf_counter()
+        try:
+            # The issuers report a failed provisioning by returning None
+            if handler(event, make_context()) is None:
+                with lock:
+                    errors['NoResult'] += 1
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            with lock:
+                errors[type(error).__name__] += 1
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    counter.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(invoke, events))
+    wall = time.perf_counter() - start
+    calls = dict(counter.calls)
+
+    return { 'requests': len(events),
+             'errors': dict(errors),
+             'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+             'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+             'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+             'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+             'throughput_rps': round(len(events) / wall, 2),
+             'aws_calls_per_request': round(sum(calls.values()) / len(events), 2),
+             'aws_calls': calls }
+
+def current_rss_kb() -> int:
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return 0
+
+def git_commit() -> str:
+    """The commit being benchmarked, when run from a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(devices: int = 50, concurrency: int = 8) -> dict:
+    """Run the whole suite and return the results document"""
+    os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+    fleet = make_fleet(devices)
+    counter = CallCounter()
+    results = { 'meta': { 'commit': git_commit(),
+                          'python': platform.python_version(),
+                          'timestamp': time.time(),
+                          'devices': devices,
+                          'concurrency': concurrency },
+                'handlers': {} }
+
+    with mock_aws(config=MOCK_CONFIG):
+        boto3.setup_default_session()
+        # Clients cached by earlier runs belong to the previous session
+        reset_clients()
+        boto3.DEFAULT_SESSION.events.register('before-call', counter)
+        setup_backends(fleet)
+        invalidate_registry()
+
+        # pylint: disable=import-outside-toplevel
+        from src.authorizer import main as authorizer
+        from src.issuer_iotcore import main as issuer_iotcore
+        from src.issuer_acmpca import main as issuer_acmpca
+
+        authorizer_events = [{ 'headers': { 'device-csr': csr }, 'methodArn': METHOD_ARN }
+                             for _, csr, _ in fleet]
+        issuer_events = [{ 'headers': { 'device-csr': csr } } for _, csr, _ in fleet]
+
+        authorizer.invalidate_pubkey()
+        results['handlers']['authorizer.cold'] = bench_handler(
+            authorizer.lambda_handler, authorizer_events, concurrency, counter)
+        results['handlers']['authorizer.warm'] = bench_handler(
+            authorizer.lambda_handler, authorizer_events, concurrency, counter)
+        results['handlers']['issuer_iotcore'] = bench_handler(
+            issuer_iotcore.lambda_handler, issuer_events, concurrency, counter)
+        results['handlers']['issuer_acmpca'] = bench_handler(
+            issuer_acmpca.lambda_handler, issuer_events, concurrency, counter)
+        boto3.DEFAULT_SESSION.events.unregister('before-call', counter)
+
+    results['rss_kb'] = current_rss_kb()
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=50, help='synthetic fleet size')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent invocations')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+    # The handlers' EMF lines go to stdout too and would corrupt the JSON
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, redirect_stdout(devnull):
+        results = run(args.devices, args.concurrency)
+    results = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(results + '\n')
+    else:
+        print(results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Cold start import budget enforcement
+"""
+import os
+from unittest import TestCase
+
+from test.benchmark.importtime import HANDLERS, run
+
+# Generous enough for a loaded CI runner; override to tighten locally.
+BUDGET_MS = { 'src.authorizer.main': float(os.environ.get('AUTHORIZER_IMPORT_BUDGET_MS', '250')),
+              'src.issuer_acmpca.main': float(os.environ.get('ISSUER_IMPORT_BUDGET_MS', '400')),
+              'src.issuer_iotcore.main': float(os.environ.get('ISSUER_IMPORT_BUDGET_MS', '400')) }
+
+class TestImportTime(TestCase):
+    """Keep handler cold start imports within budget"""
+    @classmethod
+    def setUpClass(cls):
+        cls.results = run(repeat=3)
+
+    def test_pos_heavy_modules_deferred(self):
+        """boto3, powertools and pyOpenSSL are not loaded at module import"""
+        for module in HANDLERS:
+            assert self.results[module]['deferred_loaded'] == [], module
+
+    def test_pos_within_budget(self):
+        """every handler imports within its budget"""
+        for module in HANDLERS:
+            assert self.results[module]['cumulative_ms'] <= BUDGET_MS[module], \
+                (module, self.results[module])
@@ -0,0 +1,52 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Load driver smoke testing
+"""
+import json
+import tempfile
+import time
+from unittest import TestCase
+
+from test.benchmark.load import arrival_times, drive, run
+
+class TestLoadDriver(TestCase):
+    """Keep the load driver runnable and its schedule honest"""
+    def test_pos_arrival_schedules(self):
+        """uniform arrivals are evenly spaced and Poisson ones average the rate"""
+        assert arrival_times(3) == [0.0, 0.0, 0.0]
+        assert arrival_times(3, rate=10, poisson=False) == [0.0, 0.1, 0.2]
+        offsets = arrival_times(5000, rate=100, seed=7)
+        assert offsets == sorted(offsets)
+        assert 45 < offsets[-1] < 55
+
+    def test_pos_open_loop_counts_queueing(self):
+        """latency is measured from the scheduled arrival, not the dispatch"""
+        def handler(event, context):
+            time.sleep(0.05)
+            return event
+
+        # Requests arrive every 10ms but a single worker needs 50ms for each
+        result = drive(handler, [{}] * 4, concurrency=1, rate=100, poisson=False)
+        assert result['requests'] == 4
+        assert result['service']['max_ms'] < 100
+        assert result['latency']['max_ms'] > 2 * result['service']['max_ms']
+
+    def test_neg_no_result_is_an_error(self):
+        """a handler reporting failure by returning None counts as an error"""
+        result = drive(lambda event, context: event, [None, {}, None], concurrency=2)
+        assert result['errors'] == { 'NoResult': 2 }
+
+    def test_pos_run_small_fleet(self):
+        """a tiny fleet is generated, loaded and driven through every handler"""
+        with tempfile.TemporaryDirectory() as cache:
+            results = json.loads(json.dumps(run(devices=3, concurrency=2, rate=50,
+                                                cache=cache, workers=1, seed=1)))
+        assert results['meta']['table_load']['written'] == 3
+        for name in ('authorizer', 'issuer_iotcore', 'issuer_acmpca'):
+            handler = results['handlers'][name]
+            assert handler['requests'] == 3
+            assert handler['errors'] == {}
+            assert handler['latency']['p50_ms'] <= handler['latency']['max_ms']
+        assert results['handlers']['authorizer']['aws_calls_per_request'] == 1
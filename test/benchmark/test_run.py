@@ -0,0 +1,30 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Benchmark suite smoke testing
+"""
+import json
+from unittest import TestCase
+
+from test.benchmark.run import CallCounter, bench_handler, run
+
+class TestBenchmarkRun(TestCase):
+    """Keep the benchmark suite runnable"""
+    def test_pos_run_small_fleet(self):
+        """a tiny fleet produces a complete, serializable report"""
+        results = json.loads(json.dumps(run(devices=3, concurrency=2)))
+        for name in ('authorizer.cold', 'authorizer.warm', 'issuer_iotcore', 'issuer_acmpca'):
+            handler = results['handlers'][name]
+            assert handler['requests'] == 3
+            assert handler['errors'] == {}
+            assert handler['p50_ms'] <= handler['p99_ms']
+        assert results['handlers']['authorizer.cold']['aws_calls'] == { 'dynamodb.GetItem': 3 }
+        assert results['handlers']['authorizer.warm']['aws_calls_per_request'] == 0
+        assert results['rss_kb'] > 0
+
+    def test_neg_no_result_is_an_error(self):
+        """a handler reporting failure by returning None counts as an error"""
+        results = bench_handler(lambda event, context: event, [None, 'ok', None],
+                                concurrency=2, counter=CallCounter())
+        assert results['errors'] == { 'NoResult': 2 }
@@ -0,0 +1,55 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Two-phase issuance helper unit testing
+"""
+import os
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from moto import mock_aws
+from boto3 import client
+
+import async_utils
+
+@mock_aws
+class TestAsyncUtils(TestCase):
+    """Unit tests for the two-phase issuance helpers"""
+    def setUp(self):
+        self.env = patch.dict(os.environ, { 'CERTIFICATE_BUCKET': 'widgiot-certificates',
+                                            'AWS_DEFAULT_REGION': 'us-east-1' })
+        self.env.start()
+        self.s3 = client('s3')
+        self.s3.create_bucket(Bucket='widgiot-certificates')
+
+    def test_pos_store_and_presign(self):
+        """the result lands under the key the pre-signed url points at"""
+        key = async_utils.certificate_key('device-1', 'request-1')
+        url = async_utils.retrieval_url(key, s3=self.s3)
+        async_utils.store_result(key, { 'status': 'ISSUED' }, s3=self.s3)
+        assert key in url and 'Signature' in url
+        body = self.s3.get_object(Bucket='widgiot-certificates', Key=key)['Body'].read()
+        assert json.loads(body) == { 'status': 'ISSUED' }
+
+    def test_pos_async_enabled(self):
+        """the mode follows the environment"""
+        with patch.dict(os.environ, { 'ASYNC_ISSUANCE': 'true' }):
+            assert async_utils.async_enabled()
+        with patch.dict(os.environ, { 'ASYNC_ISSUANCE': 'false' }):
+            assert not async_utils.async_enabled()
+
+    def test_pos_proxy_responses(self):
+        """the 202 and 200 answers share the proxy integration shape"""
+        accepted = async_utils.accepted_response('https://example.com/result')
+        issued = async_utils.proxy_response(200, 'pem', { 'Content-Type': 'application/x-pem-file' })
+        assert set(accepted) == set(issued) == { 'statusCode', 'headers', 'body' }
+        assert accepted['statusCode'] == 202
+        assert accepted['headers'] == { 'Content-Type': 'application/json',
+                                         'Location': 'https://example.com/result' }
+        assert json.loads(accepted['body'])['status'] == 'PENDING'
+        assert issued['headers'] == { 'Content-Type': 'application/x-pem-file' }
+
+    def tearDown(self):
+        self.env.stop()
@@ -0,0 +1,260 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Authorizer lambda function unit testing
+"""
+import os
+import base64
+import uuid
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from pytest import raises
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from cryptography.x509.oid import NameOID
+from cryptography import x509
+
+from key_utils import spki_fingerprint
+from hedge_utils import HedgedLookup
+from membership_utils import BloomFilter, MembershipFilter, add_members, publish_filter
+import sku_utils
+from sku_utils import SkuConfigStore
+
+TABLE_NAME = 'widgiot-iot-provisioning-secretfree'
+METHOD_ARN = 'arn:aws:execute-api:us-east-1:123456789012:abcdef1234/dev/POST/new'
+
+os.environ['SECRETFREE_TABLENAME'] = TABLE_NAME
+
+from src.authorizer import main  # pylint: disable=wrong-import-position
+
+def make_csr(key, cn: str) -> bytes:
+    """Build a PEM encoded CSR for the given key and common name"""
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)]))
+    return builder.sign(key, hashes.SHA256()).public_bytes(Encoding.PEM)
+
+def make_event(csr: bytes) -> dict:
+    """Build the API Gateway authorizer event"""
+    return { 'headers': { 'device-csr': base64.b64encode(csr).decode('ascii') },
+             'methodArn': METHOD_ARN }
+
+@mock_aws(config={
+    "core": {
+        "mock_credentials": True,
+        "reset_boto3_session": False,
+        "service_whitelist": None,
+    }})
+class TestAuthorizer(TestCase):
+    """Unit tests for the authorizer lambda function"""
+    def setUp(self):
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        main.invalidate_pubkey()
+        self.ddb = client('dynamodb')
+        self.ddb.create_table(TableName=TABLE_NAME,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        self.key = ec.generate_private_key(curve=ec.SECP256R1())
+        self.device_id = str(uuid.uuid4())
+        pubkey = self.key.public_key().public_bytes(Encoding.PEM,
+                                                    PublicFormat.SubjectPublicKeyInfo)
+        self.ddb.put_item(TableName=TABLE_NAME,
+                          Item={ 'device-id': { 'S': self.device_id },
+                                 'pubkey': { 'S': base64.b64encode(pubkey).decode('ascii') } })
+
+    def test_pos_matching_key_allows(self):
+        """a csr signed by the registered key yields an allow policy"""
+        response = main.lambda_handler(make_event(make_csr(self.key, self.device_id)), None)
+        statement = response['policyDocument']['Statement'][0]
+        assert statement['Effect'] == 'Allow'
+        assert response['context']['deviceId'] == self.device_id
+        assert response['context']['keyFingerprint'] == spki_fingerprint(
+            self.key.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo))
+
+    def test_neg_mismatched_key_denies(self):
+        """a csr signed by some other key is unauthorized"""
+        other = ec.generate_private_key(curve=ec.SECP256R1())
+        with raises(Exception, match='Unauthorized'):
+            main.lambda_handler(make_event(make_csr(other, self.device_id)), None)
+
+    def test_pos_warm_cache_skips_dynamodb(self):
+        """a second lookup for the same device is served from the cache"""
+        event = make_event(make_csr(self.key, self.device_id))
+        main.lambda_handler(event, None)
+        hits = main.PUBKEY_CACHE.stats()['hits']
+        with patch.object(main, 'get_client') as boto_client:
+            main.lambda_handler(event, None)
+            boto_client.assert_not_called()
+        assert main.PUBKEY_CACHE.stats()['hits'] == hits + 1
+
+    def test_pos_fingerprint_item_skips_key_parse(self):
+        """items carrying a fingerprint are compared without loading the stored key"""
+        der = self.key.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+        self.ddb.put_item(TableName=TABLE_NAME,
+                          Item={ 'device-id': { 'S': self.device_id },
+                                 'fingerprint': { 'S': spki_fingerprint(der) } })
+        with patch('key_utils.load_pem_public_key') as load_publickey:
+            response = main.lambda_handler(make_event(make_csr(self.key, self.device_id)), None)
+            load_publickey.assert_not_called()
+        assert response['policyDocument']['Statement'][0]['Effect'] == 'Allow'
+
+    def test_neg_unknown_device_is_negatively_cached(self):
+        """an unregistered device-id is refused, then refused without a table read"""
+        event = make_event(make_csr(self.key, str(uuid.uuid4())))
+        with raises(Exception, match='Unauthorized'):
+            main.lambda_handler(event, None)
+        with patch.object(main, 'get_client') as boto_client, \
+             raises(Exception, match='Unauthorized'):
+            main.lambda_handler(event, None)
+        boto_client.assert_not_called()
+
+    def test_neg_membership_filter_skips_dynamodb(self):
+        """a device-id absent from the membership filter is refused without a table read"""
+        membership = MagicMock()
+        membership.might_contain.return_value = False
+        with patch.object(main, 'MEMBERSHIP', membership), \
+             patch.object(main, 'get_client') as boto_client, \
+             raises(Exception, match='Unauthorized'):
+            main.lambda_handler(make_event(make_csr(self.key, self.device_id)), None)
+        boto_client.assert_not_called()
+
+    def test_pos_device_registered_after_filter_is_authorized(self):
+        """a device added to the filter after it was loaded is admitted before the refresh"""
+        s3 = client('s3')
+        s3.create_bucket(Bucket='widgiot-authorizer-index')
+        bloom = BloomFilter.for_capacity(100)
+        bloom.add('device-0')
+        publish_filter(bloom, 'widgiot-authorizer-index', 'membership.bloom', s3)
+        clock = MagicMock(return_value=0.0)
+        membership = MembershipFilter('widgiot-authorizer-index', 'membership.bloom', refresh=60,
+                                      recheck=1, clock=clock, s3=s3)
+        assert membership.might_contain('device-0')
+        assert not membership.might_contain(self.device_id)
+
+        # The table stream adds the newly registered device to the filter
+        add_members([self.device_id], 'widgiot-authorizer-index', 'membership.bloom', s3=s3)
+        clock.return_value = 2.0
+        with patch.object(main, 'MEMBERSHIP', membership):
+            response = main.lambda_handler(make_event(make_csr(self.key, self.device_id)), None)
+        assert response['policyDocument']['Statement'][0]['Effect'] == 'Allow'
+
+    def test_pos_key_index_skips_dynamodb(self):
+        """a device found in the key index is compared without a table read"""
+        der = self.key.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+        key_index = MagicMock()
+        key_index.lookup.return_value = spki_fingerprint(der)
+        with patch.object(main, 'KEY_INDEX', key_index), \
+             patch.object(main, 'get_client') as boto_client:
+            response = main.lambda_handler(make_event(make_csr(self.key, self.device_id)), None)
+            boto_client.assert_not_called()
+        assert response['policyDocument']['Statement'][0]['Effect'] == 'Allow'
+
+    def test_pos_compact_binary_item(self):
+        """items holding only the compact binary key are compared"""
+        point = self.key.public_key().public_bytes(Encoding.X962, PublicFormat.CompressedPoint)
+        self.ddb.put_item(TableName=TABLE_NAME,
+                          Item={ 'device-id': { 'S': self.device_id },
+                                 'pubkey_der': { 'B': point },
+                                 'keytype': { 'S': 'ec-p256' } })
+        response = main.lambda_handler(make_event(make_csr(self.key, self.device_id)), None)
+        assert response['policyDocument']['Statement'][0]['Effect'] == 'Allow'
+
+    def test_neg_junk_header_skips_dynamodb(self):
+        """junk headers are refused by screening, before any table read"""
+        for value in ('not base64!', base64.b64encode(b'x' * 64).decode('ascii'), None):
+            with patch.object(main, 'get_client') as boto_client, \
+                 raises(Exception, match='Unauthorized'):
+                main.lambda_handler({ 'headers': { 'device-csr': value },
+                                      'methodArn': METHOD_ARN }, None)
+            boto_client.assert_not_called()
+
+    def test_neg_forged_signature_denies(self):
+        """the registered key with a signature that does not verify is unauthorized"""
+        csr = x509.load_pem_x509_csr(make_csr(self.key, self.device_id))
+        der = bytearray(csr.public_bytes(Encoding.DER))
+        der[-1] ^= 0x01
+        pem = (b'-----BEGIN CERTIFICATE REQUEST-----\n' + base64.encodebytes(bytes(der)) +
+               b'-----END CERTIFICATE REQUEST-----\n')
+        with patch.object(main, 'annotate') as annotate, \
+             raises(Exception, match='Unauthorized'):
+            main.lambda_handler(make_event(pem), None)
+        annotate.assert_any_call('RejectStage', 'signature')
+
+    def test_pos_hedged_lookup_finds_lagging_replica(self):
+        """with two replicas a device only present in the secondary is admitted"""
+        remote = client('dynamodb', region_name='us-west-2')
+        remote.create_table(TableName=TABLE_NAME,
+                            KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                            AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                   'AttributeType': 'S'}],
+                            BillingMode='PAY_PER_REQUEST')
+        key = ec.generate_private_key(curve=ec.SECP256R1())
+        device_id = str(uuid.uuid4())
+        der = key.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+        remote.put_item(TableName=TABLE_NAME,
+                        Item={ 'device-id': { 'S': device_id },
+                               'fingerprint': { 'S': spki_fingerprint(der) } })
+        lookup = HedgedLookup(['us-east-1', 'us-west-2'], timeout=5.0)
+        with patch.object(main, 'HEDGED_LOOKUP', lookup):
+            response = main.lambda_handler(make_event(make_csr(key, device_id)), None)
+        assert response['policyDocument']['Statement'][0]['Effect'] == 'Allow'
+        assert len(lookup.latency['us-east-1']) == 1
+        assert len(lookup.latency['us-west-2']) == 1
+
+    def test_pos_replica_reads_are_not_retried(self):
+        """the hedged replica clients make exactly one attempt per read"""
+        config = main.get_client('dynamodb', 'us-west-2', **main.LOOKUP_CLIENT).meta.config
+        assert config.retries['total_max_attempts'] == 1
+
+    def test_pos_subject_routing_reads_sku_table(self):
+        """with subject routing the csr ou selects the sku and its table"""
+        other = 'gadgiot-iot-provisioning-secretfree'
+        self.ddb.create_table(TableName=other,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        client('s3').create_bucket(Bucket='widgiot-sku-config')
+        client('s3').put_object(Bucket='widgiot-sku-config', Key='sku-config.json',
+                                Body=b'{"version": 1, "skus": {"gadgiot": {}}}')
+        key = ec.generate_private_key(curve=ec.SECP256R1())
+        device_id = str(uuid.uuid4())
+        der = key.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+        self.ddb.put_item(TableName=other,
+                          Item={ 'device-id': { 'S': device_id },
+                                 'fingerprint': { 'S': spki_fingerprint(der) } })
+        builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, 'gadgiot'),
+            x509.NameAttribute(NameOID.COMMON_NAME, device_id)]))
+        csr = builder.sign(key, hashes.SHA256()).public_bytes(Encoding.PEM)
+        store = SkuConfigStore('widgiot-sku-config', 'sku-config.json')
+        with patch.dict(os.environ, { 'SKU_ROUTING': 'subject' }), \
+             patch.object(sku_utils, 'SKU_CONFIG', store):
+            response = main.lambda_handler(make_event(csr), None)
+            assert response['context']['sku'] == 'gadgiot'
+            # The device is not registered for the csr's own cn-only sku
+            with patch.object(main, 'annotate') as annotate, \
+                 raises(Exception, match='Unauthorized'):
+                main.lambda_handler(make_event(make_csr(key, device_id)), None)
+            annotate.assert_any_call('RejectReason', 'unknown')
+
+    def test_pos_path_routing_scopes_policy(self):
+        """with path routing the policy only allows the sku's resources"""
+        event = make_event(make_csr(self.key, self.device_id))
+        event['methodArn'] = event['methodArn'].replace('/POST/new', '/POST/widgiot/new')
+        with patch.dict(os.environ, { 'SKU_ROUTING': 'path', 'SKUNAME': 'widgiot' }):
+            response = main.lambda_handler(event, None)
+        resources = response['policyDocument']['Statement'][0]['Resource']
+        assert resources[0].endswith('/dev/POST/widgiot/new')
+        assert response['context']['sku'] == 'widgiot'
+
+    def tearDown(self):
+        main.invalidate_pubkey()
@@ -0,0 +1,73 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Shared AWS client provider unit testing
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+
+from moto import mock_aws
+
+import aws_utils
+from aws_utils import get_client, reset_clients, warm_up
+
+@mock_aws
+class TestAwsUtils(TestCase):
+    """Unit tests for the container-lifetime client cache"""
+    def setUp(self):
+        reset_clients()
+
+    def tearDown(self):
+        reset_clients()
+
+    def test_pos_client_reused_per_region(self):
+        """one client per service and region, shared by later calls"""
+        with patch.dict(os.environ, { 'AWS_DEFAULT_REGION': 'us-east-1' }):
+            first = get_client('dynamodb')
+            assert get_client('dynamodb') is first
+            assert get_client('dynamodb', 'us-east-1') is first
+            other = get_client('dynamodb', 'eu-west-1')
+        assert other is not first
+        assert other.meta.region_name == 'eu-west-1'
+
+    def test_pos_tuned_config(self):
+        """clients carry keep-alive, pool size, timeouts and adaptive retries"""
+        with patch.dict(os.environ, { 'AWS_DEFAULT_REGION': 'us-east-1',
+                                      'AWS_MAX_POOL_CONNECTIONS': '24' }):
+            config = get_client('dynamodb').meta.config
+        assert config.tcp_keepalive is True
+        assert config.max_pool_connections == 24
+        assert config.connect_timeout == 2.0
+        assert config.read_timeout == 10.0
+        assert config.retries['mode'] == 'adaptive'
+
+    def test_pos_rate_limited_services_single_attempt(self):
+        """clients of rate limited services leave retrying to the limiter"""
+        with patch.dict(os.environ, { 'AWS_DEFAULT_REGION': 'us-east-1' }):
+            iot = get_client('iot').meta.config
+            pinned = get_client('iot', retries={ 'mode': 'adaptive', 'max_attempts': 2 })
+        assert iot.retries == { 'mode': 'standard', 'total_max_attempts': 1 }
+        assert pinned.meta.config.retries['total_max_attempts'] == 3
+
+    def test_pos_concurrent_first_use(self):
+        """threads racing on first use all get the same client"""
+        with patch.dict(os.environ, { 'AWS_DEFAULT_REGION': 'us-east-1' }):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                clients = list(pool.map(lambda _: get_client('s3'), range(16)))
+        assert len({ id(client) for client in clients }) == 1
+
+    def test_pos_warm_up(self):
+        """the services named in AWS_CLIENT_WARM_UP are created up front"""
+        with patch.dict(os.environ, { 'AWS_DEFAULT_REGION': 'us-east-1',
+                                      'AWS_CLIENT_WARM_UP': 'iot, acm-pca' }):
+            warm_up()
+        assert sorted(service for service, _, _ in aws_utils._CLIENTS) == ['acm-pca', 'iot']  # pylint: disable=protected-access
+
+    def test_neg_warm_up_unset(self):
+        """without services nothing is created"""
+        with patch.dict(os.environ, { 'AWS_CLIENT_WARM_UP': '' }):
+            warm_up()
+        assert not aws_utils._CLIENTS  # pylint: disable=protected-access
@@ -0,0 +1,59 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Fingerprint backfill migration unit testing
+"""
+import base64
+from unittest import TestCase
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from key_utils import spki_fingerprint
+from src.tools.backfill_fingerprints import backfill
+
+TABLE_NAME = 'widgiot-iot-provisioning-secretfree'
+
+@mock_aws
+class TestBackfillFingerprints(TestCase):
+    """Unit tests for the fingerprint backfill migration"""
+    def setUp(self):
+        self.ddb = client('dynamodb', region_name='us-east-1')
+        self.ddb.create_table(TableName=TABLE_NAME,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        self.fingerprints = {}
+        for i in range(3):
+            key = ec.generate_private_key(curve=ec.SECP256R1()).public_key()
+            pem = key.public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+            der = key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+            self.fingerprints[str(i)] = spki_fingerprint(der)
+            self.ddb.put_item(TableName=TABLE_NAME,
+                              Item={ 'device-id': { 'S': str(i) },
+                                     'pubkey': { 'S': base64.b64encode(pem).decode('ascii') } })
+        self.ddb.put_item(TableName=TABLE_NAME,
+                          Item={ 'device-id': { 'S': 'junk' },
+                                 'pubkey': { 'S': base64.b64encode(b'junk').decode('ascii') } })
+
+    def test_pos_backfill(self):
+        """every valid item gains its fingerprint, a second run has nothing to do"""
+        report = backfill(TABLE_NAME, ddb=self.ddb)
+        assert report['updated'] == 3
+        assert report['failed'] == 1
+        for device_id, fingerprint in self.fingerprints.items():
+            item = self.ddb.get_item(TableName=TABLE_NAME,
+                                     Key={ 'device-id': { 'S': device_id } })['Item']
+            assert item['fingerprint']['S'] == fingerprint
+        assert backfill(TABLE_NAME, ddb=self.ddb)['updated'] == 0
+
+    def test_pos_dry_run(self):
+        """a dry run reports without writing"""
+        assert backfill(TABLE_NAME, dry_run=True, ddb=self.ddb)['updated'] == 3
+        item = self.ddb.get_item(TableName=TABLE_NAME, Key={ 'device-id': { 'S': '0' } })['Item']
+        assert 'fingerprint' not in item
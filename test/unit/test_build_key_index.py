@@ -0,0 +1,61 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Key index snapshot build tool unit testing
+"""
+import tempfile
+from unittest import TestCase
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from key_utils import compact_public_key, spki_fingerprint
+from keyindex_utils import KeyIndex
+from src.tools.build_key_index import build
+
+TABLE_NAME = 'widgiot-iot-provisioning-secretfree'
+BUCKET = 'widgiot-authorizer-index'
+
+@mock_aws
+class TestBuildKeyIndex(TestCase):
+    """Unit tests for the key index snapshot build"""
+    def setUp(self):
+        self.ddb = client('dynamodb', region_name='us-east-1')
+        self.s3 = client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.ddb.create_table(TableName=TABLE_NAME,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        for i in range(10):
+            self.ddb.put_item(TableName=TABLE_NAME,
+                              Item={ 'device-id': { 'S': f'device-{i}' },
+                                     'fingerprint': { 'S': f'{i + 1:02x}' * 32 } })
+        self.ddb.put_item(TableName=TABLE_NAME, Item={ 'device-id': { 'S': 'keyless' } })
+
+    def test_pos_build(self):
+        """every item with a key is in the published snapshot"""
+        report = build(TABLE_NAME, BUCKET, segments=3, ddb=self.ddb, s3=self.s3)
+        assert report['records'] == 10
+        assert report['failed'] == 1
+        index = KeyIndex(BUCKET, s3=self.s3, directory=tempfile.mkdtemp())
+        assert all(index.lookup(f'device-{i}') == f'{i + 1:02x}' * 32 for i in range(10))
+
+    def test_pos_compact_keys(self):
+        """items holding only a compact binary key are indexed too"""
+        key = ec.generate_private_key(curve=ec.SECP256R1()).public_key()
+        keytype, data = compact_public_key(key)
+        self.ddb.put_item(TableName=TABLE_NAME,
+                          Item={ 'device-id': { 'S': 'compact' },
+                                 'pubkey_der': { 'B': data },
+                                 'keytype': { 'S': keytype } })
+        report = build(TABLE_NAME, BUCKET, segments=2, ddb=self.ddb, s3=self.s3)
+        assert report['records'] == 11
+        index = KeyIndex(BUCKET, s3=self.s3, directory=tempfile.mkdtemp())
+        der = key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+        assert index.lookup('compact') == spki_fingerprint(der)
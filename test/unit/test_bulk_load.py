@@ -0,0 +1,96 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Bulk device key loader unit testing
+"""
+import os
+import csv
+import json
+import base64
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from src.tools.bulk_load import load, write_batch, Report
+
+TABLE_NAME = 'widgiot-iot-provisioning-secretfree'
+
+def public_pem() -> str:
+    """A fresh PEM encoded public key"""
+    key = ec.generate_private_key(curve=ec.SECP256R1()).public_key()
+    return key.public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo).decode('ascii')
+
+@mock_aws
+class TestBulkLoad(TestCase):
+    """Unit tests for the bulk device key loader"""
+    def setUp(self):
+        self.ddb = client('dynamodb', region_name='us-east-1')
+        self.ddb.create_table(TableName=TABLE_NAME,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manifest = os.path.join(self.tmp.name, 'devices.csv')
+        self.checkpoint = os.path.join(self.tmp.name, 'devices.ckpt')
+        with open(self.manifest, 'w', newline='', encoding='utf-8') as manifest:
+            writer = csv.writer(manifest)
+            writer.writerow(['device-id', 'pubkey'])
+            for i in range(60):
+                writer.writerow([str(i), public_pem()])
+            writer.writerow(['bad', 'not a key'])
+
+    def test_pos_load_csv_and_resume(self):
+        """valid records land with fingerprints, a resumed load skips them"""
+        report = load(TABLE_NAME, self.manifest, self.checkpoint, workers=4, ddb=self.ddb)
+        assert report['read'] == 61
+        assert report['written'] == 60
+        assert report['invalid'] == 1
+        assert self.ddb.scan(TableName=TABLE_NAME, Select='COUNT')['Count'] == 60
+        item = self.ddb.get_item(TableName=TABLE_NAME, Key={ 'device-id': { 'S': '7' } })['Item']
+        assert len(item['fingerprint']['S']) == 64
+        assert item['keytype']['S'] == 'ec-p256'
+        assert len(item['pubkey_der']['B']) == 33
+        report = load(TABLE_NAME, self.manifest, self.checkpoint, workers=4, ddb=self.ddb)
+        assert report['read'] == 0
+
+    def test_pos_load_json_lines_base64(self):
+        """json lines with base64 encoded pem keys are accepted"""
+        path = os.path.join(self.tmp.name, 'devices.jsonl')
+        with open(path, 'w', encoding='utf-8') as manifest:
+            for i in range(3):
+                pubkey = base64.b64encode(public_pem().encode('ascii')).decode('ascii')
+                manifest.write(json.dumps({ 'device-id': str(i), 'pubkey': pubkey }) + '\n')
+        assert load(TABLE_NAME, path, ddb=self.ddb)['written'] == 3
+
+    def test_neg_json_lines_that_are_not_objects(self):
+        """json that is not an object, or not json at all, is an invalid record"""
+        path = os.path.join(self.tmp.name, 'devices.jsonl')
+        with open(path, 'w', encoding='utf-8') as manifest:
+            manifest.write(json.dumps({ 'device-id': '1', 'pubkey': public_pem() }) + '\n')
+            manifest.write('["2", "key"]\n"3"\n42\nnull\n{not json\n')
+        report = load(TABLE_NAME, path, ddb=self.ddb)
+        assert report['written'] == 1
+        assert report['invalid'] == 5
+
+    def test_pos_write_batch_retries_unprocessed(self):
+        """unprocessed items are written again"""
+        ddb = MagicMock()
+        item = { 'device-id': { 'S': '1' } }
+        ddb.batch_write_item.side_effect = [
+            { 'UnprocessedItems': { TABLE_NAME: [{ 'PutRequest': { 'Item': item } }] } },
+            { 'UnprocessedItems': {} }]
+        report = Report()
+        assert write_batch(ddb, TABLE_NAME, [item], report, sleep=lambda _: None)
+        assert report.written == 1
+        assert report.retries == 1
+
+    def tearDown(self):
+        self.tmp.cleanup()
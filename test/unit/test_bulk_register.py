@@ -0,0 +1,176 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Bulk registration tool unit testing
+"""
+import io
+import os
+import json
+import base64
+import tempfile
+import uuid
+from unittest import TestCase
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+from cryptography import x509
+
+from retry_utils import Backoff
+from iot_utils import invalidate_registry
+from src.tools.bulk_register import register, wait_for_task, PROVISIONING_TEMPLATE
+
+BUCKET = 'widgiot-registration'
+ROLE_ARN = 'arn:aws:iam::123456789012:role/widgiot-bulk-registration'
+
+class StubIot:
+    """
+    AWS IoT stand-in for the bulk registration calls moto lacks: the task
+    runs the registration file on start and fails the lines whose thing
+    name is listed in fail. Everything else goes to the moto client.
+    """
+    def __init__(self, iot, s3, fail=(), polls=2):
+        self._iot = iot
+        self._s3 = s3
+        self.fail = set(fail)
+        self.polls = polls
+        self.tasks = {}
+
+    def __getattr__(self, name):
+        return getattr(self._iot, name)
+
+    def start_thing_registration_task(self, templateBody, inputFileBucket, inputFileKey,
+                                      roleArn):
+        body = self._s3.get_object(Bucket=inputFileBucket, Key=inputFileKey)['Body'].read()
+        lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        errors = [{ 'offset': offset, 'errorMessage': 'InvalidRequestException' }
+                  for offset, line in enumerate(lines) if line['ThingName'] in self.fail]
+        task_id = str(uuid.uuid4())
+        self.tasks[task_id] = { 'template': json.loads(templateBody), 'role': roleArn,
+                                'lines': lines, 'errors': errors, 'polls': 0 }
+        return { 'taskId': task_id }
+
+    def describe_thing_registration_task(self, taskId):
+        task = self.tasks[taskId]
+        task['polls'] += 1
+        done = task['polls'] >= self.polls
+        return { 'taskId': taskId,
+                 'status': 'Completed' if done else 'InProgress',
+                 'percentageProgress': 100 if done else 50,
+                 'successCount': len(task['lines']) - len(task['errors']) if done else 0,
+                 'failureCount': len(task['errors']) if done else 0 }
+
+    def list_thing_registration_task_reports(self, taskId, reportType, nextToken=None):
+        errors = self.tasks[taskId]['errors']
+        # One report per error, two per page, to exercise the paging
+        start = int(nextToken or 0)
+        page = { 'resourceLinks': [json.dumps(error) for error in errors[start:start + 2]],
+                 'reportType': reportType }
+        if start + 2 < len(errors):
+            page['nextToken'] = str(start + 2)
+        return page
+
+def fetch(report):
+    """Serves the stub's report 'urls', which are the report contents"""
+    return io.BytesIO(report.encode('utf-8') + b'\n')
+
+def make_csr(key, device_id: str) -> bytes:
+    """Build a PEM encoded CSR for the given key and device-id"""
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, device_id)]))
+    return builder.sign(key, hashes.SHA256()).public_bytes(Encoding.PEM)
+
+@mock_aws(config={ 'iot': {'use_valid_cert': True} })
+class TestBulkRegister(TestCase):
+    """Unit tests for the bulk registration tool"""
+    def setUp(self):
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        invalidate_registry()
+        self.s3 = client('s3')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.acmpca = client('acm-pca')
+        self.ca_arn = self.acmpca.create_certificate_authority(
+            CertificateAuthorityConfiguration={ 'KeyAlgorithm': 'RSA_2048',
+                                                'SigningAlgorithm': 'SHA256WITHRSA',
+                                                'Subject': { 'CommonName': 'widgiot-ca' } },
+            CertificateAuthorityType='ROOT')['CertificateAuthorityArn']
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp.name, 'devices.jsonl')
+        self.failures = os.path.join(self.tmp.name, 'failed.jsonl')
+        self.device_ids = [str(uuid.uuid4()) for _ in range(5)]
+        with open(self.input, 'w', encoding='utf-8') as records:
+            for device_id in self.device_ids:
+                csr = base64.b64encode(make_csr(self.key, device_id)).decode('ascii')
+                records.write(json.dumps({ 'device-id': device_id, 'csr': csr }) + '\n')
+            records.write(json.dumps({ 'device-id': 'bad name!', 'certificate': 'x' }) + '\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pos_register_maps_failures_to_devices(self):
+        """csrs are issued, submitted as one task, and failures map back to device-ids"""
+        iot = StubIot(client('iot'), self.s3, fail=self.device_ids[1:4])
+        report = register(self.input, BUCKET, ROLE_ARN, 'widgiot', account='123456789012',
+                          ca_arn=self.ca_arn, workers=4, failures_path=self.failures,
+                          backoff=Backoff(base=0.0), iot=iot, s3=self.s3, acmpca=self.acmpca,
+                          fetch=fetch)
+        assert report['records'] == 6
+        assert report['invalid'] == 1
+        assert report['submitted'] == 5
+        assert report['status'] == 'Completed'
+        assert report['succeeded'] == 2
+        assert sorted(failure['device-id'] for failure in report['failures']) == \
+            sorted(self.device_ids[1:4])
+
+        task = next(iter(iot.tasks.values()))
+        assert task['template'] == PROVISIONING_TEMPLATE
+        assert task['role'] == ROLE_ARN
+        assert [line['ThingName'] for line in task['lines']] == self.device_ids
+        assert all(line['CertificatePem'].startswith('-----BEGIN CERTIFICATE-----')
+                   for line in task['lines'])
+        # The template attaches the policy by name, so it was created first
+        assert client('iot').get_policy(policyName='widgiot')['policyName'] == 'widgiot'
+
+        with open(self.failures, encoding='utf-8') as failed:
+            retry = [json.loads(line) for line in failed]
+        assert len(retry) == 4
+        assert all('csr' in record or 'certificate' in record for record in retry)
+
+    def test_neg_csr_without_ca_is_invalid(self):
+        """csr records need a ca to be issued and are left out otherwise"""
+        iot = StubIot(client('iot'), self.s3)
+        report = register(self.input, BUCKET, ROLE_ARN, 'widgiot', account='123456789012',
+                          iot=iot, s3=self.s3, fetch=fetch)
+        assert report['invalid'] == 6
+        assert report['submitted'] == 0
+        assert not iot.tasks
+
+    def test_neg_task_timeout_is_reported(self):
+        """a task still running at the timeout is reported with its id and last status"""
+        iot = StubIot(client('iot'), self.s3, polls=100)
+        report = register(self.input, BUCKET, ROLE_ARN, 'widgiot', account='123456789012',
+                          ca_arn=self.ca_arn, failures_path=self.failures, timeout=0,
+                          backoff=Backoff(base=0.0), iot=iot, s3=self.s3, acmpca=self.acmpca,
+                          fetch=fetch)
+        assert report['task_id'] in iot.tasks
+        assert report['status'] == 'InProgress'
+        assert report['timed_out']
+        assert 'failures' not in report
+        # Only the invalid record is known to have failed
+        with open(self.failures, encoding='utf-8') as failed:
+            assert [json.loads(line)['device-id'] for line in failed] == ['bad name!']
+
+    def test_pos_wait_for_task_polls_until_done(self):
+        """the task is described until it leaves InProgress"""
+        iot = StubIot(client('iot'), self.s3, polls=3)
+        iot.tasks['t'] = { 'lines': [], 'errors': [], 'polls': 0 }
+        sleeps = []
+        task = wait_for_task(iot, 't', timeout=60, sleep=sleeps.append)
+        assert task['status'] == 'Completed'
+        assert len(sleeps) == 2
@@ -0,0 +1,64 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Warm container cache unit testing
+"""
+from unittest import TestCase
+
+from cache_utils import TtlLruCache
+
+class FakeClock:
+    """Manually advanced monotonic clock"""
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+class TestTtlLruCache(TestCase):
+    """Unit tests for the TTL/LRU cache"""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TtlLruCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_pos_hit_and_miss_counters(self):
+        """a put entry is a hit, an unknown key is a miss"""
+        self.cache.put('a', 1)
+        assert self.cache.get('a') == 1
+        assert self.cache.get('b') is None
+        stats = self.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+
+    def test_pos_ttl_expiry(self):
+        """entries expire after the ttl"""
+        self.cache.put('a', 1)
+        self.clock.now = 10.5
+        assert self.cache.get('a') is None
+        assert len(self.cache) == 0
+
+    def test_pos_lru_eviction(self):
+        """the least recently used entry is evicted when full"""
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        assert self.cache.get('b') is None
+        assert self.cache.get('a') == 1
+        assert self.cache.get('c') == 3
+
+    def test_pos_invalidate(self):
+        """explicit invalidation of one key or all keys"""
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.invalidate('a')
+        assert self.cache.get('a') is None
+        assert self.cache.get('b') == 2
+        self.cache.invalidate()
+        assert len(self.cache) == 0
+
+    def test_neg_disabled(self):
+        """a zero sized cache never stores anything"""
+        cache = TtlLruCache(maxsize=0, ttl=10)
+        cache.put('a', 1)
+        assert cache.get('a') is None
@@ -0,0 +1,151 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Stale certificate cleanup unit testing
+"""
+import os
+import json
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from moto import mock_aws
+from boto3 import client
+
+from src.tools.cleanup_certificates import cleanup
+
+TABLE_NAME = 'widgiot-iot-provisioning-secretfree'
+ISSUANCE_TABLE = TABLE_NAME + '-issuance'
+
+@mock_aws
+class TestCleanupCertificates(TestCase):
+    """Unit tests for the stale certificate cleanup job"""
+    def setUp(self):
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        self.ddb = client('dynamodb')
+        self.iot = client('iot')
+        for table_name in (TABLE_NAME, ISSUANCE_TABLE):
+            self.ddb.create_table(TableName=table_name,
+                                  KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                                  AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                         'AttributeType': 'S'}],
+                                  BillingMode='PAY_PER_REQUEST')
+        self.iot.create_policy(policyName='widgiot', policyDocument='{}')
+        # Device n was issued n % 3 + 1 certificates, the last one the newest
+        # and recorded
+        self.certificates = {}
+        for n in range(6):
+            device_id = 'device-%d' % n
+            self.ddb.put_item(TableName=TABLE_NAME, Item={ 'device-id': { 'S': device_id } })
+            self.iot.create_thing(thingName=device_id)
+            self.certificates[device_id] = [self.issue(device_id) for _ in range(n % 3 + 1)]
+            self.record(device_id, self.certificates[device_id][-1])
+        # A device-id without a Thing, as after a failed registration
+        self.ddb.put_item(TableName=TABLE_NAME, Item={ 'device-id': { 'S': 'no-thing' } })
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def issue(self, device_id: str) -> str:
+        """Attach a fresh certificate with the SKU policy to a Thing"""
+        arn = self.iot.create_keys_and_certificate(setAsActive=True)['certificateArn']
+        self.iot.attach_thing_principal(thingName=device_id, principal=arn)
+        self.iot.attach_policy(policyName='widgiot', target=arn)
+        return arn
+
+    def record(self, device_id: str, certificate_arn: str):
+        """Write the issuance record the issuers leave for a certificate"""
+        self.ddb.put_item(TableName=ISSUANCE_TABLE,
+                          Item={ 'device-id': { 'S': device_id },
+                                 'certificate_arn': { 'S': certificate_arn } })
+
+    def principals(self, device_id: str) -> list:
+        """The certificates attached to a Thing"""
+        return self.iot.list_thing_principals(thingName=device_id)['principals']
+
+    def test_pos_dry_run_changes_nothing(self):
+        """a dry run reports the stale certificates and leaves them in place"""
+        output = os.path.join(self.tmp.name, 'decisions.jsonl')
+        report = cleanup('widgiot', segments=3, workers=4, output=output, dry_run=True,
+                         ddb=self.ddb, iot=self.iot)
+        assert report['things'] == 6
+        assert report['certificates'] == 12
+        assert report['stale'] == 6
+        assert report['deleted'] == 0
+        assert report['errors'] == 0
+        assert len(self.principals('device-2')) == 3
+        with open(output, encoding='utf-8') as decisions:
+            entries = { entry['device-id']: entry for entry in map(json.loads, decisions) }
+        assert entries['device-2']['keep'] == self.certificates['device-2'][-1]
+        assert sorted(entries['device-2']['stale']) == sorted(self.certificates['device-2'][:-1])
+
+    def test_pos_cleanup_keeps_newest(self):
+        """every Thing is left with its newest certificate, the rest are deleted"""
+        report = cleanup('widgiot', segments=3, workers=4, ddb=self.ddb, iot=self.iot)
+        assert report['stale'] == 6
+        assert report['deleted'] == 6
+        assert report['errors'] == 0
+        for device_id, certificates in self.certificates.items():
+            assert self.principals(device_id) == [certificates[-1]]
+        gone = self.certificates['device-2'][0].rsplit('/', 1)[-1]
+        ids = [cert['certificateId'] for cert in self.iot.list_certificates()['certificates']]
+        assert gone not in ids
+        assert len(ids) == 6
+
+    def test_pos_shared_certificate_is_only_detached(self):
+        """a stale certificate another Thing still uses is not deleted"""
+        shared = self.certificates['device-0'][0]
+        self.iot.create_thing(thingName='gateway')
+        self.iot.attach_thing_principal(thingName='gateway', principal=shared)
+        self.record('device-0', self.issue('device-0'))
+        report = cleanup('widgiot', segments=1, ddb=self.ddb, iot=self.iot)
+        assert report['shared'] == 1
+        assert shared not in self.principals('device-0')
+        description = self.iot.describe_certificate(
+            certificateId=shared.rsplit('/', 1)[-1])['certificateDescription']
+        assert description['status'] == 'ACTIVE'
+
+    def test_pos_checkpoint_resumes(self):
+        """a finished run's checkpoint leaves nothing for the next run"""
+        checkpoint = os.path.join(self.tmp.name, 'cleanup.ckpt')
+        first = cleanup('widgiot', segments=2, checkpoint_path=checkpoint,
+                        ddb=self.ddb, iot=self.iot)
+        assert first['things'] == 6
+        self.issue('device-0')
+        again = cleanup('widgiot', segments=2, checkpoint_path=checkpoint,
+                        ddb=self.ddb, iot=self.iot)
+        assert again['things'] == 0
+        assert len(self.principals('device-0')) == 2
+
+    def test_pos_newer_than_recorded_is_kept(self):
+        """certificates issued after the recorded one may be in use and stay"""
+        recorded = self.certificates['device-2'][1]
+        self.record('device-2', recorded)
+        report = cleanup('widgiot', segments=1, ddb=self.ddb, iot=self.iot)
+        assert sorted(self.principals('device-2')) == sorted(self.certificates['device-2'][1:])
+        assert report['deleted'] == 5
+
+    def test_pos_unrecorded_thing_keeps_newest(self):
+        """without a usable record the newest certificate is kept"""
+        self.ddb.delete_item(TableName=ISSUANCE_TABLE, Key={ 'device-id': { 'S': 'device-1' } })
+        self.record('device-2', 'arn:aws:iot:us-east-1:123456789012:cert/gone')
+        self.iot.create_thing(thingName='bulk-1')
+        self.ddb.put_item(TableName=TABLE_NAME, Item={ 'device-id': { 'S': 'bulk-1' } })
+        bulk = [self.issue('bulk-1') for _ in range(3)]
+        report = cleanup('widgiot', segments=2, ddb=self.ddb, iot=self.iot)
+        assert report['unrecorded'] == 3
+        assert report['deleted'] == 8
+        assert report['errors'] == 0
+        assert self.principals('device-1') == [self.certificates['device-1'][-1]]
+        assert self.principals('device-2') == [self.certificates['device-2'][-1]]
+        assert self.principals('bulk-1') == [bulk[-1]]
+
+    def test_neg_worker_failures_are_errors(self):
+        """an unexpected failure cleaning a Thing is counted, not lost"""
+        with patch('src.tools.cleanup_certificates.creation_dates',
+                   side_effect=RuntimeError('boom')):
+            report = cleanup('widgiot', segments=2, ddb=self.ddb, iot=self.iot)
+        assert report['errors'] == 4
+        assert report['deleted'] == 0
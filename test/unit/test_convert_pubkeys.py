@@ -0,0 +1,78 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Compact public key migration unit testing
+"""
+import base64
+from unittest import TestCase
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from key_utils import item_fingerprint, spki_fingerprint
+from src.tools.convert_pubkeys import convert
+
+TABLE_NAME = 'widgiot-iot-provisioning-secretfree'
+
+@mock_aws
+class TestConvertPubkeys(TestCase):
+    """Unit tests for the compact public key migration"""
+    def setUp(self):
+        self.ddb = client('dynamodb', region_name='us-east-1')
+        self.ddb.create_table(TableName=TABLE_NAME,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        self.fingerprints = {}
+        keys = [ec.generate_private_key(curve=ec.SECP256R1()).public_key(),
+                ec.generate_private_key(curve=ec.SECP384R1()).public_key(),
+                rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()]
+        for i, key in enumerate(keys):
+            pem = key.public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+            der = key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+            self.fingerprints[str(i)] = spki_fingerprint(der)
+            self.ddb.put_item(TableName=TABLE_NAME,
+                              Item={ 'device-id': { 'S': str(i) },
+                                     'pubkey': { 'S': base64.b64encode(pem).decode('ascii') } })
+        self.ddb.put_item(TableName=TABLE_NAME,
+                          Item={ 'device-id': { 'S': 'junk' },
+                                 'pubkey': { 'S': base64.b64encode(b'junk').decode('ascii') } })
+
+    def get(self, device_id: str) -> dict:
+        """The stored item for device_id"""
+        return self.ddb.get_item(TableName=TABLE_NAME,
+                                 Key={ 'device-id': { 'S': device_id } })['Item']
+
+    def test_pos_convert(self):
+        """legacy items become compact binary items with the same fingerprint"""
+        report = convert(TABLE_NAME, segments=3, ddb=self.ddb)
+        assert report['converted'] == 3
+        assert report['failed'] == 1
+        assert report['saved_bytes'] > 0
+        assert [self.get(str(i))['keytype']['S'] for i in range(3)] == ['ec-p256', 'ec-p384',
+                                                                        'spki']
+        for device_id, fingerprint in self.fingerprints.items():
+            item = self.get(device_id)
+            assert 'pubkey' not in item
+            assert item['fingerprint']['S'] == fingerprint
+            # The binary form alone yields the same fingerprint
+            del item['fingerprint']
+            assert item_fingerprint(item) == fingerprint
+
+    def test_pos_keep_legacy_then_drop(self):
+        """the legacy attribute can be kept for a migration window and dropped later"""
+        convert(TABLE_NAME, keep_legacy=True, ddb=self.ddb)
+        assert 'pubkey' in self.get('0') and 'pubkey_der' in self.get('0')
+        assert convert(TABLE_NAME, keep_legacy=True, ddb=self.ddb)['converted'] == 0
+        assert convert(TABLE_NAME, ddb=self.ddb)['converted'] == 3
+        assert 'pubkey' not in self.get('0')
+
+    def test_pos_dry_run(self):
+        """a dry run writes nothing"""
+        assert convert(TABLE_NAME, dry_run=True, ddb=self.ddb)['converted'] == 3
+        assert 'pubkey_der' not in self.get('0')
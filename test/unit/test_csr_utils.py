@@ -0,0 +1,94 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Certificate signing request helper unit testing
+"""
+import base64
+import warnings
+from unittest import TestCase
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from cryptography.x509.oid import NameOID
+from cryptography import x509
+
+from csr_utils import (load_csr, common_name, public_key_der, screen_csr, verify_signature,
+                       CsrRejected)
+
+def header(pem: bytes) -> str:
+    """The device-csr header value carrying pem"""
+    return base64.b64encode(pem).decode('ascii')
+
+def rearmor(der: bytes) -> bytes:
+    """PEM armor around arbitrary DER"""
+    body = base64.encodebytes(der)
+    return b'-----BEGIN CERTIFICATE REQUEST-----\n' + body + b'-----END CERTIFICATE REQUEST-----\n'
+
+class TestCsrUtils(TestCase):
+    """Unit tests for the certificate signing request helpers"""
+    def setUp(self):
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        builder = x509.CertificateSigningRequestBuilder()
+        builder = builder.subject_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, 'widgiot'),
+            x509.NameAttribute(NameOID.COMMON_NAME, 'device-1')]))
+        self.csr = builder.sign(self.key, hashes.SHA256()).public_bytes(Encoding.PEM)
+
+    def test_pos_common_name_rsa(self):
+        """the cn of an rsa derived csr is the device-id"""
+        assert common_name(load_csr(self.csr)) == 'device-1'
+
+    def test_pos_public_key_der(self):
+        """the csr public key is returned as der spki"""
+        expected = self.key.public_key().public_bytes(Encoding.DER,
+                                                      PublicFormat.SubjectPublicKeyInfo)
+        assert public_key_der(load_csr(self.csr)) == expected
+
+    def assert_rejected(self, value, stage: str, reason: str):
+        """value is refused by the given stage for the given reason"""
+        with self.assertRaises(CsrRejected) as rejected:
+            screen_csr(value)
+        assert (rejected.exception.stage, rejected.exception.reason) == (stage, reason)
+
+    def test_pos_screen_csr(self):
+        """a well formed header yields the parsed request and device-id"""
+        screened = screen_csr(header(self.csr))
+        assert screened.device_id == 'device-1'
+        assert screened.pem == self.csr
+        verify_signature(screened.req)
+
+    def test_neg_screen_cheap_stages(self):
+        """junk is refused by the cheapest stage that can tell"""
+        self.assert_rejected(None, 'header', 'missing')
+        self.assert_rejected('A' * 8196, 'header', 'too_long')
+        self.assert_rejected('not base64!', 'base64', 'alphabet')
+        self.assert_rejected(header(b'hello world'), 'pem', 'armor')
+        der = load_csr(self.csr).public_bytes(Encoding.DER)
+        self.assert_rejected(header(rearmor(der[:-1])), 'der', 'length')
+        self.assert_rejected(header(rearmor(b'\x04\x01\x00')), 'der', 'not_sequence')
+        self.assert_rejected(header(rearmor(b'\x30\x03\x02\x01\x00')), 'asn1', 'malformed')
+
+    def test_neg_screen_subject(self):
+        """requests without a usable CN are refused before any lookup"""
+        builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, 'widgiot')]))
+        csr = builder.sign(self.key, hashes.SHA256()).public_bytes(Encoding.PEM)
+        self.assert_rejected(header(csr), 'subject', 'common_name')
+        # cryptography warns about, but keeps, a CN over the X.520 limit
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name([
+                x509.NameAttribute(NameOID.COMMON_NAME, 'd' * 65, _validate=False)]))
+            csr = builder.sign(self.key, hashes.SHA256()).public_bytes(Encoding.PEM)
+            self.assert_rejected(header(csr), 'subject', 'device_id')
+
+    def test_neg_forged_signature(self):
+        """a request whose signature does not verify fails proof of possession"""
+        der = bytearray(load_csr(self.csr).public_bytes(Encoding.DER))
+        der[-1] ^= 0x01
+        screened = screen_csr(header(rearmor(bytes(der))))
+        with self.assertRaises(CsrRejected) as rejected:
+            verify_signature(screened.req)
+        assert rejected.exception.stage == 'signature'
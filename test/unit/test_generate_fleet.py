@@ -0,0 +1,80 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Synthetic fleet generator unit testing
+"""
+import base64
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import (load_pem_private_key,
+                                                          Encoding, PublicFormat)
+from cryptography.x509.oid import NameOID
+
+from src.tools import generate_fleet
+from src.tools.generate_fleet import generate, load_fleet, write_manifest
+from src.tools.bulk_load import device_item, read_manifest
+
+class TestGenerateFleet(TestCase):
+    """Unit tests for the fleet generator"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.tmp.name, 'fleet')
+        self.chunk_size = patch.object(generate_fleet, 'CHUNK_SIZE', 2)
+        self.chunk_size.start()
+
+    def tearDown(self):
+        self.chunk_size.stop()
+        self.tmp.cleanup()
+
+    def test_pos_devices_are_consistent(self):
+        """CSR subject, public key and private key of each device belong together"""
+        fleet = load_fleet(3, sku='widgiot', cache=self.cache, workers=2)
+        assert len(fleet) == 3
+        assert len({ device['device-id'] for device in fleet }) == 3
+        for device in fleet:
+            csr = x509.load_pem_x509_csr(base64.b64decode(device['csr']))
+            assert csr.is_signature_valid
+            subject = csr.subject
+            assert subject.get_attributes_for_oid(NameOID.ORGANIZATIONAL_UNIT_NAME)[0].value == 'widgiot'
+            assert subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value == device['device-id']
+            public = csr.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+            assert base64.b64decode(device['pubkey']) == public
+            private = load_pem_private_key(device['key'].encode('ascii'), None)
+            assert private.public_key().public_bytes(Encoding.PEM,
+                                                     PublicFormat.SubjectPublicKeyInfo) == public
+            assert device_item(device['device-id'], device['pubkey'])['keytype']['S'] == 'ec-p256'
+
+    def test_pos_cache_reused_and_extended(self):
+        """a second run reads the cache and a larger fleet only adds chunks"""
+        first = generate(3, cache=self.cache, workers=1)
+        assert (first['generated_chunks'], first['cached_chunks']) == (2, 0)
+        again = generate(3, cache=self.cache, workers=1)
+        assert (again['generated_chunks'], again['cached_chunks']) == (0, 2)
+        before = load_fleet(3, cache=self.cache)
+        larger = generate(6, cache=self.cache, workers=1)
+        assert (larger['generated_chunks'], larger['cached_chunks']) == (1, 2)
+        assert load_fleet(6, cache=self.cache)[:3] == before
+
+    def test_pos_rsa_and_manifest(self):
+        """rsa fleets load through the bulk loader's manifest reader"""
+        fleet = load_fleet(1, keytype='rsa-2048', cache=self.cache, workers=1)
+        path = os.path.join(self.tmp.name, 'devices.jsonl')
+        write_manifest(fleet, path)
+        records = list(read_manifest(path))
+        assert [(device_id, pubkey) for _, device_id, pubkey in records] == \
+            [(fleet[0]['device-id'], fleet[0]['pubkey'])]
+        assert device_item(fleet[0]['device-id'], fleet[0]['pubkey'])['keytype']['S'] == 'spki'
+        with open(path, encoding='utf-8') as manifest:
+            assert 'key' not in json.loads(manifest.readline())
+
+    def test_neg_unknown_keytype(self):
+        """unknown key types are refused before any work"""
+        with self.assertRaises(ValueError):
+            generate(1, keytype='dsa-1024', cache=self.cache)
+        assert not os.path.exists(self.cache)
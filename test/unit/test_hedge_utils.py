@@ -0,0 +1,105 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Hedged multi-region lookup unit testing
+"""
+import threading
+import time
+from unittest import TestCase
+
+from botocore.exceptions import ClientError
+
+from hedge_utils import HedgedLookup, LookupUnavailable
+
+def throttled() -> ClientError:
+    """A regional failure"""
+    return ClientError({ 'Error': { 'Code': 'InternalServerError', 'Message': 'brownout' } },
+                       'GetItem')
+
+class Replicas:
+    """Stand-in replicas answering after a per-region delay"""
+    def __init__(self, **regions):
+        self.regions = regions
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, region: str):
+        with self._lock:
+            self.calls.append(region)
+        delay, answer = self.regions[region]
+        time.sleep(delay)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+class TestHedgeUtils(TestCase):
+    """Unit tests for hedged lookups"""
+    def test_pos_fast_primary_not_hedged(self):
+        """a primary answering within its delay is the only region asked"""
+        replicas = Replicas(local=(0.0, 'item'), remote=(0.0, 'other'))
+        lookup = HedgedLookup(['local', 'remote'], max_delay=0.5)
+        assert lookup.call(replicas) == 'item'
+        assert replicas.calls == ['local']
+        assert lookup.hedges == 0
+
+    def test_pos_slow_primary_hedged(self):
+        """a primary slower than the hedge delay loses to the secondary"""
+        replicas = Replicas(local=(0.5, 'late'), remote=(0.0, 'early'))
+        lookup = HedgedLookup(['local', 'remote'], max_delay=0.02, timeout=2.0)
+        started = time.perf_counter()
+        assert lookup.call(replicas) == 'early'
+        assert time.perf_counter() - started < 0.4
+        assert replicas.calls == ['local', 'remote']
+        assert lookup.hedges == 1
+
+    def test_pos_failure_falls_over(self):
+        """a failing primary is replaced by the secondary without waiting"""
+        replicas = Replicas(local=(0.0, throttled()), remote=(0.0, 'item'))
+        lookup = HedgedLookup(['local', 'remote'], max_delay=1.0)
+        assert lookup.call(replicas) == 'item'
+        assert lookup.latency['local'].failure_rate() == 1.0
+
+    def test_pos_miss_confirmed(self):
+        """an item missing from the primary, e.g. lagging replication, is read from the secondary"""
+        replicas = Replicas(local=(0.0, None), remote=(0.0, 'item'))
+        lookup = HedgedLookup(['local', 'remote'])
+        assert lookup.call(replicas, accept=lambda item: item is not None) == 'item'
+        missing = Replicas(local=(0.0, None), remote=(0.0, None))
+        assert lookup.call(missing, accept=lambda item: item is not None) is None
+        assert missing.calls == ['local', 'remote']
+
+    def test_pos_adaptive_primary(self):
+        """once both regions have samples the faster one is asked first"""
+        lookup = HedgedLookup(['local', 'remote'], min_samples=3)
+        assert lookup.ranked() == ['local', 'remote']
+        for _ in range(3):
+            lookup.latency['local'].record(0.050)
+            lookup.latency['remote'].record(0.020)
+        assert lookup.ranked() == ['remote', 'local']
+        for _ in range(3):
+            lookup.latency['remote'].record(0.020, failed=True)
+        assert lookup.ranked() == ['local', 'remote']
+
+    def test_pos_hedge_delay_tracks_percentile(self):
+        """the hedge delay follows the region's latency percentile within bounds"""
+        lookup = HedgedLookup(['local', 'remote'], min_samples=4, min_delay=0.01, max_delay=0.2)
+        assert lookup.hedge_delay('local') == 0.2
+        for latency in (0.03, 0.04, 0.05, 0.06):
+            lookup.latency['local'].record(latency)
+        assert lookup.hedge_delay('local') == 0.06
+        lookup.latency['local'].record(5.0)
+        assert lookup.hedge_delay('local') == 0.2
+
+    def test_neg_all_regions_fail(self):
+        """the last error propagates when every region failed"""
+        replicas = Replicas(local=(0.0, throttled()), remote=(0.0, throttled()))
+        with self.assertRaises(ClientError):
+            HedgedLookup(['local', 'remote']).call(replicas)
+
+    def test_neg_deadline(self):
+        """no answer within the timeout is reported as unavailable"""
+        replicas = Replicas(local=(0.3, 'late'), remote=(0.3, 'late'))
+        lookup = HedgedLookup(['local', 'remote'], max_delay=0.01, timeout=0.05)
+        with self.assertRaises(LookupUnavailable):
+            lookup.call(replicas)
@@ -0,0 +1,56 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+IoT registry memoization unit testing
+"""
+import json
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from moto import mock_aws
+from botocore.exceptions import ClientError
+from boto3 import client
+
+from iot_utils import ensure_policy, data_endpoint, invalidate_registry
+
+REGION = 'us-east-1'
+ACCOUNT = '123456789012'
+
+@mock_aws
+class TestIotUtils(TestCase):
+    """Unit tests for the IoT registry memoization"""
+    def setUp(self):
+        invalidate_registry()
+        self.iot = client('iot', region_name=REGION)
+
+    def test_pos_ensure_policy_creates_once(self):
+        """the policy is created on first use and then served from memory"""
+        document = ensure_policy(self.iot, 'widgiot', REGION, ACCOUNT)
+        assert json.loads(document)['Version'] == '2012-10-17'
+        assert self.iot.get_policy(policyName='widgiot')['policyName'] == 'widgiot'
+        spy = MagicMock(wraps=self.iot)
+        assert ensure_policy(spy, 'widgiot', REGION, ACCOUNT) == document
+        spy.get_policy.assert_not_called()
+
+    def test_pos_ensure_policy_create_race(self):
+        """losing a create_policy race to another container counts as success"""
+        iot = MagicMock()
+        iot.get_policy.side_effect = ClientError(
+            { 'Error': { 'Code': 'ResourceNotFoundException', 'Message': 'none' } }, 'GetPolicy')
+        iot.create_policy.side_effect = ClientError(
+            { 'Error': { 'Code': 'ResourceAlreadyExistsException', 'Message': 'exists' } },
+            'CreatePolicy')
+        ensure_policy(iot, 'widgiot', REGION, ACCOUNT)
+        ensure_policy(iot, 'widgiot', REGION, ACCOUNT)
+        assert iot.get_policy.call_count == 1
+
+    def test_pos_data_endpoint_memoized(self):
+        """the ats endpoint is described once"""
+        endpoint = data_endpoint(self.iot, REGION, ACCOUNT)
+        spy = MagicMock(wraps=self.iot)
+        assert data_endpoint(spy, REGION, ACCOUNT) == endpoint
+        spy.describe_endpoint.assert_not_called()
+
+    def tearDown(self):
+        invalidate_registry()
@@ -0,0 +1,109 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Repeated issuance helper unit testing
+"""
+import os
+import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+
+from issuance_utils import (csr_digest, idempotency_token, authorizer_context,
+                            verified_device_id, record_issuance, recent_issuance)
+
+CSR = b'-----BEGIN CERTIFICATE REQUEST-----\nMIIB\n-----END CERTIFICATE REQUEST-----\n'
+ISSUANCE_TABLE = 'widgiot-iot-provisioning-secretfree-issuance'
+
+def make_certificate() -> str:
+    """A self-signed PEM certificate"""
+    key = ec.generate_private_key(curve=ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'device-1')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+                   .public_key(key.public_key()).serial_number(0x1234)
+                   .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+                   .sign(key, hashes.SHA256()))
+    return certificate.public_bytes(Encoding.PEM).decode('ascii')
+
+class TestIssuanceUtils(TestCase):
+    """Unit tests for the repeated issuance helpers"""
+    def test_pos_token_stable_within_window(self):
+        """a retry in the same time bucket yields the same token"""
+        first = idempotency_token(CSR, 'device-1', window=300, now=600)
+        retry = idempotency_token(CSR.strip(), 'device-1', window=300, now=899)
+        assert first == retry
+        assert len(first) == 36
+
+    def test_neg_token_changes(self):
+        """another device, csr or time bucket yields another token"""
+        token = idempotency_token(CSR, 'device-1', window=300, now=600)
+        assert token != idempotency_token(CSR, 'device-2', window=300, now=600)
+        assert token != idempotency_token(CSR + b'x', 'device-1', window=300, now=600)
+        assert token != idempotency_token(CSR, 'device-1', window=300, now=900)
+
+    def test_pos_csr_digest_ignores_whitespace(self):
+        """the digest is taken over the stripped pem"""
+        assert csr_digest(CSR) == csr_digest(b'\n' + CSR.strip())
+
+    def test_pos_verified_device_id_from_context(self):
+        """the authorizer context is trusted for the csr it was built from"""
+        event = { 'requestContext': { 'authorizer': authorizer_context('device-1', 'ab', CSR) } }
+        assert verified_device_id(event, CSR) == 'device-1'
+
+    def test_neg_verified_device_id_other_csr(self):
+        """a context for another csr, or no context, is not trusted"""
+        event = { 'requestContext': { 'authorizer': authorizer_context('device-1', 'ab', CSR) } }
+        assert verified_device_id(event, CSR + b'x') is None
+        assert verified_device_id({}, CSR) is None
+
+@mock_aws
+class TestIssuanceRecord(TestCase):
+    """Unit tests for the issuance record store"""
+    def setUp(self):
+        self.ddb = client('dynamodb', region_name='us-east-1')
+        self.ddb.create_table(TableName=ISSUANCE_TABLE,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        self.env = patch.dict(os.environ, { 'ISSUANCE_TABLENAME': ISSUANCE_TABLE })
+        self.env.start()
+        self.certificate = make_certificate()
+
+    def tearDown(self):
+        self.env.stop()
+
+    def test_pos_recent_issuance_within_window(self):
+        """the same csr within the window gets the recorded certificate"""
+        digest = csr_digest(CSR)
+        assert record_issuance('device-1', digest, self.certificate, 'arn:cert',
+                               window=600, now=1000, ddb=self.ddb)
+        previous = recent_issuance('device-1', digest, window=600, now=1500, ddb=self.ddb)
+        assert previous['certificate'] == self.certificate
+        assert previous['serial'] == '1234'
+        item = self.ddb.get_item(TableName=ISSUANCE_TABLE,
+                                 Key={ 'device-id': { 'S': 'device-1' } })['Item']
+        assert item['certificate_arn']['S'] == 'arn:cert'
+        assert 'expires_at' not in item
+
+    def test_neg_recent_issuance_misses(self):
+        """another csr, an expired window, or no table is a miss"""
+        digest = csr_digest(CSR)
+        record_issuance('device-1', digest, self.certificate, 'arn:cert',
+                        window=600, now=1000, ddb=self.ddb)
+        assert recent_issuance('device-1', csr_digest(CSR + b'x'), window=600, now=1100,
+                               ddb=self.ddb) is None
+        assert recent_issuance('device-1', digest, window=600, now=1601, ddb=self.ddb) is None
+        assert recent_issuance('device-2', digest, window=600, now=1100, ddb=self.ddb) is None
+        with patch.dict(os.environ, { 'ISSUANCE_TABLENAME': '' }):
+            assert recent_issuance('device-1', digest, window=600, now=1100) is None
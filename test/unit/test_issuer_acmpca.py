@@ -0,0 +1,203 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+ACM PCA issuer lambda function unit testing
+"""
+import os
+import json
+import base64
+import uuid
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from pytest import raises
+
+from moto import mock_aws
+from botocore.exceptions import ClientError
+from boto3 import client
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+from cryptography import x509
+
+from iot_utils import invalidate_registry
+import sku_utils
+from sku_utils import SkuConfigStore
+from src.issuer_acmpca import main
+
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:123456789012:function:widgiot-secretfree-acmpca'
+
+def make_csr(key, cn: str) -> bytes:
+    """Build a PEM encoded CSR for the given key and common name"""
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)]))
+    return builder.sign(key, hashes.SHA256()).public_bytes(Encoding.PEM)
+
+def make_context(remaining_ms: int = 30000):
+    """Lambda context stand-in"""
+    context = MagicMock()
+    context.invoked_function_arn = FUNCTION_ARN
+    context.aws_request_id = str(uuid.uuid4())
+    context.get_remaining_time_in_millis.return_value = remaining_ms
+    return context
+
+def in_progress():
+    """The error ACM PCA returns while issuance is pending"""
+    return ClientError({ 'Error': { 'Code': 'RequestInProgressException',
+                                    'Message': 'not yet' } }, 'GetCertificate')
+
+@mock_aws(config={
+    "core": {
+        "mock_credentials": True,
+        "reset_boto3_session": False,
+        "service_whitelist": None,
+    },
+    'iot': {'use_valid_cert': True}})
+class TestIssuerAcmpca(TestCase):
+    """Unit tests for the ACM PCA issuer lambda function"""
+    def setUp(self):
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        invalidate_registry()
+        acmpca = client('acm-pca')
+        ca = acmpca.create_certificate_authority(
+            CertificateAuthorityConfiguration={ 'KeyAlgorithm': 'RSA_2048',
+                                                'SigningAlgorithm': 'SHA256WITHRSA',
+                                                'Subject': { 'CommonName': 'widgiot-ca' } },
+            CertificateAuthorityType='ROOT')
+        os.environ['ACMPCA_CA_ARN'] = ca['CertificateAuthorityArn']
+        os.environ['CERT_VALIDITY_DAYS'] = '180'
+        os.environ['CERT_SIGNING_ALGO'] = 'SHA256WITHRSA'
+        os.environ['SKUNAME'] = 'widgiot'
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def test_pos_lambda_handler(self):
+        """a csr is issued, registered, and returned with the endpoint"""
+        device_id = str(uuid.uuid4())
+        event = { 'headers': { 'device-csr': base64.b64encode(make_csr(self.key, device_id)) } }
+        response = main.lambda_handler(event, make_context())
+        assert response['statusCode'] == 200
+        assert response['headers']['Content-Type'] == 'application/json'
+        payload = json.loads(response['body'])
+        assert payload['certificate'].startswith('-----BEGIN CERTIFICATE-----')
+        assert payload['endpoint'].endswith('.amazonaws.com')
+        principals = client('iot').list_thing_principals(thingName=device_id)['principals']
+        assert len(principals) == 1
+
+    def test_pos_reissue_returns_recorded_certificate(self):
+        """the same csr again within the window is answered without issuing"""
+        client('dynamodb').create_table(
+            TableName='widgiot-issuance',
+            KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'device-id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST')
+        device_id = str(uuid.uuid4())
+        event = { 'headers': { 'device-csr': base64.b64encode(make_csr(self.key, device_id)) } }
+        with patch.dict(os.environ, { 'ISSUANCE_TABLENAME': 'widgiot-issuance' }):
+            first = json.loads(main.lambda_handler(event, make_context())['body'])
+            with patch.object(main, 'provision_certificate') as provision:
+                again = json.loads(main.lambda_handler(event, make_context())['body'])
+                provision.assert_not_called()
+        assert again == first
+
+    def test_pos_async_two_phase(self):
+        """async mode answers 202 and the worker writes the certificate to s3"""
+        client('s3').create_bucket(Bucket='widgiot-certificates')
+        device_id = str(uuid.uuid4())
+        event = { 'headers': { 'device-csr': base64.b64encode(make_csr(self.key, device_id)) } }
+        env = { 'ASYNC_ISSUANCE': 'true', 'CERTIFICATE_BUCKET': 'widgiot-certificates' }
+        with patch.dict(os.environ, env), patch.object(main, 'dispatch_worker') as dispatch:
+            response = main.lambda_handler(event, make_context())
+            assert response['statusCode'] == 202
+            assert 'widgiot-certificates' in response['headers']['Location']
+            work = dispatch.call_args.args[0]
+            assert main.worker_handler(work, make_context()) == 'ISSUED'
+        stored = client('s3').get_object(Bucket='widgiot-certificates', Key=work['key'])
+        payload = json.loads(stored['Body'].read())
+        assert payload['certificate'].startswith('-----BEGIN CERTIFICATE-----')
+
+    def test_pos_retry_reuses_registered_certificate(self):
+        """registering a certificate again yields the arn already registered"""
+        device_id = str(uuid.uuid4())
+        response = main.provision_certificate(make_csr(self.key, device_id), device_id,
+                                              make_context())
+        first = main.deploy_certificate(response['Certificate'])
+        assert main.deploy_certificate(response['Certificate']) == first
+
+    def test_pos_subject_routing_uses_sku_config(self):
+        """a routed sku is issued by its own ca with its own policy"""
+        ca = client('acm-pca').create_certificate_authority(
+            CertificateAuthorityConfiguration={ 'KeyAlgorithm': 'RSA_2048',
+                                                'SigningAlgorithm': 'SHA256WITHRSA',
+                                                'Subject': { 'CommonName': 'gadgiot-ca' } },
+            CertificateAuthorityType='ROOT')
+        client('s3').create_bucket(Bucket='widgiot-sku-config')
+        client('s3').put_object(Bucket='widgiot-sku-config', Key='sku-config.json',
+                                Body=json.dumps({ 'version': 1, 'skus': { 'gadgiot': {
+                                    'ca_arn': ca['CertificateAuthorityArn'],
+                                    'validity_days': 30,
+                                    'policy_name': 'gadgiot-policy' } } }))
+        device_id = str(uuid.uuid4())
+        builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, 'gadgiot'),
+            x509.NameAttribute(NameOID.COMMON_NAME, device_id)]))
+        csr = builder.sign(self.key, hashes.SHA256()).public_bytes(Encoding.PEM)
+        event = { 'headers': { 'device-csr': base64.b64encode(csr) } }
+        store = SkuConfigStore('widgiot-sku-config', 'sku-config.json')
+        with patch.dict(os.environ, { 'SKU_ROUTING': 'subject' }), \
+             patch.object(sku_utils, 'SKU_CONFIG', store), \
+             patch.object(main, 'SKU_CONFIG', store), \
+             patch.object(main, 'submit_certificate', wraps=main.submit_certificate) as submit:
+            payload = json.loads(main.lambda_handler(event, make_context())['body'])
+        assert payload['certificate'].startswith('-----BEGIN CERTIFICATE-----')
+        assert submit.call_args.args[3].ca_arn == ca['CertificateAuthorityArn']
+        assert client('iot').get_policy(policyName='gadgiot-policy')['policyName']
+
+    def test_neg_unknown_sku_is_refused(self):
+        """a csr naming an unconfigured sku is not issued"""
+        builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, 'nosuchsku'),
+            x509.NameAttribute(NameOID.COMMON_NAME, str(uuid.uuid4()))]))
+        csr = builder.sign(self.key, hashes.SHA256()).public_bytes(Encoding.PEM)
+        event = { 'headers': { 'device-csr': base64.b64encode(csr) } }
+        with patch.dict(os.environ, { 'SKU_ROUTING': 'subject' }), \
+             patch.object(main, 'provision_certificate') as provision:
+            assert main.lambda_handler(event, make_context()) is None
+            provision.assert_not_called()
+
+    def test_pos_wait_for_certificate_retries_in_progress(self):
+        """pending issuance is polled again until the certificate is ready"""
+        acmpca = MagicMock()
+        acmpca.get_certificate.side_effect = [in_progress(), in_progress(),
+                                              { 'Certificate': 'pem' }]
+        certificate, metrics = main.wait_for_certificate(acmpca, 'ca', 'cert', make_context())
+        assert certificate == { 'Certificate': 'pem' }
+        assert metrics.attempts == 3
+
+    def test_neg_wait_for_certificate_other_errors(self):
+        """only RequestInProgressException is retried"""
+        acmpca = MagicMock()
+        acmpca.get_certificate.side_effect = ClientError(
+            { 'Error': { 'Code': 'ResourceNotFoundException', 'Message': 'gone' } },
+            'GetCertificate')
+        with raises(ClientError):
+            main.wait_for_certificate(acmpca, 'ca', 'cert', make_context())
+        assert acmpca.get_certificate.call_count == 1
+
+    def test_neg_wait_for_certificate_deadline(self):
+        """polling gives up when the lambda is out of time"""
+        acmpca = MagicMock()
+        acmpca.get_certificate.side_effect = in_progress()
+        with raises(main.PollTimeout):
+            main.wait_for_certificate(acmpca, 'ca', 'cert', make_context(0))
+
+    def test_pos_short_timeout_still_polls(self):
+        """the margin is capped so a 3s function still waits for the certificate"""
+        acmpca = MagicMock()
+        acmpca.get_certificate.side_effect = [in_progress(), { 'Certificate': 'pem' }]
+        certificate, metrics = main.wait_for_certificate(acmpca, 'ca', 'cert',
+                                                         make_context(3000))
+        assert certificate == { 'Certificate': 'pem' }
+        assert metrics.attempts == 2
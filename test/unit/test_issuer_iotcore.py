@@ -8,6 +8,7 @@ import os
 import io
 import json
 import uuid
+import base64
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
@@ -24,8 +25,27 @@ from cryptography.hazmat.primitives.serialization import Encoding
 from cryptography.x509.oid import NameOID
 from cryptography import x509
 
+from iot_utils import invalidate_registry
+from issuance_utils import authorizer_context
+from src.issuer_iotcore import main
 from src.issuer_iotcore.main import get_cn_attribute
 
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:123456789012:function:secretfree-iotcore'
+
+def make_context():
+    """Lambda context stand-in"""
+    context = MagicMock()
+    context.invoked_function_arn = FUNCTION_ARN
+    context.aws_request_id = str(uuid.uuid4())
+    context.get_remaining_time_in_millis.return_value = 30000
+    return context
+
+def make_csr(key, cn: str) -> bytes:
+    """Build a PEM encoded CSR for the given key and common name"""
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)]))
+    return builder.sign(key, hashes.SHA256()).public_bytes(Encoding.PEM)
+
 @mock_aws(config={
     "core": {
         "mock_credentials": True,
@@ -36,6 +56,9 @@ from src.issuer_iotcore.main import get_cn_attribute
 class TestIssuerIotcore(TestCase):
     """Unit tests for the aws_utils common function module"""
     def setUp(self):
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        invalidate_registry()
+        os.environ['SKUNAME'] = 'widgiot'
         self.rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
         self.ec_key = ec.generate_private_key(curve=ec.SECP384R1())
 
@@ -53,5 +76,73 @@ class TestIssuerIotcore(TestCase):
         """get the cn attr of an rsa derived csr"""
         pass
 
+    def test_pos_lambda_handler(self):
+        """a csr is issued, the thing created, and the certificate returned"""
+        device_id = str(uuid.uuid4())
+        event = { 'headers': { 'device-csr': base64.b64encode(make_csr(self.rsa_key, device_id)) } }
+        response = main.lambda_handler(event, make_context())
+        assert response['statusCode'] == 200
+        assert response['headers']['Content-Type'] == 'application/x-pem-file'
+        assert response['body'].startswith('-----BEGIN CERTIFICATE-----')
+        principals = client('iot').list_thing_principals(thingName=device_id)['principals']
+        assert len(principals) == 1
+
+    def test_pos_lambda_handler_uses_authorizer_context(self):
+        """a verified authorizer context spares the issuer parsing the csr"""
+        device_id = str(uuid.uuid4())
+        csr = make_csr(self.rsa_key, device_id)
+        event = { 'headers': { 'device-csr': base64.b64encode(csr) },
+                  'requestContext': { 'authorizer': authorizer_context(device_id, 'ab', csr) } }
+        with patch.object(main, 'get_cn_attribute') as parse:
+            assert main.lambda_handler(event, make_context())
+            parse.assert_not_called()
+        assert client('iot').describe_thing(thingName=device_id)['thingName'] == device_id
+
+    def test_pos_reissue_returns_recorded_certificate(self):
+        """the same csr again within the window is answered without issuing"""
+        client('dynamodb').create_table(
+            TableName='widgiot-issuance',
+            KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'device-id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST')
+        device_id = str(uuid.uuid4())
+        event = { 'headers': { 'device-csr': base64.b64encode(make_csr(self.rsa_key, device_id)) } }
+        with patch.dict(os.environ, { 'ISSUANCE_TABLENAME': 'widgiot-issuance' }):
+            first = main.lambda_handler(event, make_context())
+            with patch.object(main, 'provision_certificate') as provision:
+                assert main.lambda_handler(event, make_context()) == first
+                provision.assert_not_called()
+        assert len(client('iot').list_certificates()['certificates']) == 1
+
+    def test_pos_async_two_phase(self):
+        """async mode answers 202 and the worker writes the certificate to s3"""
+        client('s3').create_bucket(Bucket='widgiot-certificates')
+        device_id = str(uuid.uuid4())
+        event = { 'headers': { 'device-csr': base64.b64encode(make_csr(self.rsa_key, device_id)) } }
+        env = { 'ASYNC_ISSUANCE': 'true', 'CERTIFICATE_BUCKET': 'widgiot-certificates' }
+        with patch.dict(os.environ, env), patch.object(main, 'dispatch_worker') as dispatch:
+            response = main.lambda_handler(event, make_context())
+            assert response['statusCode'] == 202
+            work = dispatch.call_args.args[0]
+            assert client('iot').list_things()['things'] == []
+            assert main.worker_handler(work, make_context()) == 'ISSUED'
+        stored = client('s3').get_object(Bucket='widgiot-certificates', Key=work['key'])
+        payload = json.loads(stored['Body'].read())
+        assert payload['certificate'].startswith('-----BEGIN CERTIFICATE-----')
+
+    def test_pos_sqs_handler_reports_only_failures(self):
+        """every good record is provisioned and only the bad one is redelivered"""
+        device_ids = [str(uuid.uuid4()) for _ in range(3)]
+        records = [{ 'messageId': device_id,
+                     'body': json.dumps({ 'device-csr': base64.b64encode(
+                         make_csr(self.ec_key, device_id)).decode('ascii') }) }
+                   for device_id in device_ids]
+        records.append({ 'messageId': 'junk', 'body': json.dumps({ 'device-csr': 'junk' }) })
+        response = main.sqs_handler({ 'Records': records }, make_context())
+        assert response == { 'batchItemFailures': [{ 'itemIdentifier': 'junk' }] }
+        for device_id in device_ids:
+            principals = client('iot').list_thing_principals(thingName=device_id)['principals']
+            assert len(principals) == 1
+
     def tearDown(self):
         pass
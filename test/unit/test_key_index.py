@@ -0,0 +1,100 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Key index stream consumer lambda function unit testing
+"""
+import os
+import base64
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from key_utils import spki_fingerprint
+from keyindex_utils import KeyIndex
+from membership_utils import BloomFilter, publish_filter
+from src.key_index import main
+
+BUCKET = 'widgiot-authorizer-index'
+
+def make_record(event_name: str, device_id: str, image: dict = None) -> dict:
+    """A DynamoDB stream record for the provisioning table"""
+    dynamodb = { 'Keys': { 'device-id': { 'S': device_id } } }
+    if image is not None:
+        dynamodb['NewImage'] = dict(image, **dynamodb['Keys'])
+    return { 'eventName': event_name, 'dynamodb': dynamodb }
+
+@mock_aws
+class TestKeyIndex(TestCase):
+    """Unit tests for the key index stream consumer"""
+    def setUp(self):
+        self.s3 = client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.env = patch.dict(os.environ, { 'KEY_INDEX_BUCKET': BUCKET,
+                                            'AWS_DEFAULT_REGION': 'us-east-1' })
+        self.env.start()
+        key = ec.generate_private_key(curve=ec.SECP256R1()).public_key()
+        self.pem = key.public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+        der = key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+        self.fingerprint = spki_fingerprint(der)
+        # Binary attributes arrive base64 encoded in stream events
+        self.der_b64 = base64.b64encode(der).decode('ascii')
+
+    def tearDown(self):
+        self.env.stop()
+
+    def test_pos_stream_batch(self):
+        """inserts and legacy keys are indexed, removals are dropped, junk is skipped"""
+        legacy = { 'pubkey': { 'S': base64.b64encode(self.pem).decode('ascii') } }
+        event = { 'Records': [
+            make_record('INSERT', 'device-1', { 'fingerprint': { 'S': 'ab' * 32 } }),
+            make_record('INSERT', 'device-2', legacy),
+            make_record('INSERT', 'device-3', { 'fingerprint': { 'S': 'cd' * 32 } }),
+            make_record('REMOVE', 'device-3'),
+            make_record('INSERT', 'device-4', { 'pubkey': { 'S': 'junk' } }),
+            make_record('INSERT', 'device-5', { 'pubkey_der': { 'B': self.der_b64 },
+                                                'keytype': { 'S': 'spki' } }),
+        ] }
+        assert main.lambda_handler(event, None)['changes'] == 4
+
+        index = KeyIndex(BUCKET, s3=self.s3, directory=tempfile.mkdtemp())
+        assert index.lookup('device-1') == 'ab' * 32
+        assert index.lookup('device-2') == self.fingerprint
+        assert index.lookup('device-3') is None
+        assert index.lookup('device-4') is None
+        assert index.lookup('device-5') == self.fingerprint
+
+    def test_neg_nothing_to_index(self):
+        """a batch without usable records publishes nothing"""
+        event = { 'Records': [make_record('MODIFY', 'device-1', {})] }
+        assert main.lambda_handler(event, None) == { 'changes': 0 }
+        assert self.s3.list_objects_v2(Bucket=BUCKET)['KeyCount'] == 0
+
+    def test_pos_registrations_join_membership_filter(self):
+        """registered device-ids are added to a published membership filter"""
+        publish_filter(BloomFilter.for_capacity(100), BUCKET, 'membership.bloom', self.s3)
+        event = { 'Records': [
+            make_record('INSERT', 'device-1', { 'fingerprint': { 'S': 'ab' * 32 } }),
+            make_record('INSERT', 'device-2', {}),
+            make_record('REMOVE', 'device-3'),
+        ] }
+        with patch.dict(os.environ, { 'MEMBERSHIP_BUCKET': BUCKET,
+                                      'MEMBERSHIP_KEY': 'membership.bloom' }):
+            assert main.lambda_handler(event, None)['members'] == 2
+        body = self.s3.get_object(Bucket=BUCKET, Key='membership.bloom')['Body'].read()
+        bloom = BloomFilter.from_bytes(body)
+        assert 'device-1' in bloom and 'device-2' in bloom
+        assert 'device-3' not in bloom
+
+    def test_neg_no_membership_filter_yet(self):
+        """without a published filter none is created from a single batch"""
+        event = { 'Records': [make_record('INSERT', 'device-1', {})] }
+        with patch.dict(os.environ, { 'MEMBERSHIP_BUCKET': BUCKET }):
+            assert main.lambda_handler(event, None) == { 'changes': 0 }
+        assert self.s3.list_objects_v2(Bucket=BUCKET)['KeyCount'] == 0
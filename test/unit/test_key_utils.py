@@ -0,0 +1,34 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Public key helper unit testing
+"""
+import hashlib
+from unittest import TestCase
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from key_utils import spki_fingerprint, fingerprints_match
+
+class TestKeyUtils(TestCase):
+    """Unit tests for the public key helpers"""
+    def setUp(self):
+        self.key = ec.generate_private_key(curve=ec.SECP256R1()).public_key()
+        self.der = self.key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+
+    def test_pos_spki_fingerprint(self):
+        """the fingerprint is the sha256 of the der spki"""
+        assert spki_fingerprint(self.der) == hashlib.sha256(self.der).hexdigest()
+
+    def test_pos_fingerprints_match_case_insensitive(self):
+        """hex case does not matter"""
+        fingerprint = spki_fingerprint(self.der)
+        assert fingerprints_match(fingerprint.upper(), fingerprint)
+
+    def test_neg_fingerprints_match(self):
+        """different or missing fingerprints never match"""
+        fingerprint = spki_fingerprint(self.der)
+        assert not fingerprints_match(fingerprint, spki_fingerprint(b'other'))
+        assert not fingerprints_match(None, fingerprint)
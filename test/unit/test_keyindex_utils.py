@@ -0,0 +1,118 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Stream-fed key index unit testing
+"""
+import hashlib
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from pytest import raises
+
+from moto import mock_aws
+from boto3 import client
+
+import keyindex_utils
+from keyindex_utils import (TOMBSTONE, IndexConflict, KeyIndex, SnapshotIndex, index_key,
+                            encode_records, decode_records, publish_changes,
+                            publish_snapshot, read_manifest)
+
+BUCKET = 'widgiot-authorizer-index'
+
+def fingerprint(device_id: str) -> bytes:
+    """Stand-in fingerprint bytes for a device"""
+    return hashlib.sha256(b'key-' + device_id.encode('ascii')).digest()
+
+class FakeClock:
+    """Manually advanced monotonic clock"""
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+class TestSnapshotIndex(TestCase):
+    """Unit tests for the snapshot format"""
+    def test_pos_round_trip_and_search(self):
+        """every record is found by binary search, absent keys are not"""
+        records = { index_key(f'device-{i}'): fingerprint(f'device-{i}') for i in range(100) }
+        data = encode_records(records)
+        assert decode_records(data) == records
+        snapshot = SnapshotIndex(data)
+        assert len(snapshot) == 100
+        for i in range(100):
+            assert snapshot.find(index_key(f'device-{i}')) == fingerprint(f'device-{i}')
+        assert snapshot.find(index_key('other')) is None
+
+    def test_neg_corrupt(self):
+        """truncated or foreign data is rejected"""
+        data = encode_records({ index_key('device-1'): fingerprint('device-1') })
+        with raises(ValueError):
+            SnapshotIndex(data[:-1])
+        with raises(ValueError):
+            decode_records(b'junk' * 8)
+
+@mock_aws
+class TestKeyIndexPublishing(TestCase):
+    """Unit tests for publishing and reading the index"""
+    def setUp(self):
+        self.s3 = client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.clock = FakeClock()
+        self.directory = tempfile.mkdtemp()
+        self.index = KeyIndex(BUCKET, refresh=60, clock=self.clock, s3=self.s3,
+                              directory=self.directory)
+
+    def test_pos_delta_then_compaction(self):
+        """changes go to the delta until it is large enough to compact"""
+        publish_snapshot({ index_key('device-1'): fingerprint('device-1') }, BUCKET, s3=self.s3)
+        manifest = publish_changes({ index_key('device-2'): fingerprint('device-2') },
+                                   BUCKET, compact_at=3, s3=self.s3)
+        assert manifest['records'] == 1
+        assert manifest['delta_records'] == 1
+
+        manifest = publish_changes({ index_key('device-1'): TOMBSTONE,
+                                     index_key('device-3'): fingerprint('device-3') },
+                                   BUCKET, compact_at=3, s3=self.s3)
+        assert manifest['delta'] is None
+        assert manifest['records'] == 2
+        # Superseded objects are removed
+        listed = self.s3.list_objects_v2(Bucket=BUCKET)['Contents']
+        assert len(listed) == 2
+
+    def test_neg_conflict_exhausts_attempts(self):
+        """a manifest that changes on every attempt raises"""
+        with patch.object(keyindex_utils, '_replace_manifest', return_value=False), \
+             raises(IndexConflict):
+            publish_changes({ index_key('device-1'): fingerprint('device-1') },
+                            BUCKET, attempts=2, s3=self.s3)
+        assert read_manifest(self.s3, BUCKET) == ({}, None)
+
+    def test_pos_lookup_snapshot_and_delta(self):
+        """lookups see the mapped snapshot and, after a refresh, the delta"""
+        assert self.index.lookup('device-1') is None
+        publish_snapshot({ index_key('device-1'): fingerprint('device-1') }, BUCKET, s3=self.s3)
+        self.clock.now = 61
+        assert self.index.lookup('device-1') == fingerprint('device-1').hex()
+
+        publish_changes({ index_key('device-1'): TOMBSTONE,
+                          index_key('device-2'): fingerprint('device-2') }, BUCKET, s3=self.s3)
+        assert self.index.lookup('device-2') is None
+        self.clock.now = 122
+        assert self.index.lookup('device-2') == fingerprint('device-2').hex()
+        assert self.index.lookup('device-1') is None
+
+    def test_pos_replaced_snapshot_stays_readable(self):
+        """a lookup still searching the old snapshot is not cut off by a refresh"""
+        publish_snapshot({ index_key('device-1'): fingerprint('device-1') }, BUCKET, s3=self.s3)
+        assert self.index.lookup('device-1') == fingerprint('device-1').hex()
+        held = self.index._snapshot  # pylint: disable=protected-access
+        publish_snapshot({ index_key('device-2'): fingerprint('device-2') }, BUCKET, s3=self.s3)
+        self.clock.now = 61
+        assert self.index.lookup('device-2') == fingerprint('device-2').hex()
+        assert held.find(index_key('device-1')) == fingerprint('device-1')
+
+    def test_neg_disabled(self):
+        """without a bucket nothing is indexed"""
+        assert KeyIndex().lookup('device-1') is None
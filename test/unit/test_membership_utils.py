@@ -0,0 +1,95 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Device-id membership filter unit testing
+"""
+from unittest import TestCase
+
+from pytest import raises
+
+from moto import mock_aws
+from boto3 import client
+
+from membership_utils import BloomFilter, MembershipFilter, publish_filter
+
+BUCKET = 'widgiot-authorizer-index'
+KEY = 'membership/device-ids.bloom'
+
+class FakeClock:
+    """Manually advanced monotonic clock"""
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+class TestBloomFilter(TestCase):
+    """Unit tests for the Bloom filter"""
+    def test_pos_no_false_negatives(self):
+        """every added item is reported as present"""
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'device-{i}')
+        assert all(f'device-{i}' in bloom for i in range(1000))
+
+    def test_pos_false_positive_rate(self):
+        """absent items are rarely reported as present"""
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'device-{i}')
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        assert false_positives < 300
+
+    def test_pos_round_trip(self):
+        """a serialized filter loads back with the same members"""
+        bloom = BloomFilter.for_capacity(10)
+        bloom.add('device-1')
+        loaded = BloomFilter.from_bytes(bloom.to_bytes())
+        assert (loaded.size, loaded.hashes) == (bloom.size, bloom.hashes)
+        assert 'device-1' in loaded
+
+    def test_neg_not_a_filter(self):
+        """arbitrary bytes are rejected"""
+        with raises(ValueError):
+            BloomFilter.from_bytes(b'junk' * 8)
+
+@mock_aws
+class TestMembershipFilter(TestCase):
+    """Unit tests for the published filter view"""
+    def setUp(self):
+        self.s3 = client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.clock = FakeClock()
+        self.membership = MembershipFilter(BUCKET, KEY, refresh=60, clock=self.clock, s3=self.s3)
+
+    def test_pos_refresh(self):
+        """a republished filter is picked up once the refresh interval passes"""
+        bloom = BloomFilter.for_capacity(10)
+        bloom.add('device-1')
+        publish_filter(bloom, BUCKET, KEY, self.s3)
+        assert self.membership.might_contain('device-1')
+        assert not self.membership.might_contain('device-2')
+
+        bloom.add('device-2')
+        publish_filter(bloom, BUCKET, KEY, self.s3)
+        assert not self.membership.might_contain('device-2')
+        self.clock.now = 61
+        assert self.membership.might_contain('device-2')
+
+    def test_pos_miss_is_rechecked(self):
+        """a miss looks for a newer filter once the recheck interval has passed"""
+        membership = MembershipFilter(BUCKET, KEY, refresh=60, recheck=1, clock=self.clock,
+                                      s3=self.s3)
+        bloom = BloomFilter.for_capacity(10)
+        publish_filter(bloom, BUCKET, KEY, self.s3)
+        assert not membership.might_contain('device-1')
+        bloom.add('device-1')
+        publish_filter(bloom, BUCKET, KEY, self.s3)
+        assert not membership.might_contain('device-1')
+        self.clock.now = 1
+        assert membership.might_contain('device-1')
+
+    def test_neg_fails_open(self):
+        """without a filter, or a bucket, every device-id may be registered"""
+        assert self.membership.might_contain('device-1')
+        assert MembershipFilter().might_contain('device-1')
@@ -0,0 +1,118 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Embedded metric instrumentation unit testing
+"""
+import io
+import json
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+import metrics_utils
+from metrics_utils import instrumented, span, run_in_context, annotate
+
+def emitted(stream: io.StringIO) -> dict:
+    """The single EMF document written to stream"""
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    return json.loads(lines[0])
+
+class TestMetricsUtils(TestCase):
+    """Unit tests for the EMF instrumentation"""
+    def setUp(self):
+        metrics_utils._cold_start = True  # pylint: disable=protected-access
+
+    def test_pos_document_structure(self):
+        """spans become Millisecond metrics under the declared dimensions"""
+        @instrumented('test')
+        def handler(event, context):
+            with span('stage'):
+                pass
+            return 'ok'
+
+        stream = io.StringIO()
+        with redirect_stdout(stream):
+            assert handler({}, None) == 'ok'
+        document = emitted(stream)
+        directive = document['_aws']['CloudWatchMetrics'][0]
+        assert directive['Dimensions'] == [metrics_utils.DIMENSIONS]
+        assert { metric['Name'] for metric in directive['Metrics'] } == { 'stage', 'total' }
+        assert document['Handler'] == 'test'
+        assert document['Outcome'] == 'success'
+        assert document['stage'] >= 0
+
+    def test_pos_cold_start_only_first(self):
+        """only the first invocation of the container is a cold start"""
+        @instrumented('test')
+        def handler(event, context):
+            return 'ok'
+
+        flags = []
+        for _ in range(2):
+            stream = io.StringIO()
+            with redirect_stdout(stream):
+                handler({}, None)
+            flags.append(emitted(stream)['ColdStart'])
+        assert flags == ['true', 'false']
+
+    def test_pos_outcomes(self):
+        """None is a failure and the Unauthorized exception is reported as such"""
+        @instrumented('test')
+        def failed(event, context):
+            return None
+
+        @instrumented('test')
+        def denied(event, context):
+            raise Exception('Unauthorized')  # pylint: disable=broad-exception-raised
+
+        stream = io.StringIO()
+        with redirect_stdout(stream):
+            failed({}, None)
+        assert emitted(stream)['Outcome'] == 'failure'
+
+        stream = io.StringIO()
+        with redirect_stdout(stream), self.assertRaises(Exception):
+            denied({}, None)
+        assert emitted(stream)['Outcome'] == 'unauthorized'
+
+    def test_pos_span_from_pool_thread(self):
+        """spans timed on a worker thread land on the invocation's metrics"""
+        def work():
+            with span('pooled'):
+                pass
+
+        @instrumented('test')
+        def handler(event, context):
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                pool.submit(run_in_context(work)).result()
+            return 'ok'
+
+        stream = io.StringIO()
+        with redirect_stdout(stream):
+            handler({}, None)
+        assert 'pooled' in emitted(stream)
+
+    def test_pos_annotation_is_a_property(self):
+        """annotations land on the line without becoming metrics"""
+        @instrumented('test')
+        def handler(event, context):
+            annotate('RejectReason', 'alphabet')
+            return 'ok'
+
+        stream = io.StringIO()
+        with redirect_stdout(stream):
+            handler({}, None)
+        document = emitted(stream)
+        assert document['RejectReason'] == 'alphabet'
+        names = { metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics'] }
+        assert 'RejectReason' not in names
+
+    def test_neg_span_outside_handler(self):
+        """a span with no active invocation is a no-op"""
+        stream = io.StringIO()
+        with redirect_stdout(stream):
+            with span('orphan'):
+                pass
+        assert stream.getvalue() == ''
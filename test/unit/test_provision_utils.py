@@ -0,0 +1,64 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Provisioning core unit testing
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from moto import mock_aws
+from botocore.exceptions import ClientError
+from boto3 import client
+
+from iot_utils import invalidate_registry
+from provision_utils import register_device
+
+REGION = 'us-east-1'
+ACCOUNT = '123456789012'
+
+@mock_aws
+class TestProvisionUtils(TestCase):
+    """Unit tests for the provisioning core"""
+    def setUp(self):
+        invalidate_registry()
+        self.iot = client('iot', region_name=REGION)
+        self.certificate_arn = self.iot.create_keys_and_certificate(
+            setAsActive=True)['certificateArn']
+
+    def test_pos_register_new_device(self):
+        """thing, principal and policy are all in place afterwards"""
+        spy = MagicMock(wraps=self.iot)
+        result = register_device(spy, 'device-1', self.certificate_arn, 'widgiot', REGION, ACCOUNT)
+        assert result.ok
+        assert [step.step for step in result.steps] == ['create_thing',
+                                                        'attach_thing_principal',
+                                                        'attach_policy']
+        spy.describe_thing.assert_not_called()
+        assert self.iot.list_thing_principals(thingName='device-1')['principals'] == \
+            [self.certificate_arn]
+        policies = self.iot.list_attached_policies(target=self.certificate_arn)['policies']
+        assert [policy['policyName'] for policy in policies] == ['widgiot']
+
+    def test_pos_register_existing_thing(self):
+        """a reissue to an existing thing is a success"""
+        self.iot.create_thing(thingName='device-1', attributePayload={
+            'attributes': { 'line': 'a' } })
+        result = register_device(self.iot, 'device-1', self.certificate_arn, 'widgiot',
+                                 REGION, ACCOUNT)
+        assert result.ok
+
+    def test_neg_step_failure_is_reported(self):
+        """a failed step is reported per step rather than raised"""
+        iot = MagicMock(wraps=self.iot)
+        iot.attach_thing_principal.side_effect = ClientError(
+            { 'Error': { 'Code': 'ThrottlingException', 'Message': 'slow down' } },
+            'AttachThingPrincipal')
+        result = register_device(iot, 'device-1', self.certificate_arn, 'widgiot', REGION, ACCOUNT)
+        assert not result.ok
+        failed = [step for step in result.as_dict()['steps'] if not step['ok']]
+        assert failed[0]['step'] == 'attach_thing_principal'
+        assert failed[0]['error_code'] == 'ThrottlingException'
+
+    def tearDown(self):
+        invalidate_registry()
@@ -0,0 +1,187 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Adaptive client-side rate limiter unit testing
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from pytest import raises
+
+from moto import mock_aws
+from botocore.exceptions import ClientError
+from boto3 import client
+
+from retry_utils import Backoff
+from ratelimit_utils import (TokenBucket, AdaptiveLimiter, RateLimits, SharedBudget,
+                             RateLimitTimeout, within_deadline)
+
+class FakeTime:
+    """Clock whose sleep advances it instantly"""
+    def __init__(self):
+        self.now = 1000.0
+    def clock(self):
+        return self.now
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+class ThrottlingService:
+    """Local stand-in for a control-plane API with a per-second quota"""
+    def __init__(self, time_source: FakeTime, quota: int):
+        self.time = time_source
+        self.quota = quota
+        self.calls = {}
+        self.throttled = 0
+
+    def operation(self, **kwargs):
+        """Succeed within the quota, throttle above it"""
+        second = int(self.time.now)
+        self.calls[second] = self.calls.get(second, 0) + 1
+        if self.calls[second] > self.quota:
+            self.throttled += 1
+            raise ClientError({ 'Error': { 'Code': 'ThrottlingException',
+                                           'Message': 'Rate exceeded' } }, 'IssueCertificate')
+        self.time.sleep(0.001)
+        return kwargs
+
+class TestRateLimit(TestCase):
+    """Unit tests for the token buckets and AIMD limiter"""
+    def setUp(self):
+        self.time = FakeTime()
+
+    def test_pos_bucket_paces_calls(self):
+        """after the burst, calls are spaced at the bucket rate"""
+        bucket = TokenBucket(5, burst=1, clock=self.time.clock, sleep=self.time.sleep)
+        for _ in range(11):
+            bucket.acquire()
+        assert abs(self.time.now - 1002.0) < 1e-6
+        assert not bucket.acquire(timeout=0.01)
+
+    def test_pos_aimd(self):
+        """throttles halve the rate, successes win it back up to the ceiling"""
+        limiter = AdaptiveLimiter('CreateThing', 16, clock=self.time.clock, sleep=self.time.sleep)
+        limiter.on_throttle()
+        limiter.on_throttle()
+        assert limiter.rate == 4
+        for _ in range(1000):
+            limiter.on_success()
+        assert limiter.rate == 16
+
+    def test_pos_sustains_quota_without_storm(self):
+        """calls against a lower real quota settle near it with few throttles"""
+        service = ThrottlingService(self.time, quota=10)
+        limits = RateLimits(max_attempts=5, backoff=Backoff(rng=lambda: 0.5),
+                            clock=self.time.clock, sleep=self.time.sleep)
+        for i in range(300):
+            assert limits.call('IssueCertificate', service.operation, n=i) == { 'n': i }
+        elapsed = self.time.now - 1000.0
+        assert 300 / elapsed > 5
+        assert service.throttled < 30
+
+    def test_pos_budget_limit_is_the_quota(self):
+        """a throttled instance still shares the budget at the account quota"""
+        budget = MagicMock()
+        limiter = AdaptiveLimiter('IssueCertificate', 25.0, budget=budget,
+                                  clock=self.time.clock, sleep=self.time.sleep)
+        limiter.on_throttle()
+        limiter.acquire()
+        budget.acquire.assert_called_once_with('IssueCertificate', 25.0, timeout=None)
+
+    def test_neg_errors_propagate(self):
+        """other errors are not retried, persistent throttles give up"""
+        limits = RateLimits(max_attempts=3, backoff=Backoff(rng=lambda: 0.0),
+                            clock=self.time.clock, sleep=self.time.sleep)
+        calls = []
+        def invalid():
+            calls.append(1)
+            raise ClientError({ 'Error': { 'Code': 'InvalidRequestException',
+                                           'Message': 'bad' } }, 'IssueCertificate')
+        with raises(ClientError):
+            limits.call('IssueCertificate', invalid)
+        assert len(calls) == 1
+
+        service = ThrottlingService(self.time, quota=0)
+        with raises(ClientError):
+            limits.call('CreateThing', service.operation)
+        assert service.throttled == 3
+
+    def test_pos_service_errors_retried(self):
+        """5xx responses are retried without lowering the rate"""
+        limits = RateLimits(max_attempts=3, backoff=Backoff(rng=lambda: 0.0),
+                            clock=self.time.clock, sleep=self.time.sleep)
+        calls = []
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ClientError({ 'Error': { 'Code': 'InternalFailure', 'Message': 'oops' },
+                                    'ResponseMetadata': { 'HTTPStatusCode': 500 } },
+                                  'CreateThing')
+            return 'ok'
+        assert limits.call('CreateThing', flaky) == 'ok'
+        assert len(calls) == 3
+        assert limits.limiter('CreateThing').throttles == 0
+
+    def test_neg_wait_is_bounded(self):
+        """a call that would wait longer than max_wait is refused as a throttle"""
+        limits = RateLimits(max_wait=0.5, clock=self.time.clock, sleep=self.time.sleep)
+        limiter = limits.limiter('CreateThing')
+        limiter.bucket.set_rate(1.0)
+        limiter.bucket.drain()
+        calls = []
+        with raises(RateLimitTimeout) as error:
+            limits.call('CreateThing', calls.append, 1)
+        assert error.value.response['Error']['Code'] == 'ThrottlingException'
+        assert isinstance(error.value, ClientError)
+        assert not calls
+        assert self.time.now == 1000.0
+
+    def test_neg_budget_wait_is_bounded(self):
+        """the shared budget gets what is left of the wait"""
+        budget = MagicMock()
+        budget.acquire.return_value = False
+        limiter = AdaptiveLimiter('IssueCertificate', 25.0, budget=budget,
+                                  clock=self.time.clock, sleep=self.time.sleep)
+        assert not limiter.acquire(timeout=2.0)
+        budget.acquire.assert_called_once_with('IssueCertificate', 25.0, timeout=2.0)
+
+    def test_neg_wait_ends_before_deadline(self):
+        """within_deadline caps the waits at the invocation's remaining time"""
+        limits = RateLimits(max_wait=60, clock=self.time.clock, sleep=self.time.sleep)
+        limiter = limits.limiter('CreateThing')
+        limiter.bucket.set_rate(0.1)
+        limiter.bucket.drain()
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 1500
+
+        @within_deadline
+        def handler(event, context):
+            assert limits.wait_limit() <= 0.5
+            return limits.call('CreateThing', dict, **event)
+
+        with raises(RateLimitTimeout):
+            handler({}, context)
+        assert self.time.now == 1000.0
+        assert limits.wait_limit() == 60
+
+@mock_aws
+class TestSharedBudget(TestCase):
+    """Unit tests for the coordinated per-second budget"""
+    def setUp(self):
+        self.ddb = client('dynamodb', region_name='us-east-1')
+        self.ddb.create_table(TableName='widgiot-rate-limits',
+                              KeySchema=[{'AttributeName': 'bucket', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'bucket',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        self.time = FakeTime()
+
+    def test_pos_budget_spills_into_next_second(self):
+        """requests beyond the shared limit wait for the next second"""
+        budget = SharedBudget('widgiot-rate-limits', ddb=self.ddb,
+                              clock=self.time.clock, sleep=self.time.sleep)
+        assert budget.acquire('IssueCertificate', 2)
+        assert budget.acquire('IssueCertificate', 2)
+        assert not budget.acquire('IssueCertificate', 2, timeout=0.5)
+        assert budget.acquire('IssueCertificate', 2)
+        assert self.time.now == 1001.0
@@ -0,0 +1,87 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Membership filter rebuild tool unit testing
+"""
+from unittest import TestCase
+from unittest.mock import patch
+
+from moto import mock_aws
+from boto3 import client
+
+from pytest import raises
+
+from membership_utils import BloomFilter, FilterConflict, add_members
+from src.tools.rebuild_membership import build, rebuild
+
+TABLE_NAME = 'widgiot-iot-provisioning-secretfree'
+BUCKET = 'widgiot-authorizer-index'
+KEY = 'membership/device-ids.bloom'
+
+@mock_aws
+class TestRebuildMembership(TestCase):
+    """Unit tests for the membership filter rebuild"""
+    def setUp(self):
+        self.ddb = client('dynamodb', region_name='us-east-1')
+        self.s3 = client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.ddb.create_table(TableName=TABLE_NAME,
+                              KeySchema=[{'AttributeName': 'device-id', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'device-id',
+                                                     'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+        for i in range(20):
+            self.ddb.put_item(TableName=TABLE_NAME,
+                              Item={ 'device-id': { 'S': f'device-{i}' },
+                                     'fingerprint': { 'S': 'ab' } })
+
+    def test_pos_rebuild(self):
+        """every device-id in the table is in the published filter"""
+        report = rebuild(TABLE_NAME, BUCKET, KEY, segments=3, ddb=self.ddb, s3=self.s3)
+        assert report['devices'] == 20
+        body = self.s3.get_object(Bucket=BUCKET, Key=KEY)['Body'].read()
+        bloom = BloomFilter.from_bytes(body)
+        assert all(f'device-{i}' in bloom for i in range(20))
+
+    def test_pos_dry_run(self):
+        """a dry run publishes nothing"""
+        report = rebuild(TABLE_NAME, BUCKET, KEY, dry_run=True, ddb=self.ddb, s3=self.s3)
+        assert not report['published']
+        assert self.s3.list_objects_v2(Bucket=BUCKET)['KeyCount'] == 0
+
+    def test_pos_stream_additions_survive_rebuild(self):
+        """a filter changed while the table is scanned is rebuilt again"""
+        rebuild(TABLE_NAME, BUCKET, KEY, ddb=self.ddb, s3=self.s3)
+        scans = []
+
+        def add_during_scan(*args):
+            if not scans:
+                self.ddb.put_item(TableName=TABLE_NAME,
+                                  Item={ 'device-id': { 'S': 'late' } })
+                add_members(['late'], BUCKET, KEY, s3=self.s3)
+            scans.append(args)
+            return build(*args)
+
+        with patch('src.tools.rebuild_membership.build', side_effect=add_during_scan):
+            report = rebuild(TABLE_NAME, BUCKET, KEY, ddb=self.ddb, s3=self.s3)
+        assert len(scans) == 2
+        assert report['devices'] == 21
+        body = self.s3.get_object(Bucket=BUCKET, Key=KEY)['Body'].read()
+        assert 'late' in BloomFilter.from_bytes(body)
+
+    def test_neg_filter_keeps_changing(self):
+        """a rebuild that loses every race raises"""
+        rebuild(TABLE_NAME, BUCKET, KEY, ddb=self.ddb, s3=self.s3)
+
+        scans = []
+
+        def add_during_scan(*args):
+            scans.append(args)
+            add_members([f'late-{len(scans)}'], BUCKET, KEY, s3=self.s3)
+            return build(*args)
+
+        with patch('src.tools.rebuild_membership.build', side_effect=add_during_scan), \
+             raises(FilterConflict):
+            rebuild(TABLE_NAME, BUCKET, KEY, attempts=2, ddb=self.ddb, s3=self.s3)
+        assert len(scans) == 2
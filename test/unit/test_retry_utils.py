@@ -0,0 +1,66 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Backoff and polling helper unit testing
+"""
+from unittest import TestCase
+
+from pytest import raises
+
+from retry_utils import Backoff, PollTimeout, poll
+
+class Retryable(Exception):
+    """An error worth retrying"""
+
+class FakeClock:
+    """Clock that only advances when sleep is called"""
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        self.now += seconds
+
+class TestRetryUtils(TestCase):
+    """Unit tests for the backoff and polling helpers"""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backoff = Backoff(base=0.1, cap=1.0, rng=lambda: 1.0)
+
+    def test_pos_backoff_is_capped(self):
+        """delays grow exponentially up to the cap"""
+        assert [self.backoff.delay(n) for n in range(5)] == [0.1, 0.2, 0.4, 0.8, 1.0]
+
+    def test_pos_poll_until_ready(self):
+        """retryable failures are retried and counted"""
+        results = iter([Retryable(), Retryable(), 'done'])
+        def operation():
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        result, metrics = poll(operation, lambda e: isinstance(e, Retryable), deadline=10,
+                               backoff=self.backoff, first_delay=0.05,
+                               sleep=self.clock.sleep, clock=self.clock)
+        assert result == 'done'
+        assert metrics.attempts == 3
+        assert abs(metrics.waited - 0.35) < 1e-9
+
+    def test_neg_poll_deadline(self):
+        """polling stops at the deadline"""
+        def operation():
+            raise Retryable()
+        with raises(PollTimeout) as error:
+            poll(operation, lambda e: isinstance(e, Retryable), deadline=2,
+                 backoff=self.backoff, sleep=self.clock.sleep, clock=self.clock)
+        assert self.clock.now <= 2
+        assert error.value.metrics.attempts > 1
+
+    def test_neg_poll_not_retryable(self):
+        """errors that are not retryable propagate immediately"""
+        def operation():
+            raise ValueError()
+        with raises(ValueError):
+            poll(operation, lambda e: isinstance(e, Retryable), deadline=10,
+                 sleep=self.clock.sleep, clock=self.clock)
@@ -0,0 +1,142 @@
+"""
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+Per-SKU configuration unit testing
+"""
+import os
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from pytest import raises
+
+from moto import mock_aws
+from boto3 import client
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from cryptography import x509
+
+import sku_utils
+from sku_utils import SkuConfig, SkuConfigStore, UnknownSku
+
+BUCKET = 'widgiot-sku-config'
+KEY = 'sku-config.json'
+
+def make_req(ou: str = None):
+    """A parsed CSR with an optional subject OU"""
+    names = [x509.NameAttribute(NameOID.COMMON_NAME, 'device-1')]
+    if ou is not None:
+        names.append(x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, ou))
+    key = ec.generate_private_key(curve=ec.SECP256R1())
+    builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name(names))
+    return builder.sign(key, hashes.SHA256())
+
+class FakeClock:
+    """Monotonic clock stand-in"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@mock_aws(config={
+    "core": {
+        "mock_credentials": True,
+        "reset_boto3_session": False,
+        "service_whitelist": None,
+    }})
+class TestSkuUtils(TestCase):
+    """Unit tests for SKU configuration and routing"""
+    def setUp(self):
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        self.s3 = client('s3')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.clock = FakeClock()
+        self.store = SkuConfigStore(BUCKET, KEY, refresh=60, clock=self.clock, s3=self.s3)
+
+    def put(self, version: int, skus: dict):
+        """Publish a configuration document"""
+        self.s3.put_object(Bucket=BUCKET, Key=KEY,
+                           Body=json.dumps({ 'version': version, 'skus': skus }))
+
+    def test_pos_environment_is_the_home_sku(self):
+        """without a document the deployment's own settings are used"""
+        env = { 'SKUNAME': 'widgiot', 'CERT_VALIDITY_DAYS': '90', 'ACMPCA_CA_ARN': 'arn:ca' }
+        with patch.dict(os.environ, env):
+            config = SkuConfigStore().get()
+        assert config.name == 'widgiot'
+        assert config.validity_days == 90
+        assert config.ca_arn == 'arn:ca'
+        assert config.policy_name == 'widgiot'
+
+    def test_pos_document_defaults(self):
+        """omitted settings get the conventional table and policy names"""
+        config = SkuConfig.from_document('gadgiot', { 'ca_arn': 'arn:ca' })
+        assert config.table_name == 'gadgiot-iot-provisioning-secretfree'
+        assert config.policy_name == 'gadgiot'
+        assert config.validity_days == 180
+
+    def test_pos_document_is_cached_until_refresh(self):
+        """the document is read once per refresh interval"""
+        self.put(1, { 'gadgiot': { 'validity_days': 30 } })
+        assert self.store.get('gadgiot').validity_days == 30
+        self.put(2, { 'gadgiot': { 'validity_days': 60 } })
+        assert self.store.get('gadgiot').validity_days == 30
+        self.clock.now = 61
+        assert self.store.get('gadgiot').validity_days == 60
+        assert self.store.version == 2
+
+    def test_neg_older_version_is_ignored(self):
+        """a document with a lower version never rolls the configuration back"""
+        self.put(5, { 'gadgiot': { 'validity_days': 30 } })
+        assert self.store.get('gadgiot').validity_days == 30
+        self.put(4, { 'gadgiot': { 'validity_days': 999 } })
+        self.clock.now = 61
+        assert self.store.get('gadgiot').validity_days == 30
+        assert self.store.version == 5
+
+    def test_neg_unknown_and_invalid_names(self):
+        """skus missing from the document or with unsafe names are refused"""
+        self.put(1, { 'gadgiot': {} })
+        with raises(UnknownSku):
+            self.store.get('nosuchsku')
+        with raises(UnknownSku):
+            self.store.get('../gadgiot')
+
+    def test_pos_load_failure_keeps_last_good(self):
+        """an unreadable document leaves the loaded configuration in place"""
+        self.put(1, { 'gadgiot': { 'validity_days': 30 } })
+        assert self.store.get('gadgiot').validity_days == 30
+        self.s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'not json')
+        self.clock.now = 61
+        assert self.store.get('gadgiot').validity_days == 30
+
+    def test_pos_home_sku_without_entry(self):
+        """the deployment's own sku resolves even when the document omits it"""
+        self.put(1, { 'gadgiot': {} })
+        with patch.dict(os.environ, { 'SKUNAME': 'widgiot' }):
+            assert self.store.get('widgiot').name == 'widgiot'
+
+    def test_pos_requested_sku(self):
+        """the routing mode decides where the sku is read from"""
+        event = { 'methodArn': 'arn:aws:execute-api:us-east-1:123456789012:api/dev/POST/gadgiot/new' }
+        with patch.dict(os.environ, { 'SKU_ROUTING': 'subject' }):
+            assert sku_utils.requested_sku(event, make_req('gadgiot')) == 'gadgiot'
+            assert sku_utils.requested_sku(event, make_req()) is None
+        with patch.dict(os.environ, { 'SKU_ROUTING': 'path' }):
+            assert sku_utils.requested_sku(event) == 'gadgiot'
+            assert sku_utils.requested_sku({ 'pathParameters': { 'sku': 'other' } }) == 'other'
+            assert sku_utils.requested_sku({ 'methodArn': event['methodArn'].replace(
+                'gadgiot/new', 'new') }) is None
+        with patch.dict(os.environ, { 'SKU_ROUTING': '' }):
+            assert sku_utils.requested_sku(event, make_req('gadgiot')) is None
+
+    def test_neg_routing_without_sku(self):
+        """with routing on a request naming no sku is refused"""
+        with patch.dict(os.environ, { 'SKU_ROUTING': 'subject' }), \
+             patch.object(sku_utils, 'SKU_CONFIG', self.store):
+            with raises(UnknownSku):
+                sku_utils.sku_config({}, make_req())